@@ -0,0 +1,40 @@
+"""
+Benchmarks of the Machine command path against a local :class:`DuetEmulator`.
+
+Run them with ``tox -e bench``. Each run is saved under ``.benchmarks/``, named after the
+commit it was run on, and compared with the previous run; a mean more than 20% slower
+fails the run. The first run, with no previous run to compare with, only saves. Keep ``.benchmarks/`` (e.g. in a CI cache) to track performance across
+commits.
+
+The emulator answers without modeling motion time or network latency, so the numbers
+measure the host side of the command path: formatting, transport and reply handling.
+"""
+
+import pytest
+
+from science_jubilee.Machine import Machine
+from science_jubilee.utils.DuetEmulator import DuetEmulator
+
+DECK = "lab_automation_deck_AFL_bolton"
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    session = getattr(config, "_benchmarksession", None)
+    if session is not None and session.compare and not session.compared_mapping:
+        # Nothing saved yet: --benchmark-compare-fail would be a usage error
+        session.compare_fail = []
+
+
+@pytest.fixture(params=["dsf", "standalone"])
+def duet(request):
+    with DuetEmulator(mode=request.param, time_scale=0) as emulator:
+        yield emulator
+
+
+@pytest.fixture
+def machine(duet):
+    m = Machine(address=duet.address, deck_config=DECK)
+    m.home_all()
+    yield m
+    m.disconnect()
@@ -0,0 +1,87 @@
+from science_jubilee.Machine import Machine
+from science_jubilee.tools.Pipette import Pipette
+from science_jubilee.tools.Tool import Tool
+
+MOVES = 50
+
+
+def test_round_trip(benchmark, machine):
+    """One command and its reply."""
+    benchmark(machine.gcode, "M115")
+
+
+def test_move_to_throughput(benchmark, machine):
+    """Moves that each wait for the machine to finish, as protocols send them."""
+
+    def moves():
+        for i in range(MOVES):
+            machine.move_to(x=10 + i % 2, y=20)
+
+    benchmark(moves)
+    benchmark.extra_info["moves_per_second"] = MOVES / benchmark.stats["mean"]
+
+
+def test_connect(benchmark, duet):
+    """Opening a connection and reading the machine state."""
+
+    def connect():
+        Machine(address=duet.address).disconnect()
+
+    benchmark(connect)
+
+
+def test_get_position(benchmark, machine):
+    """The tracked position, as read by most tool operations."""
+    benchmark(machine.get_position)
+
+
+def test_sync_position(benchmark, machine):
+    """Reading the position back from the machine with M114."""
+    benchmark(machine.sync_position)
+
+
+def test_load_tool(benchmark, machine):
+    """Loading a tool, which reads the tool table from the machine."""
+
+    def load():
+        machine.tools.pop(2, None)
+        machine.load_tool(Tool(2, "tool2"))
+
+    benchmark(load)
+
+
+def test_pickup_tool(benchmark, machine):
+    """Picking up a tool and parking it again."""
+    tool = Tool(2, "tool2")
+    machine.load_tool(tool)
+
+    def pickup_and_park():
+        machine.pickup_tool(tool)
+        machine.park_tool()
+
+    benchmark(pickup_and_park)
+
+
+def test_pipette_transfer_96(benchmark, machine):
+    """Distributing from a reservoir to a full 96-well plate, with one tip."""
+    tiprack = machine.load_labware("opentrons_96_tiprack_300ul", 0)
+    plate = machine.load_labware("corning_96_wellplate_360ul_flat", 1)
+    reservoir = machine.load_labware("agilent_1_reservoir_290ml", 2)
+    pipette = Pipette.from_config(1, "P300", "P300_config.json")
+    machine.load_tool(pipette)
+    machine.pickup_tool(pipette)
+    pipette.add_tiprack(tiprack)
+    pipette.trash = reservoir[0]
+
+    def setup():
+        # Each round starts from a full tip rack
+        for tip in tiprack.wells.values():
+            tip.set_has_tip(True)
+            tip.set_clean_tip(True)
+        pipette.add_tiprack(tiprack)
+
+    def transfer():
+        pipette.transfer(50, reservoir[0], list(plate.wells.values()), new_tip="once")
+
+    benchmark.pedantic(transfer, setup=setup, rounds=3)
+    benchmark.extra_info["wells_per_second"] = 96 / benchmark.stats["mean"]
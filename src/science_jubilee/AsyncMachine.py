@@ -0,0 +1,482 @@
+"""Asyncio driver for Jubilee, mirroring the motion API of :class:`Machine`"""
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List, Tuple, Union
+
+import requests
+
+from science_jubilee.decks.Deck import Deck
+from science_jubilee.labware.Labware import Labware, Location, Well
+from science_jubilee.Machine import (
+    MachineStateError,
+    check_relative_move,
+    find_tool_index,
+    plan_travel,
+)
+from science_jubilee.tools.Tool import Tool
+from science_jubilee.utils import GCode
+from science_jubilee.utils.AsyncTransport import AsyncHTTPTransport, maybe_await
+from science_jubilee.utils.MotionState import MotionState, parse_m114
+from science_jubilee.utils.ObjectModel import ObjectModelCache
+from science_jubilee.utils.Retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMachine:
+    """An asyncio client for Jubilee, so that motion can overlap with instrument I/O on one event loop.
+
+    The commands are formatted by :mod:`science_jubilee.utils.GCode`, exactly as :class:`Machine`
+    sends them, and positions and the object model are tracked the same way. Commands are sent one
+    request at a time, in the order they were awaited; coroutines that do not talk to the machine
+    (e.g. waiting on a camera or syringe server) run in the meantime.
+
+    Use it as an async context manager, which connects on entry and closes the connection on exit::
+
+        async with AsyncMachine(address="192.168.1.2") as m:
+            await m.home_all()
+            await m.move_to(x=100, y=100)
+
+    :param address: The IP address of the machine, defaults to None
+    :type address: str, optional
+    :param deck_config: The name of the deck configuration file to load, defaults to None
+    :type deck_config: str, optional
+    :param simulated: Whether to simulate the machine, defaults to False
+    :type simulated: bool, optional
+    :param transport: The transport to the controller, defaults to an :class:`AsyncHTTPTransport` to `address`
+    :type transport: :class:`AsyncHTTPTransport`, optional
+    :param defer_sync: Whether moves return as soon as they are queued, see :meth:`Machine.deferred_sync`. Defaults to False
+    :type defer_sync: bool, optional
+    """
+
+    BATCH_MARKER = GCode.BATCH_MARKER
+
+    def __init__(
+        self,
+        address: str = None,
+        deck_config: str = None,
+        simulated: bool = False,
+        transport=None,
+        defer_sync: bool = False,
+    ):
+        self.address = address
+        self.simulated = simulated
+        self.defer_sync = defer_sync
+        self.transport = transport or AsyncHTTPTransport(address)
+        self.deck = None
+        self.tools = {}
+        self.tool = None
+        self.axes_homed = [False] * 4
+        self._active_tool_index = None
+        self._axis_limits = (None, None, None)
+        self.motion_state = MotionState()
+        # Asking again for a reply that did not come back, as Machine.query_retry does
+        self.query_retry = RetryPolicy(
+            attempts=50, first=0.01, maximum=0.25, deadline=10
+        )
+        if self.simulated:
+            self.motion_state.sync({"X": 0, "Y": 0, "Z": 0, "U": 0})
+        # Filled by `model()`, which awaits the reads the cache cannot do itself
+        self.object_model = ObjectModelCache(self._fetch_object_model)
+        self._lock = None  # Created on connect, in the running event loop
+
+        if deck_config is not None:
+            self.load_deck(deck_config)
+
+    async def connect(self):
+        """Read the object model and set absolute positioning.
+
+        :raises MachineStateError: If the connection to the machine is unsuccessful.
+        """
+        self._lock = asyncio.Lock()
+        self.motion_state.invalidate()
+        if self.simulated:
+            return
+        try:
+            await self.refresh_model()
+        except (requests.RequestException, ValueError) as e:
+            raise MachineStateError(f"Could not connect to {self.address}: {e}") from e
+        self.axes_homed = [
+            axis["homed"] for axis in self.object_model.get("move")["axes"]
+        ][:4]
+        self._axis_limits = [
+            (axis["min"], axis["max"]) for axis in self.object_model.get("move")["axes"]
+        ]
+        self._read_tool_offsets()
+        self._active_tool_index = None
+        await self.active_tool_index()
+        await self.gcode(GCode.ABSOLUTE_POSITIONING)
+
+    async def close(self):
+        """Close the connection."""
+        await self.transport.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    ##########################################
+    #             OBJECT MODEL
+    ##########################################
+    def _fetch_object_model(self, key: str):
+        if self.simulated:
+            model = {"move": {"axes": []}, "tools": [], "state": {"currentTool": -1}}
+            return model[key] if key else model
+        raise RuntimeError("The object model of an AsyncMachine is read with `model()`")
+
+    async def refresh_model(self):
+        """Read the whole object model in one request."""
+        if not self.simulated:
+            self.object_model.store("", await self.transport.get_model(""))
+
+    async def model(self, section: str):
+        """Return a top-level section of the object model, reading it only if it is not cached.
+
+        :param section: The top-level key of the object model, e.g. ``move``
+        :type section: str
+        :return: The cached value of the section
+        :rtype: Union[dict, list]
+        """
+        if self.simulated:
+            return self._fetch_object_model(section)
+        if not self.object_model.is_current(""):
+            await self.refresh_model()
+        elif not self.object_model.is_current(section):
+            self.object_model.store(section, await self.transport.get_model(section))
+        return self.object_model.get(section)
+
+    def _read_tool_offsets(self):
+        """Copy the tool offsets of the cached object model into the motion state."""
+        for tool_data in self.object_model.get("tools"):
+            if tool_data is None:
+                continue
+            self.motion_state.tool_offsets[tool_data["number"]] = tool_data["offsets"]
+            self.motion_state.tool_extruders[tool_data["number"]] = tool_data.get(
+                "extruders", []
+            )
+
+    async def active_tool_index(self):
+        """Return the index of the current active tool, or -1 if no tool is active.
+
+        :rtype: int
+        """
+        if self._active_tool_index is None:
+            self._set_active_tool(max((await self.model("state"))["currentTool"], -1))
+        return self._active_tool_index
+
+    def _set_active_tool(self, tool_index: int):
+        """Record the current tool, and toggle the old tool off."""
+        if self.tool is not None:
+            self.tool.is_active_tool = False
+        self.motion_state.active_tool = max(tool_index, -1)
+        if tool_index < 0:
+            self._active_tool_index = -1
+            self.tool = None
+            return
+        self._active_tool_index = tool_index
+        if tool_index in self.tools:
+            self.tool = self.tools[tool_index]["tool"]
+            self.tool.is_active_tool = True
+        else:
+            self.tool = None
+
+    ##########################################
+    #                G-CODE
+    ##########################################
+    async def gcode(self, cmd: str = "", timeout=None, response_wait: float = 60):
+        """Send a G-Code command to the machine and return the response.
+
+        :param cmd: The G-Code command to send, defaults to ""
+        :type cmd: str, optional
+        :param timeout: The time to wait for a response from the machine, defaults to None
+        :type timeout: float, optional
+        :param response_wait: The time to wait for a response from the machine, defaults to 60
+        :type response_wait: float, optional
+        :return: The response message from the machine
+        :rtype: str
+        """
+        self._track(cmd)
+        return await self._send(cmd, timeout=timeout, response_wait=response_wait)
+
+    async def gcode_many(
+        self, cmds: List[str], timeout=None, response_wait: float = 60
+    ):
+        """Send several G-Code commands in a single request, see :meth:`Machine.gcode_many`.
+
+        :param cmds: The G-Code commands to send, in order
+        :type cmds: List[str]
+        :param timeout: The time to wait for a response from the machine, defaults to None
+        :type timeout: float, optional
+        :param response_wait: The time to wait for all the replies from the machine, defaults to 60
+        :type response_wait: float, optional
+        :return: The reply to each command, in order. A reply is None if it never arrived.
+        :rtype: list
+        """
+        cmds = list(cmds)
+        for cmd in cmds:
+            self._track(cmd)
+        if len(cmds) == 0:
+            return []
+        if len(cmds) == 1:
+            return [
+                await self._send(cmds[0], timeout=timeout, response_wait=response_wait)
+            ]
+        body, until = GCode.batch_request(cmds, self.BATCH_MARKER)
+        response = await self._send(
+            body, timeout=timeout, response_wait=response_wait, until=until
+        )
+        if self.simulated:
+            return [None] * len(cmds)
+        return GCode.split_batch_reply(response, len(cmds), self.BATCH_MARKER)
+
+    def _track(self, cmd: str):
+        self.motion_state.update(cmd)
+        self.object_model.update(cmd)
+
+    async def _send(
+        self, cmd: str, timeout=None, response_wait: float = 60, until=None
+    ):
+        """Send a command (or a newline-separated block of commands) to the controller."""
+        if self.simulated:
+            print(f"sending: {cmd}")
+            return None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # One request at a time, so that commands reach the machine in the order they were awaited
+        async with self._lock:
+            response = await self.transport.send_code(
+                cmd, timeout=timeout, response_wait=response_wait, until=until
+            )
+            self.object_model.settle()
+        if response is not None and "Error" in response:
+            self.motion_state.invalidate()
+        return response
+
+    ##########################################
+    #                MOTION
+    ##########################################
+    async def _require_homed(self):
+        """Raise :class:`MachineStateError` unless all axes are homed, see :func:`machine_homed`."""
+        if self.simulated or (self.axes_homed and all(self.axes_homed)):
+            return
+        self.object_model.invalidate("move")
+        self.axes_homed = [axis["homed"] for axis in (await self.model("move"))["axes"]]
+        if not all(self.axes_homed):
+            raise MachineStateError("Error: machine must first be homed.")
+
+    async def home_all(self):
+        """Home all axes."""
+        if await self.active_tool_index() != -1:
+            await self.park_tool()
+        await self.gcode_many([GCode.home(), GCode.ABSOLUTE_POSITIONING])
+        self.axes_homed = [True, True, True, True]
+
+    async def move_to(
+        self,
+        x: float = None,
+        y: float = None,
+        z: float = None,
+        e: float = None,
+        v: float = None,
+        s: float = 6000,
+        param: str = None,
+        wait: bool = None,
+    ):
+        """Move to an absolute X/Y/Z/E/V position, see :meth:`Machine.move_to`.
+
+        :param wait: Whether to return only once the move has finished, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
+        """
+        await self._require_homed()
+        cmds = [
+            GCode.ABSOLUTE_POSITIONING,
+            GCode.move(x=x, y=y, z=z, e=e, v=v, s=s, param=param),
+        ]
+        if wait or (wait is None and not self.defer_sync):
+            cmds.append(GCode.WAIT_FOR_MOVES)
+        await self.gcode_many(cmds)
+
+    async def move(
+        self,
+        dx: float = 0,
+        dy: float = 0,
+        dz: float = 0,
+        de: float = 0,
+        dv: float = 0,
+        s: float = 6000,
+        param: str = None,
+        wait: bool = None,
+    ):
+        """Move relative to the current position, see :meth:`Machine.move`.
+
+        :raises MachineStateError: If the move would exceed the axis limits
+        """
+        if any(self._axis_limits):
+            check_relative_move(
+                self._axis_limits, await self.get_position(), dx, dy, dz
+            )
+        await self._require_homed()
+        cmds = [
+            GCode.RELATIVE_POSITIONING,
+            GCode.move(x=dx, y=dy, z=dz, e=de, v=dv, s=s, param=param),
+        ]
+        if wait or (wait is None and not self.defer_sync):
+            cmds.append(GCode.WAIT_FOR_MOVES)
+        await self.gcode_many(cmds)
+
+    async def sync(self):
+        """Wait until every move sent so far has finished, see :meth:`Machine.sync`."""
+        if self.motion_state.moves_pending:
+            await self.gcode(GCode.WAIT_FOR_MOVES)
+
+    @asynccontextmanager
+    async def deferred_sync(self):
+        """Let moves inside an `async with` block return once queued, see :meth:`Machine.deferred_sync`."""
+        previous, self.defer_sync = self.defer_sync, True
+        try:
+            yield
+        finally:
+            self.defer_sync = previous
+        if not previous:
+            await self.sync()
+
+    async def dwell(self, t: float, millis: bool = True):
+        """Pause the machine for a period of time, see :meth:`Machine.dwell`."""
+        await self.gcode(GCode.dwell(t, millis=millis))
+
+    async def set_tool_offset(self, tool_idx: int, x=None, y=None, z=None):
+        """Set the offsets of a tool, see :meth:`Machine.set_tool_offset`."""
+        await self.gcode(GCode.tool_offset(tool_idx, x=x, y=y, z=z))
+
+    async def safe_z_movement(self):
+        """Move the Z axis to a safe height to avoid crashing into labware."""
+        safe_z = self.deck.safe_z if self.deck else 0
+        if float((await self.get_position())["Z"]) < safe_z:
+            await self.move_to(z=safe_z + 20)
+
+    async def travel_to(
+        self,
+        location: Union[Well, Tuple, Location] = None,
+        x: float = None,
+        y: float = None,
+        z: float = None,
+        clearance: float = None,
+        s: float = 6000,
+        wait: bool = None,
+    ):
+        """Move to a well or point, clearing the labware on the deck, in as few moves as possible, see :meth:`Machine.travel_to`."""
+        await self._require_homed()
+        if location is not None:
+            lx, ly, lz = Labware._getxyz(location)
+            x = lx if x is None else x
+            y = ly if y is None else y
+            z = lz if z is None else z
+        if clearance is None:
+            clearance = self.deck.safe_z if self.deck else 0
+        moves = plan_travel(
+            await self.get_position(), x=x, y=y, z=z, clearance=clearance
+        )
+        cmds = [GCode.ABSOLUTE_POSITIONING]
+        cmds += [GCode.move(**move, s=s) for move in moves]
+        if wait or (wait is None and not self.defer_sync):
+            cmds.append(GCode.WAIT_FOR_MOVES)
+        await self.gcode_many(cmds)
+
+    async def get_position(self):
+        """Get the current position of the machine control point in mm, see :meth:`Machine.get_position`.
+
+        :return: A dictionary of the machine control point in mm. The keys are the axis name, e.g. 'X'
+        :rtype: dict
+        """
+        if self.motion_state.valid or self.simulated:
+            return self.motion_state.as_dict()
+        return await self.sync_position()
+
+    async def sync_position(self):
+        """Read the current position back from the machine with `M114` and reset the tracked position.
+
+        :return: A dictionary of the machine control point in mm. The keys are the axis name, e.g. 'X'
+        :rtype: dict
+        """
+        if self.simulated:
+            return self.motion_state.as_dict()
+        # The position is only final once the queued moves have finished
+        await self.sync()
+
+        async def read_position():
+            resp = await self._send(GCode.GET_POSITION)
+            if resp is None or "Count" not in resp:
+                raise MachineStateError(f"Unexpected reply to M114: {resp!r}")
+            return resp
+
+        resp = await self.query_retry.acall(
+            read_position, retry_on=(MachineStateError,)
+        )
+        positions = parse_m114(resp)
+        self.motion_state.sync(positions)
+        return positions
+
+    ##########################################
+    #                TOOLS
+    ##########################################
+    async def load_tool(self, tool: Tool):
+        """Add a new tool for use on the machine. Awaits its `post_load` if it is a coroutine.
+
+        :param tool: The tool to load
+        :type tool: :class:`Tool`
+        """
+        self.tools[tool.index] = {"name": tool.name, "tool": tool}
+        tool._machine = self
+        if tool.index == self._active_tool_index:
+            self._set_active_tool(tool.index)
+        await maybe_await(tool.post_load())
+        if tool.index is not None and not self.simulated:
+            for tool_data in await self.model("tools"):
+                if tool_data is not None and tool_data["number"] == tool.index:
+                    tool.tool_offset = tool_data["offsets"][2]
+
+    async def pickup_tool(self, tool_id: Union[int, str, Tool]):
+        """Pick up the tool specified by a tool index, name or :class:`Tool` object.
+
+        :param tool_id: The tool index, name, or :class:`Tool` object
+        :type tool_id: Union[int, str, Tool]
+        :raises MachineConfigurationError: If the tool is not loaded on the machine.
+        """
+        tool_index = find_tool_index(self.tools, tool_id)
+        await self.safe_z_movement()
+        await self.gcode(GCode.select_tool(tool_index))
+        self._set_active_tool(tool_index)
+
+    async def park_tool(self):
+        """Park the current tool and change the active tool index to `-1`."""
+        await self.safe_z_movement()
+        await self.gcode(GCode.PARK_TOOL)
+        self._set_active_tool(-1)
+
+    ##########################################
+    #                DECK
+    ##########################################
+    def load_deck(
+        self,
+        deck_filename: str,
+        path: str = os.path.join(os.path.dirname(__file__), "decks", "deck_definition"),
+    ):
+        """Load a deck configuration file, see :meth:`Machine.load_deck`."""
+        self.deck = Deck(deck_filename, path=path)
+        return self.deck
+
+    def load_labware(
+        self, labware_filename: str, slot: int, path: str = None, order: str = "rows"
+    ):
+        """Load a labware into a slot of the deck, see :meth:`Machine.load_labware`."""
+        if path is not None:
+            return self.deck.load_labware(
+                labware_filename, slot, path=path, order=order
+            )
+        return self.deck.load_labware(labware_filename, slot, order=order)
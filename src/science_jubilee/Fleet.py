@@ -0,0 +1,367 @@
+"""Driving several Jubilees from one process.
+
+Example::
+
+    from science_jubilee.Fleet import Fleet
+
+    def protocol(m, volume):
+        m.home_all()
+        ...
+
+    with Fleet.connect({"jubilee-1": {"address": "192.168.1.2"},
+                        "jubilee-2": {"address": "192.168.1.3"}}) as fleet:
+        loader = fleet.share(sample_loader, "loader")
+        results = fleet.run(protocol, volume=50)
+        print(fleet.telemetry())
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from science_jubilee.Machine import Machine
+from science_jubilee.tools.Tool import Tool
+from science_jubilee.utils.Tracing import GCODE, Tracer
+
+
+class FleetError(Exception):
+    """Raise this error if a protocol failed on one or more machines.
+
+    :param errors: The exception raised on each machine that failed, by machine name
+    :type errors: dict
+    :param results: The result of each machine that did not fail, by machine name
+    :type results: dict
+    """
+
+    def __init__(self, errors: dict, results: dict):
+        self.errors = errors
+        self.results = results
+        failed = ", ".join(f"{name}: {error!r}" for name, error in errors.items())
+        super().__init__(f"Protocol failed on {len(errors)} machine(s): {failed}")
+
+
+class SharedResource:
+    """A device used by several machines, e.g. a :class:`PneumaticSampleLoader` or a syringe server.
+
+    Machines take turns in the order they asked for the resource, so none of them is starved
+    when it is busy. If the resource is a tool, it is bound to the machine using it for the
+    duration of its turn.
+
+    :param resource: The shared device
+    :type resource: object
+    :param name: The name of the resource, defaults to the class name of `resource`
+    :type name: str, optional
+    :param label: Returns the name recorded in the usage statistics for a holder, defaults to :func:`str`
+    :type label: Callable, optional
+    """
+
+    def __init__(self, resource, name: str = None, label: Callable = str):
+        self.resource = resource
+        self.name = name or type(resource).__name__
+        self.label = label
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()  # (event, holder) in arrival order
+        self.holder = None
+        self._busy = False
+
+        # Statistics
+        self.uses = collections.Counter()  # holder label -> turns taken
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, holder=None, timeout: float = None):
+        """Wait for the resource to be free, behind everyone who asked for it earlier.
+
+        :param holder: The machine (or other user) taking the resource, defaults to None
+        :type holder: :class:`Machine`, optional
+        :param timeout: The time to wait, defaults to None (no limit)
+        :type timeout: float, optional
+        :return: Whether the resource was acquired
+        :rtype: bool
+        """
+        tic = time.perf_counter()
+        event = threading.Event()
+        with self._lock:
+            if not self._busy and not self._waiters:
+                self._busy = True
+                event.set()
+            else:
+                self._waiters.append((event, holder))
+        if not event.wait(timeout):
+            with self._lock:
+                if not event.is_set():
+                    self._waiters.remove((event, holder))
+                    return False
+        waited = time.perf_counter() - tic
+        with self._lock:
+            self.holder = holder
+            self.uses[self.label(holder)] += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        if isinstance(self.resource, Tool) and isinstance(holder, Machine):
+            self.resource._machine = holder
+        return True
+
+    def release(self):
+        """Hand the resource to the next in line, or mark it free."""
+        with self._lock:
+            self.holder = None
+            if self._waiters:
+                event, _ = self._waiters.popleft()
+                event.set()
+            else:
+                self._busy = False
+
+    @contextmanager
+    def use(self, holder=None, timeout: float = None):
+        """Hold the resource for the duration of a `with` block, see :meth:`acquire`.
+
+        :param holder: The machine (or other user) taking the resource, defaults to None
+        :type holder: :class:`Machine`, optional
+        :param timeout: The time to wait, defaults to None (no limit)
+        :type timeout: float, optional
+        :raises TimeoutError: If the resource did not become free in time
+        :return: The shared device
+        """
+        if not self.acquire(holder, timeout=timeout):
+            raise TimeoutError(f"{self.name} was not free within {timeout} s")
+        try:
+            yield self.resource
+        finally:
+            self.release()
+
+    @property
+    def stats(self):
+        """Usage statistics of the resource.
+
+        :return: A dictionary with the number of turns taken by each holder, the total and
+            longest time spent waiting for a turn, and the number of holders waiting now
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "uses": dict(self.uses),
+                "wait_time": self.wait_time,
+                "max_wait": self.max_wait,
+                "waiting": len(self._waiters),
+            }
+
+
+class Fleet:
+    """Runs protocols on several machines at once, one worker thread per machine.
+
+    Each :class:`Machine` spends nearly all of its time waiting on its controller, so the
+    machines progress in parallel from a single process. Every machine is given a
+    :class:`Tracer` (unless it has one) to collect its telemetry.
+
+    :param machines: The machines, by name
+    :type machines: Dict[str, :class:`Machine`]
+    :param max_workers: The number of protocols run at once, defaults to one per machine
+    :type max_workers: int, optional
+    """
+
+    def __init__(self, machines: Dict[str, Machine], max_workers: int = None):
+        self.machines = dict(machines)
+        self.resources = {}
+        for machine in self.machines.values():
+            if machine.tracer is None:
+                machine.tracer = Tracer()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(len(self.machines), 1),
+            thread_name_prefix="fleet",
+        )
+        self._lock = threading.Lock()
+        self._runs = {
+            name: {
+                "state": "idle",
+                "runs": 0,
+                "busy_time": 0.0,
+                "started": None,
+                "finished": None,
+                "error": None,
+            }
+            for name in self.machines
+        }
+
+    @classmethod
+    def connect(cls, configs: Dict[str, dict], max_workers: int = None):
+        """Connect to several machines at once.
+
+        :param configs: The keyword arguments of :class:`Machine` for each machine, by name
+        :type configs: Dict[str, dict]
+        :param max_workers: The number of protocols run at once, defaults to one per machine
+        :type max_workers: int, optional
+        :raises Exception: The first error met connecting to a machine, once the machines that did
+            connect are disconnected again
+        :return: The fleet of connected machines
+        :rtype: :class:`Fleet`
+        """
+        with ThreadPoolExecutor(max_workers=max(len(configs), 1)) as executor:
+            futures = {
+                name: executor.submit(Machine, **config)
+                for name, config in configs.items()
+            }
+        machines = {}
+        errors = []
+        for name, future in futures.items():
+            try:
+                machines[name] = future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            for machine in machines.values():
+                machine.disconnect()
+            raise errors[0]
+        return cls(machines, max_workers=max_workers)
+
+    def __getitem__(self, name: str):
+        return self.machines[name]
+
+    def __iter__(self):
+        return iter(self.machines)
+
+    def __len__(self):
+        return len(self.machines)
+
+    def name_of(self, machine: Machine):
+        """Return the name of a machine of the fleet, or its string representation for anything else."""
+        for name, m in self.machines.items():
+            if m is machine:
+                return name
+        return str(machine)
+
+    def share(self, resource, name: str = None):
+        """Register a device used by several machines of the fleet, see :class:`SharedResource`.
+
+        :param resource: The shared device
+        :type resource: object
+        :param name: The name of the resource, defaults to the class name of `resource`
+        :type name: str, optional
+        :return: The shared resource, whose :meth:`SharedResource.use` gives out turns
+        :rtype: :class:`SharedResource`
+        """
+        shared = SharedResource(resource, name=name, label=self.name_of)
+        self.resources[shared.name] = shared
+        return shared
+
+    def submit(self, name: str, protocol: Callable, *args, **kwargs):
+        """Start a protocol on one machine in the background.
+
+        :param name: The name of the machine
+        :type name: str
+        :param protocol: Called with the machine followed by `args` and `kwargs`
+        :type protocol: Callable
+        :return: The future holding the value returned by the protocol
+        :rtype: :class:`concurrent.futures.Future`
+        """
+        machine = self.machines[name]
+        return self._executor.submit(
+            self._run_one, name, protocol, machine, *args, **kwargs
+        )
+
+    def run(
+        self,
+        protocol: Callable,
+        *args,
+        machines: list = None,
+        per_machine: Dict[str, dict] = None,
+        **kwargs,
+    ):
+        """Run a protocol on several machines at once and wait for all of them to finish.
+
+        A failure on one machine does not stop the others.
+
+        :param protocol: Called with each machine followed by `args` and `kwargs`
+        :type protocol: Callable
+        :param machines: The names of the machines to run on, defaults to all of them
+        :type machines: list, optional
+        :param per_machine: Extra keyword arguments for the protocol of each machine, by name, defaults to None
+        :type per_machine: Dict[str, dict], optional
+        :raises FleetError: If the protocol raised on any machine, once all have finished
+        :return: The value returned by the protocol on each machine, by name
+        :rtype: dict
+        """
+        names = list(self.machines) if machines is None else list(machines)
+        per_machine = per_machine or {}
+        futures = {
+            name: self.submit(
+                name, protocol, *args, **{**kwargs, **per_machine.get(name, {})}
+            )
+            for name in names
+        }
+        results = {}
+        errors = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+        if errors:
+            raise FleetError(errors, results)
+        return results
+
+    def _run_one(
+        self, name: str, protocol: Callable, machine: Machine, *args, **kwargs
+    ):
+        """Run a protocol on one machine, keeping track of its state."""
+        with self._lock:
+            run = self._runs[name]
+            if run["state"] == "running":
+                raise RuntimeError(f"A protocol is already running on {name}")
+            run.update(state="running", started=time.time(), finished=None, error=None)
+        tic = time.perf_counter()
+        try:
+            result = protocol(machine, *args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                run.update(state="failed", error=repr(e))
+            raise
+        else:
+            with self._lock:
+                run["state"] = "done"
+            return result
+        finally:
+            with self._lock:
+                run["runs"] += 1
+                run["busy_time"] += time.perf_counter() - tic
+                run["finished"] = time.time()
+
+    def telemetry(self):
+        """Return the state and statistics of every machine and shared resource.
+
+        :return: A dictionary with, under `machines`, the state of each machine's protocol (idle,
+            running, done or failed), its number of runs, busy time, start and end times and error,
+            the number of commands sent and the time spent waiting on them, and its connection and
+            reply-polling statistics; and under `resources`, the :attr:`SharedResource.stats` of
+            each shared resource.
+        :rtype: dict
+        """
+        machines = {}
+        for name, machine in self.machines.items():
+            with self._lock:
+                telemetry = dict(self._runs[name])
+            commands = machine.tracer.summary(GCODE).values() if machine.tracer else []
+            telemetry["commands"] = sum(c["count"] for c in commands)
+            telemetry["command_time"] = sum(c["total"] for c in commands)
+            telemetry["connection"] = machine.connection_stats
+            telemetry["replies"] = machine.reply_stats
+            machines[name] = telemetry
+        return {
+            "machines": machines,
+            "resources": {name: r.stats for name, r in self.resources.items()},
+        }
+
+    def disconnect(self):
+        """Wait for running protocols to finish and close every connection."""
+        self._executor.shutdown(wait=True)
+        for machine in self.machines.values():
+            machine.disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
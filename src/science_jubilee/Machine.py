@@ -8,15 +8,31 @@ import os
 import re
 import time
 import warnings
+from contextlib import contextmanager
 from functools import wraps
 from pathlib import Path
-from typing import Union
+from typing import List, Tuple, Union
 
+import numpy as np
 import requests  # for issuing commands
-from requests.adapters import HTTPAdapter, Retry
 
 from science_jubilee.decks.Deck import Deck
+from science_jubilee.labware.Labware import Labware, Location, Well
 from science_jubilee.tools.Tool import Tool
+from science_jubilee.utils import GCode
+from science_jubilee.utils.CrashMonitor import CrashMonitor
+from science_jubilee.utils.MotionState import (
+    MOVE_COMMANDS,
+    MotionState,
+    parse_command,
+    parse_m114,
+)
+from science_jubilee.utils.ObjectModel import ModelSubscription, ObjectModelCache
+from science_jubilee.utils.Retry import RetryPolicy
+from science_jubilee.utils.SerialTransport import SerialTransport
+from science_jubilee.utils.Simulator import KinematicSimulator
+from science_jubilee.utils.Tracing import GCODE, Tracer, traced
+from science_jubilee.utils.Transport import HTTPTransport
 
 # TODO: Figure out how to print error messages from the Duet.
 
@@ -50,14 +66,21 @@ class MachineStateError(Exception):
 def machine_homed(func):
     """Decorator used to check if the machine is homed before performing certain actions."""
 
+    @wraps(func)
     def homing_check(self, *args, **kwds):
         # Check the cached value if one exists.
         if self.simulated:
             return func(self, *args, **kwds)
         if self.axes_homed and all(self.axes_homed):
             return func(self, *args, **kwds)
-        # Request homing status from the object model if not known.
-        self.axes_homed = json.loads(self.gcode('M409 K"move.axes[].homed"'))["result"]
+        # Request homing status from the object model if not known. Sent right away, even
+        # inside a batch, since the reply is needed here. With a running subscription the
+        # cached object model is already current.
+        if not self.subscribed:
+            self.object_model.invalidate("move")
+        self.axes_homed = [
+            axis["homed"] for axis in self.object_model.get("move")["axes"]
+        ]
         if not all(self.axes_homed):
             raise MachineStateError("Error: machine must first be homed.")
         return func(self, *args, **kwds)
@@ -68,6 +91,7 @@ def machine_homed(func):
 def requires_deck(func):
     """Decorator used ot check if a deck has been configured before performing certain actions."""
 
+    @wraps(func)
     def deck_check(self, *args, **kwds):
         if self.deck is None:
             raise MachineStateError("Error: No deck is set up")
@@ -79,6 +103,7 @@ def requires_deck(func):
 def requires_safe_z(func):
     """Decorator used to ensure the deck is at a safe height before performing certain actions."""
 
+    @wraps(func)
     def z_check(self, *args, **kwds):
         current_z = float(self.get_position()["Z"])
         if self.deck:
@@ -93,6 +118,164 @@ def requires_safe_z(func):
     return z_check
 
 
+##########################################
+#        HELPERS SHARED WITH AsyncMachine
+##########################################
+def check_relative_move(axis_limits, pos, dx: float = 0, dy: float = 0, dz: float = 0):
+    """Check that a relative move stays within the axis limits.
+
+    :param axis_limits: The (min, max) limits of each axis, in XYZ order
+    :type axis_limits: list
+    :param pos: The current position, as returned by :meth:`Machine.get_position`
+    :type pos: dict
+    :raises MachineStateError: If the move would leave the limits of an axis
+    """
+    for axis, limit, delta in zip("XYZ", axis_limits[0:3], (dx, dy, dz)):
+        if not limit or delta == 0:
+            continue
+        target = float(pos[axis]) + delta
+        if target > limit[1] or target < limit[0]:
+            raise MachineStateError(f"Error: Relative move exceeds {axis} axis limit!")
+
+
+def find_tool_index(tools: dict, tool_id: Union[int, str, Tool]):
+    """Return the index of a loaded tool from its index, name or :class:`Tool` object.
+
+    :param tools: The loaded tools, as in :attr:`Machine.tools`
+    :type tools: dict
+    :param tool_id: The tool index, name, or :class:`Tool` object
+    :type tool_id: Union[int, str, Tool]
+    :raises MachineConfigurationError: If the tool is not loaded on the machine.
+    :raises ValueError: If the indicated tool_id is not of type Union[int, str, Tool].
+    :return: The tool index
+    :rtype: int
+    """
+    # Accept either tool index, tool name, or reference to the tool itself
+    if isinstance(tool_id, int):
+        if tool_id in tools:
+            return tool_id
+        raise MachineConfigurationError(
+            f"Error: No tool with index {tool_id} is currently loaded."
+        )
+    elif isinstance(tool_id, str):
+        for loaded_tool_index, loaded_tool in tools.items():
+            if loaded_tool["name"] == tool_id:
+                return loaded_tool_index
+        raise MachineConfigurationError(
+            f"Error: No tool with name {tool_id} is currently loaded."
+        )
+    elif isinstance(tool_id, Tool):
+        for loaded_tool_index, loaded_tool in tools.items():
+            if loaded_tool["tool"] is tool_id:
+                return loaded_tool_index
+        raise MachineConfigurationError(
+            f"Error: No tool of type {tool_id} is currently loaded."
+        )
+    raise ValueError(f"Unknown tool format {type(tool_id)}")
+
+
+# Height above the clearance that the machine retracts to before travelling, as in `safe_z_movement`
+CLEARANCE_MARGIN = 20
+
+
+def plan_travel(
+    pos,
+    x: float = None,
+    y: float = None,
+    z: float = None,
+    clearance: float = 0,
+    margin: float = CLEARANCE_MARGIN,
+):
+    """Plan the fewest moves to a point that keep clear of the labware while travelling in XY.
+
+    XY travel only happens at or above `clearance`; from below it, the machine first retracts
+    to `clearance + margin`. A target above `clearance` is reached in one move from there, and
+    otherwise the travel ends as low as it safely can so that less of the descent is left for
+    the final move. A target straight above or below the current position is reached in one
+    vertical move.
+
+    :param pos: The current position, as returned by :meth:`Machine.get_position`
+    :type pos: dict
+    :param x: The target x position, defaults to None (unchanged)
+    :type x: float, optional
+    :param y: The target y position, defaults to None (unchanged)
+    :type y: float, optional
+    :param z: The target z position, defaults to None (unchanged, at the travel height)
+    :type z: float, optional
+    :param clearance: The lowest Z at which the tool clears the labware, defaults to 0
+    :type clearance: float, optional
+    :param margin: The height above `clearance` to retract to, defaults to :data:`CLEARANCE_MARGIN`
+    :type margin: float, optional
+    :return: The absolute moves to make in order, as dictionaries of the axes that change
+    :rtype: List[dict]
+    """
+    x0, y0, z0 = (float(pos[axis]) for axis in "XYZ")
+    same = lambda a, b: abs(a - b) < 1e-3
+    if (x is None or same(x, x0)) and (y is None or same(y, y0)):
+        return [] if z is None or same(z, z0) else [{"z": z}]
+    xy = {axis: v for axis, v in (("x", x), ("y", y)) if v is not None}
+
+    moves = []
+    if z0 < clearance:
+        z0 = clearance + margin
+        moves.append({"z": z0})
+    if z is None:
+        moves.append(xy)
+    elif z >= clearance:
+        # Clear of the labware all the way, so travel and descend together
+        moves.append({**xy, "z": z})
+    else:
+        # Travel no lower than the retract height, then descend the rest of the way
+        travel_z = min(z0, clearance + margin)
+        moves.append(xy if same(travel_z, z0) else {**xy, "z": travel_z})
+        moves.append({"z": z})
+    return moves
+
+
+def _moves_xy(cmd: str) -> bool:
+    """Whether any line of `cmd` is a move in X or Y."""
+    for line in cmd.split("\n"):
+        name, params = parse_command(line)
+        if name in MOVE_COMMANDS and ("X" in params or "Y" in params):
+            return True
+    return False
+
+
+class GCodeBatch:
+    """Commands queued by :meth:`Machine.batch`, and their replies once the batch has been sent."""
+
+    def __init__(self):
+        self.commands = []
+        self.replies = None
+
+
+class GCodeJob(GCodeBatch):
+    """Commands recorded by :meth:`Machine.record`, to be run on the controller as a file with :meth:`Machine.run_job`.
+
+    :param name: The file name of the job on the SD card, defaults to "science_jubilee_job.g"
+    :type name: str, optional
+    """
+
+    def __init__(self, name: str = "science_jubilee_job.g"):
+        super().__init__()
+        self.name = name
+
+    @property
+    def text(self):
+        """The contents of the job file, one command per line."""
+        lines = [f"; {self.name}, recorded by science_jubilee"] + self.commands
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: str):
+        """Write the job file to a local path, e.g. to inspect it or to run it from the web interface.
+
+        :param path: The path of the file to write
+        :type path: str
+        """
+        with open(path, "w") as f:
+            f.write(self.text)
+
+
 ##########################################
 #             MACHINE CLASS
 ##########################################
@@ -105,6 +288,7 @@ class Machine:
     # where I keyboard interrupted during pipette tip pickup - tip was picked up but offset was not applied, crashing machine on next move. This should not be possible.
 
     LOCALHOST = "192.168.1.2"
+    BATCH_MARKER = GCode.BATCH_MARKER  # echoed after each command of a batch
 
     def __init__(
         self,
@@ -115,6 +299,12 @@ class Machine:
         simulated: bool = False,
         crash_detection: bool = False,
         crash_handler=None,
+        subscribe: bool = False,
+        defer_sync: bool = False,
+        tracer: Tracer = None,
+        simulator: KinematicSimulator = None,
+        retry_policy: RetryPolicy = None,
+        crash_stop: str = "halt",
     ):
         """Initialize the Machine object.
 
@@ -126,19 +316,31 @@ class Machine:
         :type address: str, optional
         :param deck_config: The name of the deck configuration file to load, defaults to None
         :type deck_config: str, optional
-        :param simulated: Whether to simulate the machine, defaults to False
+        :param simulated: Whether to simulate the machine, defaults to False. The time the commands would take is estimated by :attr:`simulator`.
         :type simulated: bool, optional
-        :param crash_detection: Whether to monitor for tool changer crash detection. See science-jubilee docs for more. Default to False (no detection)
+        :param crash_detection: Whether to monitor for tool changer crash detection, see :class:`CrashMonitor`. This starts the object model subscription. See science-jubilee docs for more. Default to False (no detection)
         :type crash_detection: bool
-        :param crash_handler: Function to call when crash is detected. See docs
+        :param crash_handler: Handler run when a crash is detected, e.g. :class:`SlackInputHandler` or a function called with the crash message. See docs
         :type crash_handler: None or function
+        :param subscribe: Whether to keep the object model up to date from a background thread, see :meth:`start_subscription`. Defaults to False
+        :type subscribe: bool, optional
+        :param defer_sync: Whether moves return as soon as they are queued instead of waiting for them to finish, see :meth:`deferred_sync`. Defaults to False
+        :type defer_sync: bool, optional
+        :param tracer: Records the timing of every command sent and the operation it was sent from, see :mod:`science_jubilee.utils.Tracing`. Defaults to None (no tracing)
+        :type tracer: :class:`Tracer`, optional
+        :param simulator: Estimates the run time of a simulated machine, defaults to None (a :class:`KinematicSimulator` with the Jubilee defaults)
+        :type simulator: :class:`KinematicSimulator`, optional
+        :param retry_policy: How failed requests to the machine are retried, see :class:`RetryPolicy`. Defaults to None (retry queries, never resend a motion command that may have arrived, and stop retrying while the machine stays unreachable)
+        :type retry_policy: :class:`RetryPolicy`, optional
+        :param crash_stop: How the machine is stopped when a crash is detected, "halt" (``M112``, then ``M999``) or "pause" (``M25``, only for a job running from the SD card), see :class:`CrashMonitor`. Defaults to "halt"
+        :type crash_stop: str, optional
 
         :raises MachineStateError: If the machine is not in the correct state to perform the requested action. This is a user error, not a machine error.
         :raises MachineConfigurationError: If the machine does nto support the indicated configuration, e.g., a tool index is already in use.
         :raises ValueError: If Jubilee returns an invalid value, e.g., the axis limit queried is not correct or query is unsuccessful.
 
         """
-        if address != self.__class__.LOCALHOST:
+        if port is None and address != self.__class__.LOCALHOST:
             print(
                 "Warning: disconnecting this application from the network will halt connection to Jubilee."
             )
@@ -155,13 +357,24 @@ class Machine:
 
         # self.debug = debug
         self.simulated = simulated
+        self.simulator = None
+        if simulated:
+            self.simulator = simulator or KinematicSimulator()
         self.model_update_timestamp = 0
         self.command_ws = None
         self.wake_time = None  # Next scheduled time that the update thread updates.
+        self._subscribe = subscribe
+        self.subscription = None
+        self.defer_sync = defer_sync
+        self.tracer = tracer
 
-        # crash detection
+        # crash detection, from the object model subscription rather than the command replies
         self.crash_detection = crash_detection
         self.crash_handler = crash_handler
+        self.crash_monitor = None
+        if crash_detection and not simulated:
+            self.crash_monitor = CrashMonitor(self, crash_handler, stop=crash_stop)
+            self._subscribe = True
 
         self._absolute_positioning = True
         self._absolute_extrusion = (
@@ -179,16 +392,41 @@ class Machine:
         # TODO: this is confusingly named
         self.tools = {}  # this is the list of available tools
         self.tool = None  # this is the current active tool
-        self.current_well = None
+        self._current_well = None
+        self._batch = None  # Commands queued by `batch()`
+        # Shadow copy of the axis positions, so that reading them does not cost an M114 round trip
+        self.motion_state = MotionState()
+        if self.simulated:
+            self.motion_state.sync({axis["letter"]: 0 for axis in self.simulator.axes})
 
-        requests_session = requests.Session()
-        retries = Retry(
-            total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]
+        if port is not None and not simulated:
+            # Commands are streamed over USB with line numbers, checksums and `ok` flow control.
+            self.transport = SerialTransport(
+                port, baudrate, line_ending=self.lineEnding
+            )
+            self.ser = self.transport.ser
+            self.session = None
+            self.retry_policy = retry_policy or RetryPolicy()
+        else:
+            # One persistent, pooled connection per controller, shared by the DSF and rr_* paths.
+            self.transport = HTTPTransport(address, retry_policy=retry_policy)
+            self.session = self.transport.session
+            self.retry_policy = self.transport.retry_policy
+        # Each machine has its own retry policies, so their statistics are not shared with other machines
+        # Waiting for a controller that answers but has not finished starting up
+        self.connect_retry = RetryPolicy(
+            attempts=50, first=0.05, maximum=0.5, deadline=10
         )
-
-        requests_session.mount("http://", HTTPAdapter(max_retries=retries))
-        requests_session.headers["Connection"] = "close"
-        self.session = requests_session
+        # Asking again for a reply that did not come back, e.g. to M114
+        self.query_retry = RetryPolicy(
+            attempts=50, first=0.01, maximum=0.25, deadline=10
+        )
+        # Waiting for a controller to come back after a reset
+        self.reconnect_retry = RetryPolicy(
+            attempts=None, first=0.5, factor=1.5, maximum=2.0, deadline=30
+        )
+        # Object model read in one request and kept until a command changes it
+        self.object_model = ObjectModelCache(self._fetch_object_model)
 
         if deck_config is not None:
             self.load_deck(deck_config)
@@ -198,43 +436,45 @@ class Machine:
         self._set_absolute_positioning()  # force=True)
 
     def connect(self):
-        """Connects to Jubilee over http.
+        """Connects to Jubilee over http, or over serial if a `port` was given.
 
         :raises MachineStateError: If the connection to the machine is unsuccessful.
         """
-        # TODO: incorporate serial connection from machine agency version
         if self.simulated:
             return
+        # The machine may have moved while we were not connected.
+        self.motion_state.invalidate()
         # Do the equivalent of a ping to see if the machine is up.
 
         # if self.debug:
         #    print(f"Connecting to {self.address} ...")
+        def read_homed():
+            # Read the whole object model in one request; the properties below are served from it.
+            self.object_model.refresh()
+            homed = [axis["homed"] for axis in self.object_model.get("move")["axes"]]
+            if len(homed) == 0:
+                raise MachineStateError("The machine has not reported its axes yet.")
+            return homed[:4]
+
         try:
             # "Ping" the machine by updating the only cacheable information we care about.
-            # TODO: This should handle a response from self.gcode of 'None' gracefully.
-            max_tries = 50
-            for i in range(max_tries):
-                print(i)
-                response = json.loads(self.gcode('M409 K"move.axes[].homed"'))[
-                    "result"
-                ][:4]
-                print("response in connect: ", response)
-                if len(response) == 0:
-                    continue
-                else:
-                    break
-            self.axes_homed = response
+            # Failed requests were already retried by the transport; this waits for a controller
+            # that answers but is still starting up.
+            self.axes_homed = self.connect_retry.call(
+                read_homed, retry_on=(MachineStateError, json.JSONDecodeError)
+            )
 
             # These data members are tied to @properties of the same name
             # without the '_' prefix.
             # Upon reconnecting, we need to flag that the @property must
             # refresh; otherwise we will retrieve old values that may be invalid.
+            self._configured_axes = None
+            self._configured_tools = None
             self._active_tool_index = None
             self._tool_z_offsets = None
             self._axis_limits = None
 
-            # To save time upon connecting, let's just hit the API on the
-            # first try for all the @properties we care about.
+            # Fill the cached values from the object model fetched above.
             self.configured_axes
             self.active_tool_index
             self.tool_z_offsets
@@ -242,14 +482,19 @@ class Machine:
             # pprint.pprint(json.loads(requests.get("http://127.0.0.1/machine/status").text))
             # TODO: recover absolute/relative from object model instead of enforcing it here.
             self._set_absolute_positioning()
+            if self._subscribe:
+                self.start_subscription()
         except json.decoder.JSONDecodeError as e:
-            print("Response in connect: ", response)
             print("Error in connect: ", e)
             raise MachineStateError("DCS not ready to connect.") from e
-        except requests.exceptions.Timeout as e:
+        except (requests.exceptions.Timeout, TimeoutError) as e:
             raise MachineStateError(
                 "Connection timed out. URL may be invalid, or machine may not be connected to the network."
             ) from e
+        except requests.exceptions.ConnectionError as e:
+            raise MachineStateError(
+                "Could not connect. The machine may be restarting, or not connected to the network."
+            ) from e
         # if self.debug:
         #    print("Connected.")
 
@@ -262,23 +507,10 @@ class Machine:
         :return: A list of configured axes.
         :rtype: list
         """
-        if self._configured_axes is None:  # Starting from a fresh connection
-            try:
-                max_tries = 50
-                for i in range(max_tries):
-                    response = json.loads(self.gcode('M409 K"move.axes[]"'))["result"]
-                    if len(response) == 0:
-                        continue
-                    else:
-                        break
-                self._configured_axes = []
-                for axis in response:
-                    self._configured_axes.append(axis["letter"])
-            except ValueError as e:
-                print("Error occurred trying to read axis limits on each axis!")
-                raise e
-
-        # Return the cached value.
+        # Served from the object model cache, which is refreshed when the axes are reconfigured.
+        self._configured_axes = [
+            axis["letter"] for axis in self.object_model.get("move")["axes"]
+        ]
         return self._configured_axes
 
     @property
@@ -292,23 +524,11 @@ class Machine:
         """
 
         # TODO: Compare this to loaded tools list
-        if self._configured_tools is None:  # Starting from a fresh connection
-            try:
-                max_tries = 50
-                for i in range(max_tries):
-                    response = json.loads(self.gcode('M409 K"tools[]"'))["result"]
-                    if len(response) == 0:
-                        continue
-                    else:
-                        break
-                self._configured_tools = {}
-                for tool in response:
-                    self._configured_tools[tool["number"]] = tool["name"]
-            except ValueError as e:
-                print("Error occurred trying to read axis limits on each axis!")
-                raise e
-
-        # Return the cached value.
+        self._configured_tools = {}
+        for tool in self.object_model.get("tools"):
+            if tool is None:
+                continue
+            self._configured_tools[tool["number"]] = tool["name"]
         return self._configured_tools
 
     @property
@@ -319,28 +539,17 @@ class Machine:
         :rtype: int
         """
 
-        if self._active_tool_index is None:  # Starting from a fresh connection.
-            try:
-                max_tries = 50
-                for i in range(max_tries):
-                    response = self.gcode("T")
-                    if len(response) == 0:
-                        continue
-                    else:
-                        break
-                # On HTTP Interface, we get a string instead of -1 when there are no tools.
-                if response.startswith("No tool"):
-                    # print('active tool prop thinks theres no tool')
-                    return -1
-                # On HTTP Interface, we get a string instead of the tool index.
-                elif response.startswith("Tool"):
-                    # Recover from the string: 'Tool X is selected.'
-                    self.active_tool_index = int(response.split()[1])
-                else:
-                    self.active_tool_index = int(response)
-            except ValueError as e:
-                # print("Error occurred trying to read current tool!")
-                raise e
+        if self.subscribed:
+            # The subscription keeps the object model current, e.g. after a tool change from the web interface.
+            tool_index = max(self.object_model.get("state")["currentTool"], -1)
+            if tool_index != self._active_tool_index:
+                self.active_tool_index = tool_index
+        elif self._active_tool_index is None:  # Starting from a fresh connection.
+            tool_index = self.object_model.get("state")["currentTool"]
+            if tool_index < 0:
+                self.motion_state.active_tool = -1
+                return -1
+            self.active_tool_index = tool_index
         # Return the cached value.
         return self._active_tool_index
 
@@ -350,6 +559,7 @@ class Machine:
         if self.tool is not None:
             self.tool.is_active_tool = False
 
+        self.motion_state.active_tool = max(tool_index, -1)
         if tool_index < 0:
             self._active_tool_index = -1
             self.tool = None
@@ -370,28 +580,19 @@ class Machine:
 
         :return: A list of tool z offsets, in the order of the tool index
         :rtype: list"""
-        # Starting from fresh connection, query from the Duet.
-        # if self._tool_z_offsets is None:
-        try:
-            max_tries = 50
-            for i in range(max_tries):
-                response = json.loads(self.gcode('M409 K"tools"'))["result"]
-                if len(response) == 0:
-                    continue
-                else:
-                    break
-
-            self._tool_z_offsets = {}  # Create a fresh dictionary.
-            for tool_data in response:
-                if tool_data is None:
-                    continue
-                tool_number = tool_data["number"]
-                tool_z_offset = tool_data["offsets"][2]  # Pull Z axis
-                self._tool_z_offsets[tool_number] = tool_z_offset
-        except ValueError as e:
-            print("Error occurred trying to read z offsets of all tools!")
-            raise e
-        # Return the cached value.
+        # Served from the object model cache, which is refreshed after tool offsets change (G10).
+        self._tool_z_offsets = {}  # Create a fresh dictionary.
+        for tool_data in self.object_model.get("tools"):
+            if tool_data is None:
+                continue
+            tool_number = tool_data["number"]
+            tool_z_offset = tool_data["offsets"][2]  # Pull Z axis
+            self._tool_z_offsets[tool_number] = tool_z_offset
+            # Lets the position tracking follow extrusion moves and offset changes
+            self.motion_state.tool_offsets[tool_number] = tool_data["offsets"]
+            self.motion_state.tool_extruders[tool_number] = tool_data.get(
+                "extruders", []
+            )
         return self._tool_z_offsets
 
     @property
@@ -403,28 +604,19 @@ class Machine:
 
         Note: This list is obtained directly from the tools added to the machine's `config.g` file.
         """
-        # Starting from fresh connection, query from the Duet.
-        if self._axis_limits is None:
-            try:
-                max_tries = 50
-                for i in range(max_tries):
-                    response = json.loads(self.gcode('M409 K"move.axes"'))["result"]
-                    if len(response) == 0:
-                        continue
-                    else:
-                        break
-                # pprint.pprint(response)
-                self._axis_limits = []  # Create a fresh list.
-                for axis_data in response:
-                    axis_min = axis_data["min"]
-                    axis_max = axis_data["max"]
-                    self._axis_limits.append((axis_min, axis_max))
-            except ValueError as e:
-                print("Error occurred trying to read axis limits on each axis!")
-                raise e
-        # Return the cached value.
+        self._axis_limits = [
+            (axis_data["min"], axis_data["max"])
+            for axis_data in self.object_model.get("move")["axes"]
+        ]
         return self._axis_limits
 
+    def _fetch_object_model(self, key: str):
+        """Read a key of the object model from the machine; used to fill :attr:`object_model`."""
+        if self.simulated:
+            model = self.simulator.object_model()
+            return model[key] if key else model
+        return self.transport.get_model(key)
+
     @property
     def position(self):
         """Returns the current machine control point in mm.
@@ -433,9 +625,8 @@ class Machine:
         :rtype: dict
         """
         # Axes are ordered X, Y, Z, U, E, E0, E1, ... En, where E is a copy of E0.
-        response_chunks = self.gcode("M114").split()
-        positions = [float(a.split(":")[1]) for a in response_chunks[:3]]
-        return positions
+        pos = self.get_position()
+        return [float(pos[axis]) for axis in ("X", "Y", "Z")]
 
     ##########################################
     #                BED PLATE
@@ -470,6 +661,8 @@ class Machine:
     def gcode(self, cmd: str = "", timeout=None, response_wait: float = 60):
         """Send a G-Code command to the Machine and return the response.
 
+        Inside a :meth:`batch` block the command is queued instead of sent, and None is returned.
+
         :param cmd: The G-Code command to send, defaults to ""
         :type cmd: str, optional
         :param timeout: The time to wait for a response from the machine, defaults to None
@@ -480,141 +673,234 @@ class Machine:
         :return: The response message from the machine. If too long, the message might not display in the terminal.
         :rtype: str
         """
-        # print("gcode cmd: ", cmd)
+        self._track(cmd)
+        if self._batch is not None:
+            self._batch.commands.append(cmd)
+            return None
+        return self._send(cmd, timeout=timeout, response_wait=response_wait)
 
-        # TODO: Add serial option for gcode commands from MA
+    def gcode_many(self, cmds: List[str], timeout=None, response_wait: float = 60):
+        """Send several G-Code commands to the Machine in a single request.
+
+        The commands are packed into one multi-line request body (DSF) or one chained `rr_gcode`
+        request (standalone). An `echo` marker is sent after each command so that the combined
+        reply can be split back into one reply per command.
+
+        :param cmds: The G-Code commands to send, in order
+        :type cmds: List[str]
+        :param timeout: The time to wait for a response from the machine, defaults to None
+        :type timeout: float, optional
+        :param response_wait: The time to wait for all the replies from the machine, defaults to 60
+        :type response_wait: float, optional
+        :return: The reply to each command, in order. A reply is None if it never arrived.
+        :rtype: list
+        """
+        cmds = list(cmds)
+        for cmd in cmds:
+            self._track(cmd)
+        if self._batch is not None:
+            self._batch.commands.extend(cmds)
+            return [None] * len(cmds)
+        return self._send_many(cmds, timeout=timeout, response_wait=response_wait)
+
+    def _track(self, cmd: str):
+        """Update the locally tracked machine state with a command about to be sent."""
+        xy = self._tracked_xy()
+        self.motion_state.update(cmd)
+        self.object_model.update(cmd)
+        if self._current_well is None:
+            return
+        # Without a known position, any move naming X or Y counts as leaving the well
+        moved = _moves_xy(cmd) if xy is None else self._tracked_xy() != xy
+        if moved:
+            # The machine left the well assigned by hand
+            self._current_well = None
+
+    def _tracked_xy(self):
+        """The tracked X and Y positions, or None while they are unknown."""
+        if not self.motion_state.valid:
+            return None
+        positions = self.motion_state.positions
+        return positions.get("X"), positions.get("Y")
+
+    def _send_many(self, cmds: List[str], timeout=None, response_wait: float = 60):
+        """Send several commands right away in one request and split the reply per command."""
+        if len(cmds) == 0:
+            return []
+        if len(cmds) == 1:
+            return [self._send(cmds[0], timeout=timeout, response_wait=response_wait)]
+        if self.simulated:
+            for cmd in cmds:
+                print(f"sending: {cmd}")
+            self.simulator.send("\n".join(cmds))
+            return [None] * len(cmds)
+
+        body, until = GCode.batch_request(cmds, self.BATCH_MARKER)
+        response = self._send(
+            body, timeout=timeout, response_wait=response_wait, until=until
+        )
+        return self._split_batch_reply(response, len(cmds))
+
+    def _split_batch_reply(self, response: str, n: int):
+        """Split the combined reply of a :meth:`gcode_many` request at the echo markers."""
+        return GCode.split_batch_reply(response, n, self.BATCH_MARKER)
+
+    @contextmanager
+    def batch(self):
+        """Queue all the commands sent inside a `with` block and send them in one request on exit.
+
+        Commands issued through :meth:`gcode` inside the block return None; the replies are
+        available on the yielded :class:`GCodeBatch` once the block exits. Nested blocks join the
+        outermost batch. If the block raises, the queued commands are discarded and the tracked
+        motion state is restored to what it was before the block.
+
+        :return: The batch collecting the queued commands
+        :rtype: :class:`GCodeBatch`
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        batch = GCodeBatch()
+        self._batch = batch
+        state = self.motion_state.copy()
+        try:
+            yield batch
+        except BaseException:
+            # None of the queued commands reached the controller. Sections of the object model they
+            # marked stale are only read again.
+            self.motion_state.restore(state)
+            raise
+        finally:
+            self._batch = None
+        batch.replies = self._send_many(batch.commands)
+
+    @contextmanager
+    def record(self, name: str = "science_jubilee_job.g"):
+        """Record the commands sent inside a `with` block into a job file instead of sending them.
+
+        Run the recorded job with :meth:`run_job`: the whole sequence is then executed by the
+        controller from its SD card, without a host round trip between moves. Positions read
+        inside the block are predicted from the recorded commands; they cannot be read back from
+        the machine, so the block must not depend on the position after homing or a tool change.
+        Queries that need a reply, such as homing checks, are still sent right away.
+
+        :param name: The file name of the job on the SD card, defaults to "science_jubilee_job.g"
+        :type name: str, optional
+        :raises MachineStateError: If called inside a :meth:`batch` or another recording
+        :return: The job collecting the recorded commands
+        :rtype: :class:`GCodeJob`
+        """
+        if self._batch is not None:
+            raise MachineStateError("Error: cannot record a job inside a batch.")
+        # Positions inside the block are predicted from the current one
+        self.get_position()
+        job = GCodeJob(name)
+        self._batch = job
+        try:
+            yield job
+        finally:
+            self._batch = None
+            # The recorded commands have not run yet
+            self.motion_state.invalidate()
+
+    @property
+    def recording(self):
+        """Whether commands are currently being recorded by :meth:`record`."""
+        return isinstance(self._batch, GCodeJob)
+
+    def _send(self, cmd: str, timeout=None, response_wait: float = 60, until=None):
+        """Send a command (or a newline-separated block of commands) to the controller right away."""
+        if self.crash_monitor is not None and self.crash_monitor.crashed:
+            self.crash_monitor.wait_until_clear()
+        if self.tracer is None:
+            return self._send_code(cmd, timeout, response_wait, until)
+        lines = [line for line in cmd.split("\n") if line.strip()]
+        name = lines[0].split()[0] if len(lines) == 1 else "batch"
+        with self.tracer.span(name, GCODE, cmd=cmd, lines=len(lines)) as span:
+            response = self._send_code(cmd, timeout, response_wait, until)
+            span.attrs.update(
+                path="simulated" if self.simulated else self.transport.mode,
+                polls=0 if self.simulated else self.transport.last_polls,
+                retries=0 if self.simulated else self.transport.last_retries,
+                reply_bytes=len(response or ""),
+            )
+        return response
+
+    def _send_code(self, cmd: str, timeout, response_wait: float, until):
+        """Send a command through the transport and check its reply."""
         if self.simulated:
             print(f"sending: {cmd}")
+            self.simulator.send(cmd)
             return None
 
-        try:
-            # Try sending the command with requests.post
-            response = requests.post(
-                f"http://{self.address}/machine/code", data=f"{cmd}", timeout=timeout
-            ).text
-            if "rejected" in response:
-                raise requests.RequestException
-        except requests.RequestException:
-            # If requests.post fails ( not supported for standalone mode), try sending the command with requests.get
-            try:
-                # Paraphrased from Duet HTTP-requests page:
-                # Client should query `rr_model?key=seqs` and monitor `seqs.reply`. If incremented, the command went through
-                # and the response is available at `rr_reply`.
-                reply_response = self.session.get(
-                    f"http://{self.address}/rr_model?key=seqs"
-                )
+        response = self.transport.send_code(
+            cmd, timeout=timeout, response_wait=response_wait, until=until
+        )
+        # Object model updates requested before this point may predate the command
+        self.object_model.settle()
 
-                logging.debug(
-                    f"MODEL response, status: {reply_response.status_code}, headers:{reply_response.headers}, content:{reply_response.content}"
-                )
+        if response is not None and "Error" in response:
+            # Some of the commands may not have been carried out as tracked
+            self.motion_state.invalidate()
+        if self.crash_monitor is not None and response:
+            # Trigger macros reporting with `echo` or `M118` on standalone boards show up in replies
+            self.crash_monitor.check_reply(response)
 
-                reply_count = reply_response.json()["result"]["reply"]
-                buffer_response = self.session.get(
-                    f"http://{self.address}/rr_gcode?gcode={cmd}", timeout=timeout
-                )
-                logging.debug(
-                    f"GCODE response, status: {buffer_response.status_code}, headers:{buffer_response.headers}, content:{buffer_response.content}"
-                )
-                # wait for a response code to be appended
-                # TODO: Implement retry backoff for managing long-running operations to avoid too many requests error. Right now this is handled by the generic exception catch then sleep. Real fix is some sort of backoff for things running longer than a few seconds.
-                tic = time.time()
-                try_count = 0
-                while True:
-                    try:
-                        new_reply_response = self.session.get(
-                            f"http://{self.address}/rr_model?key=seqs"
-                        )
-
-                        logger.debug(
-                            f"MODEL response, status: {new_reply_response.status_code}, headers:{new_reply_response.headers}, content:{new_reply_response.content}"
-                        )
-                        new_reply_count = new_reply_response.json()["result"]["reply"]
-                        # print('new reply count: ', new_reply_count)
-
-                        if new_reply_count != reply_count:
-                            response = self.session.get(
-                                f"http://{self.address}/rr_reply"
-                            )
-
-                            logger.debug(
-                                f"REPLY response, status: {response.status_code}, headers:{response.headers}, content:{response.content}"
-                            )
-
-                            response = response.text
-
-                            responses = self.split_response_objects(response)
-
-                            if len(responses) > 0:
-                                response = responses[-1]
-                            else:
-                                response = None
-                                # print('response length 0 in gcode')
-
-                            # crash detection monitoring happens here
-                            if self.crash_detection:
-                                if "crash detected" in response:
-                                    logger.error("Jubilee crash detected")
-                                    handler_response = self.crash_handler.handle_crash()
-                            break
-                        elif time.time() - tic > response_wait:
-                            response = None
-                            break
-                        time.sleep(self.delay_time(try_count))
-                        try_count += 1
-                    except Exception as e:
-                        print(f"Connection error ({e}), sleeping 1 second")
-                        logging.debug(f"Error in gcode reply wait loop: {e}")
-                        time.sleep(2)
-                        continue
-
-            except requests.RequestException as e:
-                print(f"Both `requests.post` and `requests.get` requests failed: {e}")
-                response = None
         # TODO: handle this with logging. Also fix so all output goes to logs
         return response
 
     def delay_time(self, n):
+        """Return the delay before retry `n` of a request, see :meth:`RetryPolicy.delay`."""
+        return self.retry_policy.delay(n)
+
+    @property
+    def connection_stats(self):
+        """Return connection-reuse statistics for the controller connection.
+
+        :return: A dictionary with the number of requests sent, TCP connections opened, requests
+            that reused an open connection and the reuse ratio. Over serial: the number of lines
+            sent, resent, and the most lines in flight at once.
+        :rtype: dict
         """
-        Calculate delay time for next request. dumb hard code for now, could be fancy exponential backoff
+        return self.transport.stats
+
+    @property
+    def reply_stats(self):
+        """Return how many times the machine was polled for replies, by kind of command.
+
+        :return: A dictionary mapping each command class ('instant', 'wait', 'long') to the number
+            of commands sent, reply polls made and polls per command.
+        :rtype: dict
         """
-        if n == 0:
-            return 0
-        if n < 10:
-            return 0.1
-        if n < 20:
-            return 0.2
-        if n < 30:
-            return 0.3
-        else:
-            return 1
+        return self.transport.poll_stats
 
     def _set_absolute_positioning(self):
         """Set absolute positioning for all axes except extrusion"""
-        self.gcode("G90")
+        self.gcode(GCode.ABSOLUTE_POSITIONING)
         self._absolute_positioning = True
 
     def _set_relative_positioning(self):
         """Set relative positioning for all axes except extrusion"""
-        self.gcode("G91")
-        self.absolute_positioning = False
+        self.gcode(GCode.RELATIVE_POSITIONING)
+        self._absolute_positioning = False
 
     def _set_absolute_extrusion(self):
         """Set absolute positioning for extrusion"""
-        self.gcode("M82")
+        self.gcode(GCode.ABSOLUTE_EXTRUSION)
         self._absolute_extrusion = True
 
     def _set_relative_extrusion(self):
         """Set relative positioning for extrusion"""
-        self.gcode("M83")
-        self.absolute_extrusion = False
+        self.gcode(GCode.RELATIVE_EXTRUSION)
+        self._absolute_extrusion = False
 
     def push_machine_state(self):
         """Push machine state onto a stack"""
-        self.gcode("M120")
+        self.gcode(GCode.PUSH_STATE)
 
     def pop_machine_state(self):
         """Recover previous machine state"""
-        self.gcode("M121")
+        self.gcode(GCode.POP_STATE)
 
     def download_file(self, filepath: str = None, timeout: float = None):
         """Download a file into a file object. Full machine filepath must be specified.
@@ -628,27 +914,158 @@ class Machine:
         :rtype: file object
         """
         # RRF3 Only
-        file_contents = requests.get(
-            f"http://{self.address}/rr_download?name={filepath}", timeout=timeout
-        )
+        file_contents = self.transport.download(filepath, timeout=timeout)
         return file_contents
 
+    def upload_file(self, filepath: str, contents, timeout: float = None):
+        """Upload a file to the machine's SD card. Full machine filepath must be specified.
+        Example: 0:/gcodes/job.g
+
+        :param filepath: The full filepath of the file to write
+        :type filepath: str
+        :param contents: The file contents
+        :type contents: Union[str, bytes]
+        :param timeout: The time to wait for a response from the machine, defaults to None
+        :type timeout: float, optional
+        """
+        if self.simulated:
+            print(f"uploading: {filepath}")
+            return
+        self.transport.upload(filepath, contents, timeout=timeout)
+
+    @traced
+    def run_job(
+        self,
+        job: GCodeJob,
+        filepath: str = None,
+        wait: bool = True,
+        poll_interval: float = 0.5,
+        on_progress=None,
+        timeout: float = None,
+    ):
+        """Upload a job recorded with :meth:`record` to the SD card and run it with `M32`.
+
+        :param job: The recorded job
+        :type job: :class:`GCodeJob`
+        :param filepath: Where to write the job on the SD card, defaults to ``0:/gcodes/<job name>``
+        :type filepath: str, optional
+        :param wait: Whether to wait for the job to finish, defaults to True
+        :type wait: bool, optional
+        :param poll_interval: Seconds between progress checks, defaults to 0.5
+        :type poll_interval: float, optional
+        :param on_progress: Called with the fraction of the file processed after each check, defaults to None
+        :type on_progress: callable, optional
+        :param timeout: Seconds to wait for the job before raising, defaults to None (no limit)
+        :type timeout: float, optional
+        :raises MachineStateError: If the machine refuses to start the job, or it does not finish in time.
+        """
+        if filepath is None:
+            filepath = f"0:/gcodes/{job.name}"
+        self.upload_file(filepath, job.text)
+        response = self.gcode(f'M32 "{filepath}"')
+        if response is not None and "Error" in response:
+            raise MachineStateError(
+                f"Error: could not start job {filepath}: {response}"
+            )
+        if wait:
+            self.wait_for_job(
+                poll_interval=poll_interval, on_progress=on_progress, timeout=timeout
+            )
+
+    def wait_for_job(
+        self, poll_interval: float = 0.5, on_progress=None, timeout: float = None
+    ):
+        """Wait for the job started by :meth:`run_job` to finish, following it in the object model.
+
+        :param poll_interval: Seconds between progress checks, defaults to 0.5
+        :type poll_interval: float, optional
+        :param on_progress: Called with the fraction of the file processed after each check, defaults to None
+        :type on_progress: callable, optional
+        :param timeout: Seconds to wait before raising, defaults to None (no limit)
+        :type timeout: float, optional
+        :raises MachineStateError: If the job does not finish in time.
+        """
+        if self.simulated:
+            return
+        tic = time.time()
+        while True:
+            self.object_model.invalidate("job", "state")
+            job = self.object_model.get("job")
+            status = self.object_model.get("state")["status"]
+            file_info = job.get("file") or {}
+            if on_progress is not None and file_info.get("size"):
+                on_progress(min(job.get("filePosition", 0) / file_info["size"], 1.0))
+            if not file_info.get("fileName") and status == "idle":
+                break
+            if timeout is not None and time.time() - tic > timeout:
+                raise MachineStateError(
+                    f"Error: job did not finish within {timeout} s (status: {status})."
+                )
+            time.sleep(poll_interval)
+        if on_progress is not None:
+            on_progress(1.0)
+        # The job may have changed anything
+        self.object_model.invalidate()
+        self.motion_state.invalidate()
+
+    def start_subscription(self, interval: float = 0.25):
+        """Keep the object model up to date from a background thread.
+
+        Homing checks and the active tool are then read from memory instead of the machine. The
+        subscription is restarted on reconnect until :meth:`stop_subscription` is called.
+
+        :param interval: Seconds between object model polls when the machine cannot push updates, defaults to 0.25
+        :type interval: float, optional
+        """
+        self._subscribe = True
+        if self.simulated or self.subscribed:
+            return
+        self.subscription = ModelSubscription(
+            self.object_model,
+            self.transport,
+            interval=interval,
+            on_update=self._on_model_update,
+            sections=CrashMonitor.WATCHED_SECTIONS if self.crash_monitor else (),
+        ).start()
+
+    def stop_subscription(self):
+        """Stop the background object model updates started by :meth:`start_subscription`."""
+        self._subscribe = False
+        self._end_subscription()
+
+    def _end_subscription(self):
+        if self.subscription is not None:
+            self.subscription.stop()
+            self.subscription = None
+            self.command_ws = None
+
+    @property
+    def subscribed(self):
+        """Whether a background thread is keeping the object model up to date."""
+        return self.subscription is not None and self.subscription.running
+
+    def _on_model_update(self, delta: dict):
+        """Called from the subscription thread after each object model update."""
+        self.model_update_timestamp = time.time()
+        self.wake_time = self.subscription.wake_time
+        self.command_ws = self.subscription.ws
+        if self.crash_monitor is not None:
+            self.crash_monitor.check(delta)
+
     def reset(self):
         """Issue a software reset."""
         # End the subscribe thread first.
+        self._end_subscription()
         self.gcode("M999")  # Issue a board reset. Assumes we are already connected
         self.axes_homed = [False] * 4
         self.disconnect()
         print("Reconnecting...")
-        for i in range(10):
-            time.sleep(1)
-            try:
-                self.connect()
-                return
-            except MachineStateError as e:
-                pass
-        raise MachineStateError("Reconnecting failed.")
+        try:
+            self.reconnect_retry.call(self.connect, retry_on=(MachineStateError,))
+        except MachineStateError as e:
+            raise MachineStateError("Reconnecting failed.") from e
 
+    @traced
     def home_all(self):
         """Home all axes."""
         # Having a tool is only possible if the machine was already homed.
@@ -657,8 +1074,9 @@ class Machine:
         # TODO: Catch errors where tool is already on and forward to user for fix
         if self.active_tool_index != -1:
             self.park_tool()
-        self.gcode("G28")
-        self._set_absolute_positioning()
+        with self.batch():
+            self.gcode(GCode.home())
+            self._set_absolute_positioning()
         # Update homing state. Do not query the object model because of race condition.
         self.axes_homed = [True, True, True, True]  # X, Y, Z, U
 
@@ -666,12 +1084,13 @@ class Machine:
 
     def home_xyu(self):
         """Home the XYU axes. Home Y before X to prevent possibility of crashing into the tool rack."""
-        self.gcode("G28 Y")
-        self.gcode("G28 X")
-        self.gcode("G28 U")
-        self._set_absolute_positioning()
+        with self.batch():
+            self.gcode("G28 Y")
+            self.gcode("G28 X")
+            self.gcode("G28 U")
+            self._set_absolute_positioning()
         # Update homing state. Pull Z from the object model which will not create a race condition.
-        z_home_status = json.loads(self.gcode('M409 K"move.axes[].homed"'))["result"][2]
+        z_home_status = self.object_model.get("move")["axes"][2]["homed"]
         self.axes_homed = [True, True, z_home_status, True]
 
     def home_x(self):
@@ -722,23 +1141,7 @@ class Machine:
         if tool_idx is None:
             raise MachineConfigurationError("No tool index provided!")
 
-        x = "{0:.2f}".format(x) if x is not None else None
-        y = "{0:.2f}".format(y) if y is not None else None
-        z = "{0:.2f}".format(z) if z is not None else None
-
-        p_cmd = x_cmd = y_cmd = z_cmd = ""
-
-        if tool_idx is not None:
-            p_cmd = f"P{tool_idx}"
-        if x is not None:
-            x_cmd = f"X{x}"
-        if y is not None:
-            y_cmd = f"Y{y}"
-        if z is not None:
-            z_cmd = f"Z{z}"
-
-        cmd = f"G10 {p_cmd} {z_cmd} {x_cmd} {y_cmd}"
-        self.gcode(cmd)
+        self.gcode(GCode.tool_offset(tool_idx, x=x, y=y, z=z))
 
     @machine_homed
     def _move_xyzev(
@@ -750,7 +1153,7 @@ class Machine:
         v: float = None,
         s: float = 6000,
         param: str = None,
-        wait: bool = False,
+        wait: bool = None,
     ):
         """Move X/Y/Z/E/V axes. Set absolute/relative mode externally.
 
@@ -766,37 +1169,14 @@ class Machine:
         :type v: float, optional
         :param s: speed at which to move (default 6000 mm/min)
         :type s: float, optional
+        :param wait: Whether to wait for the move to finish, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
         """
 
-        x = "{0:.2f}".format(x) if x is not None else None
-        y = "{0:.2f}".format(y) if y is not None else None
-        z = "{0:.2f}".format(z) if z is not None else None
-        e = "{0:.2f}".format(e) if e is not None else None
-        v = "{0:.2f}".format(v) if v is not None else None
-        s = "{0:.2f}".format(s)
-
-        # initialize coordinates commands
-        x_cmd = y_cmd = z_cmd = e_cmd = v_cmd = f_cmd = param_cmd = ""
-
-        if x is not None:
-            x_cmd = f"X{x}"
-        if y is not None:
-            y_cmd = f"Y{y}"
-        if z is not None:
-            z_cmd = f"Z{z}"
-        if e is not None:
-            e_cmd = f"E{e}"
-        if v is not None:
-            v_cmd = f"V{v}"
-        if s is not None:
-            f_cmd = f"F{s}"
-        if param is not None:
-            param_cmd = param
-
-        cmd = f"G0 {z_cmd} {x_cmd} {y_cmd} {e_cmd} {v_cmd} {f_cmd} {param_cmd}"
-        self.gcode(cmd)
-        if wait:
-            self.gcode(f"M400")
+        cmds = [GCode.move(x=x, y=y, z=z, e=e, v=v, s=s, param=param)]
+        if wait or (wait is None and not self.defer_sync):
+            cmds.append(GCode.WAIT_FOR_MOVES)
+        self.gcode_many(cmds)
 
     def move_to(
         self,
@@ -807,7 +1187,7 @@ class Machine:
         v: float = None,
         s: float = 6000,
         param: str = None,
-        wait: bool = True,
+        wait: bool = None,
     ):
         """Move to an absolute X/Y/Z/E/V position.
 
@@ -823,11 +1203,14 @@ class Machine:
         :type v: float, optional
         :param s: speed at which to move (default 6000 mm/min)
         :type s: float, optional
+        :param wait: Whether to wait for the move to finish, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
 
         """
-        self._set_absolute_positioning()
-
-        self._move_xyzev(x=x, y=y, z=z, e=e, v=v, s=s, param=param, wait=wait)
+        # G90, the move and the trailing M400 go out in a single request.
+        with self.batch():
+            self._set_absolute_positioning()
+            self._move_xyzev(x=x, y=y, z=z, e=e, v=v, s=s, param=param, wait=wait)
 
     def move(
         self,
@@ -838,7 +1221,7 @@ class Machine:
         dv: float = 0,
         s: float = 6000,
         param: str = None,
-        wait: bool = True,
+        wait: bool = None,
     ):
         """Move relative to the current position
 
@@ -854,42 +1237,126 @@ class Machine:
         :type dv: float, optional
         :param s:  speed at which to move (default 6000 mm/min)
         :type s: float, optional
+        :param wait: Whether to wait for the move to finish, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
         """
         # Check that the relative move doesn't exceed user-defined limit
         # By default, ensure that it won't crash into the parked tools
         if any(self._axis_limits):
-            x_limit, y_limit, z_limit = self._axis_limits[0:3]
-            pos = self.get_position()
-            if (
-                x_limit
-                and dx != 0
-                and (
-                    (float(pos["X"]) + dx > x_limit[1])
-                    or (float(pos["X"]) + dx < x_limit[0])
-                )
-            ):
-                raise MachineStateError("Error: Relative move exceeds X axis limit!")
-            if (
-                y_limit
-                and dy != 0
-                and (
-                    (float(pos["Y"]) + dy > y_limit[1])
-                    or (float(pos["Y"]) + dy < y_limit[0])
-                )
-            ):
-                raise MachineStateError("Error: Relative move exceeds Y axis limit!")
-            if (
-                z_limit
-                and dz != 0
-                and (
-                    (float(pos["Z"]) + dz > z_limit[1])
-                    or (float(pos["Z"]) + dz < z_limit[0])
-                )
-            ):
-                raise MachineStateError("Error: Relative move exceeds Z axis limit!")
-        self._set_relative_positioning()
+            check_relative_move(self._axis_limits, self.get_position(), dx, dy, dz)
+        with self.batch():
+            self._set_relative_positioning()
+            self._move_xyzev(x=dx, y=dy, z=dz, e=de, v=dv, s=s, param=param, wait=wait)
+
+    @traced
+    @machine_homed
+    def stream_path(
+        self,
+        points: np.ndarray,
+        s: float = 6000,
+        e_per_mm: float = None,
+        chunk_size: int = 200,
+        wait: bool = None,
+        response_wait: float = 60,
+    ):
+        """Move through a dense sequence of X/Y/Z points with straight ``G1`` moves.
+
+        The segment lengths, extrusion amounts and commands for the whole path are computed at
+        once, and the commands are sent `chunk_size` at a time. Each chunk is one request (streamed
+        line by line within the flow-control window over serial, and in pieces that fit the input
+        buffer of standalone boards), and the next chunk is only sent once the controller has
+        taken the previous one, so the motion planner stays fed without overflowing. The position
+        is read once, at the start.
+
+        :param points: The positions to move through, an (N, 3) array of X, Y and Z in mm
+        :type points: :class:`numpy.ndarray`
+        :param s: speed at which to move (default 6000 mm/min)
+        :type s: float, optional
+        :param e_per_mm: Extrusion per mm of travel, in relative extrusion mode; defaults to None (no extrusion)
+        :type e_per_mm: float, optional
+        :param chunk_size: The number of commands sent per request, defaults to 200
+        :type chunk_size: int, optional
+        :param wait: Whether to wait for the last move to finish, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
+        :param response_wait: The time to wait for the controller to take each chunk, defaults to 60
+        :type response_wait: float, optional
+        :raises ValueError: If `points` is not an (N, 3) array
+        :raises MachineStateError: If the controller reports an error or does not take a chunk in time
+        """
+        points = np.asarray(points, dtype=float)
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError(
+                f"Error: expected an (N, 3) array of X/Y/Z positions, got shape {points.shape}"
+            )
+        if len(points) == 0:
+            return
+        position = self.get_position()
+        start = np.array([float(position[axis]) for axis in "XYZ"])
+
+        extrusion = None
+        restore_extrusion = e_per_mm is not None and self._absolute_extrusion
+        if e_per_mm is not None:
+            lengths = np.linalg.norm(np.diff(points, axis=0, prepend=[start]), axis=1)
+            extrusion = lengths * e_per_mm
+        cmds = [GCode.ABSOLUTE_POSITIONING]
+        if extrusion is not None:
+            cmds.append(GCode.RELATIVE_EXTRUSION)
+        cmds += GCode.linear_path(points, start=start, s=s, e=extrusion)
+        if restore_extrusion:
+            cmds.append(GCode.ABSOLUTE_EXTRUSION)
+        if wait or (wait is None and not self.defer_sync):
+            cmds.append(GCode.WAIT_FOR_MOVES)
+
+        self._absolute_positioning = True
+        if extrusion is not None and not restore_extrusion:
+            self._absolute_extrusion = False
+        for i in range(0, len(cmds), chunk_size):
+            self._send_chunk(cmds[i : i + chunk_size], response_wait)
+
+    def _send_chunk(self, cmds: List[str], response_wait: float = 60):
+        """Send a block of commands in one request and return once the controller has taken all of them."""
+        block = "\n".join(cmds)
+        if self._batch is not None or self.simulated:
+            self.gcode(block)
+            return
+        self._track(block)
+        marker = f"{self.BATCH_MARKER}end"
+        response = self._send(
+            f'{block}\necho "{marker}"', response_wait=response_wait, until=marker
+        )
+        if response is None or marker not in response:
+            raise MachineStateError(
+                f"Error: the controller did not take {len(cmds)} commands within {response_wait} s"
+            )
+        if "Error" in response:
+            raise MachineStateError(f"Error: {response.strip()}")
+
+    def sync(self):
+        """Wait until every move sent so far has finished, if any were sent without waiting.
+
+        Tools call this before anything that needs the machine to stand still at its target,
+        e.g. reading a sensor, capturing an image, probing for a tip or triggering an external
+        device. Otherwise it costs nothing.
+        """
+        if self.motion_state.moves_pending:
+            self.gcode(GCode.WAIT_FOR_MOVES)
 
-        self._move_xyzev(x=dx, y=dy, z=dz, e=de, v=dv, s=s, param=param, wait=wait)
+    @contextmanager
+    def deferred_sync(self):
+        """Let moves sent inside a `with` block return as soon as the controller has queued them.
+
+        Consecutive moves are then blended by the controller's motion planner instead of each
+        one coming to a full stop; the machine only waits for them where a tool calls
+        :meth:`sync`. All moves have finished once the block exits. Set :attr:`defer_sync` (or
+        pass `defer_sync=True` to the constructor) to work this way all the time.
+        """
+        previous, self.defer_sync = self.defer_sync, True
+        try:
+            yield
+        finally:
+            self.defer_sync = previous
+        if not previous:
+            self.sync()
 
     def dwell(self, t: float, millis: bool = True):
         """Pauses the machine for a period of time.
@@ -900,10 +1367,52 @@ class Machine:
         :type millis: bool, optional
         """
 
-        param = "P" if millis else "S"
-        cmd = f"G4 {param}{t}"
+        self.gcode(GCode.dwell(t, millis=millis))
 
-        self.gcode(cmd)
+    def travel_to(
+        self,
+        location: Union[Well, Tuple, Location] = None,
+        x: float = None,
+        y: float = None,
+        z: float = None,
+        clearance: float = None,
+        s: float = 6000,
+        wait: bool = None,
+    ):
+        """Move to a well or point, clearing the labware on the deck, in as few moves as possible.
+
+        Replaces :meth:`safe_z_movement` followed by XY and Z moves, see :func:`plan_travel`. All
+        the moves are sent in one request and the machine only stops once, at the target.
+
+        :param location: The well or point to move to; `x`, `y` and `z` override its coordinates, defaults to None
+        :type location: Union[:class:`Well`, tuple, :class:`Location`], optional
+        :param x: x position on the bed, defaults to None (unchanged)
+        :type x: float, optional
+        :param y: y position on the bed, defaults to None (unchanged)
+        :type y: float, optional
+        :param z: z position on the bed, defaults to None (unchanged, at the travel height)
+        :type z: float, optional
+        :param clearance: The lowest Z at which the tool clears the labware, defaults to None (the deck's :attr:`safe_z`)
+        :type clearance: float, optional
+        :param s: speed at which to move (default 6000 mm/min)
+        :type s: float, optional
+        :param wait: Whether to wait for the moves to finish, defaults to None (wait unless :attr:`defer_sync` is set)
+        :type wait: bool, optional
+        """
+        if location is not None:
+            lx, ly, lz = Labware._getxyz(location)
+            x = lx if x is None else x
+            y = ly if y is None else y
+            z = lz if z is None else z
+        if clearance is None:
+            clearance = self.deck.safe_z if self.deck else 0
+        moves = plan_travel(self.get_position(), x=x, y=y, z=z, clearance=clearance)
+        with self.batch():
+            self._set_absolute_positioning()
+            for move in moves:
+                self._move_xyzev(**move, s=s, wait=False)
+            if wait or (wait is None and not self.defer_sync):
+                self.gcode(GCode.WAIT_FOR_MOVES)
 
     def safe_z_movement(self):
         """Move the Z axis to a safe height to avoid crashing into labware."""
@@ -981,6 +1490,7 @@ class Machine:
 
     # TODO: Unload tool method
 
+    @traced
     @requires_safe_z
     def pickup_tool(self, tool_id: Union[int, str, Tool]):
         """Pick up the tool specified by a tool index, name or :class:`Tool` object.
@@ -991,82 +1501,94 @@ class Machine:
         :raises ValueError: If the indicated tool_id is not of type Union[int, str, Tool].
         """
         # TODO: Make sure axis limits are checked and not exceeded when picking up pipette
-        if isinstance(
-            tool_id, int
-        ):  # Accept either tool index, tool name, or reference to the tool itself
-            if tool_id in self.tools:
-                tool_index = tool_id
-            else:
-                raise MachineConfigurationError(
-                    f"Error: No tool with index {tool_id} is currently loaded."
-                )
-        elif isinstance(tool_id, str):
-            tool_index = None
-            for loaded_tool_index in self.tools:
-                if self.tools[loaded_tool_index]["name"] is tool_id:
-                    tool_index = loaded_tool_index
-                    break
-            if tool_index is None:
-                raise MachineConfigurationError(
-                    f"Error: No tool with name {tool_id} is currently loaded."
-                )
-        elif isinstance(tool_id, Tool):
-            tool_index = None
-            for loaded_tool_index in self.tools:
-                if self.tools[loaded_tool_index]["tool"] is tool_id:
-                    tool_index = loaded_tool_index
-                    break
-            if tool_index is None:
-                raise MachineConfigurationError(
-                    f"Error: No tool of type {tool_id} is currently loaded."
-                )
-        else:
-            raise ValueError(f"Unknown tool format {type(tool_id)}")
+        tool_index = find_tool_index(self.tools, tool_id)
 
         #         self.safe_z_movement()
-        self.gcode(f"T{tool_index}")
+        self.gcode(GCode.select_tool(tool_index))
         self.active_tool_index = tool_index
         self.tools[tool_index]["tool"].is_active_tool = True
 
+    @traced
     @requires_safe_z
     def park_tool(self):
         """Park the current tool adn cahnges active tool index to `-1`."""
         # self.safe_z_movement()
-        self.gcode("T-1")
+        self.gcode(GCode.PARK_TOOL)
         # Update the cached value to prevent read delays.
         current_tool_index = self.active_tool_index
         if current_tool_index != -1:
             self.tools[current_tool_index]["tool"].is_active_tool = False
             self._active_tool_index = -1
 
+    @property
+    def current_well(self):
+        """The well last assigned to this property until the machine moves in X or Y, otherwise the
+        well under the machine control point.
+
+        The well under the control point is looked up on the deck from the tracked position, so
+        reading this never queries the machine: it is None while the position is unknown, e.g.
+        after homing, until :meth:`get_position` reads it back.
+
+        :return: The :class:`Well`, or None if none was assigned and the machine is not known to be over a well
+        :rtype: :class:`Well`
+        """
+        if self._current_well is not None or self.deck is None:
+            return self._current_well
+        if not self.motion_state.valid:
+            return None
+        positions = self.motion_state.positions
+        return self.deck.well_at(positions["X"], positions["Y"])
+
+    @current_well.setter
+    def current_well(self, well):
+        self._current_well = well
+
     def get_position(self):
         """Get the current position of the machine control point in mm.
 
+        The position is tracked locally from the commands sent to the machine, and only read back
+        with `M114` after something the tracking cannot follow, e.g. homing, a tool change or an error.
+
         :return: A dictionary of the machine control point in mm. The keys are the axis name, e.g. 'X'
         :rtype: dict
         """
+        if self.motion_state.valid:
+            return self.motion_state.as_dict()
+        return self.sync_position()
 
-        max_tries = 50
-        for i in range(max_tries):
-            resp = self.gcode("M114")
-            if resp is None:
-                continue
-            elif "Count" not in resp:
-                continue
-            else:
-                break
-        positions = {}
-        keyword = " Count "  # this is the keyword hosts like e.g. pronterface search for to track position
-        keyword_idx = resp.find(keyword)
-
-        count = 0
-        if keyword_idx > -1:
-            resp = resp[:keyword_idx]
-            position_elements = resp.split(" ")
-            for e in position_elements:
-                axis, pos = e.split(":", 2)
-                positions[axis] = pos
+    def sync_position(self):
+        """Read the current position back from the machine with `M114` and reset the tracked position.
 
+        :return: A dictionary of the machine control point in mm. The keys are the axis name, e.g. 'X'
+        :rtype: dict
+        """
+        if self.simulated:
+            # The simulator follows every command, including those the tracking cannot
+            self.motion_state.sync(
+                {
+                    axis["letter"]: self.simulator.position[axis["letter"]]
+                    for axis in self.simulator.axes
+                }
+            )
+            return self.motion_state.as_dict()
+        if self.recording:
+            raise MachineStateError(
+                "Error: the position cannot be read back from the machine while recording a job."
+            )
+        if self._batch is None:
+            # The position is only final once the queued moves have finished
+            self.sync()
+
+        def read_position():
+            # Sent right away, even inside a batch, since the reply is needed here.
+            resp = self._send(GCode.GET_POSITION)
+            if resp is None or "Count" not in resp:
+                raise MachineStateError(f"Unexpected reply to M114: {resp!r}")
+            return resp
+
+        resp = self.query_retry.call(read_position, retry_on=(MachineStateError,))
+        positions = parse_m114(resp)
+        self.motion_state.sync(positions)
         return positions
 
     def load_labware(
@@ -1109,8 +1631,8 @@ class Machine:
 
     def disconnect(self):
         """Close the connection."""
-        # Nothing to do?
-        pass
+        self._end_subscription()
+        self.transport.close()
 
     def __enter__(self):
         return self
@@ -1,9 +1,10 @@
-import json
 import os
 from dataclasses import dataclass
+from math import hypot
 from typing import Dict, Tuple
 
 from science_jubilee.labware.Labware import Labware
+from science_jubilee.utils.DefinitionCache import definitions
 
 
 @dataclass
@@ -89,13 +90,13 @@ class Deck(SlotSet):
 
         config_path = os.path.join(path, f"{deck_filename}")
 
-        with open(config_path, "r") as f:
-            deck_config = json.load(f)
-
-        self.deck_config = deck_config
+        # Parsed once per process, and shared with other decks loaded from the same file
+        self.deck_config = definitions.load(config_path)
         self.slots_data = self.deck_config.get("slots", {})
         self.slots = self._get_slots()
         self._safe_z = 10
+        # Spatial index of the wells of each slot's labware, see `_well_indexes`
+        self._indexes = {}
 
     def _get_slots(self):
         """Function that creates a dictionary of :class:`Slot` objects from the deck configuration file.
@@ -222,3 +223,94 @@ class Deck(SlotSet):
         self.slots[str(slot)].labware = labware
         self.safe_z = labware.dimensions["zDimension"]
         return labware
+
+    def _well_indexes(self):
+        """Return the spatial index of the wells of each loaded labware.
+
+        Indexes are kept between queries, and only rebuilt for labware that was loaded or whose wells
+        moved (e.g. by an offset or a calibration) since.
+
+        :return: A list of (labware, index) pairs
+        :rtype: List[Tuple[:class:`Labware`, :class:`GridIndex`]]
+        """
+        indexes = []
+        for key, slot in self.slots.items():
+            if not slot.has_labware:
+                continue
+            labware = slot.labware
+            geometry = labware.geometry
+            cached = self._indexes.get(key)
+            if (
+                cached is None
+                or cached[0] is not geometry
+                or cached[1] != geometry.version
+            ):
+                cached = (geometry, geometry.version, labware, labware.spatial_index())
+                self._indexes[key] = cached
+            indexes.append((labware, cached[3]))
+        return indexes
+
+    def well_at(self, x: float, y: float):
+        """Find the well whose footprint contains the (x, y) position.
+
+        :param x: The x-coordinate, in mm
+        :type x: float
+        :param y: The y-coordinate, in mm
+        :type y: float
+        :return: The :class:`Well`, or None if the position is not over any well
+        :rtype: :class:`Well`
+        """
+        for labware, index in self._well_indexes():
+            x0, y0, x1, y1 = index.bounds
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                i = index.at(x, y)
+                if i is not None:
+                    return labware.well_at_index(i)
+        return None
+
+    def nearest_well(self, x: float, y: float):
+        """Find the well whose center is closest to the (x, y) position.
+
+        :param x: The x-coordinate, in mm
+        :type x: float
+        :param y: The y-coordinate, in mm
+        :type y: float
+        :return: The :class:`Well` and the distance to its center in mm, or (None, inf) if no labware is loaded
+        :rtype: Tuple[:class:`Well`, float]
+        """
+        candidates = []
+        for labware, index in self._well_indexes():
+            x0, y0, x1, y1 = index.bounds
+            # No well of this labware can be closer than its bounding box
+            bound = hypot(max(x0 - x, 0, x - x1), max(y0 - y, 0, y - y1))
+            candidates.append((bound, labware, index))
+        candidates.sort(key=lambda item: item[0])
+
+        best, best_d = None, float("inf")
+        for bound, labware, index in candidates:
+            if bound >= best_d:
+                break
+            i, d = index.nearest(x, y)
+            if d < best_d:
+                best, best_d = labware.well_at_index(i), d
+        return best, best_d
+
+    def wells_within(self, x: float, y: float, radius: float):
+        """Find the wells whose center is within `radius` of the (x, y) position.
+
+        :param x: The x-coordinate, in mm
+        :type x: float
+        :param y: The y-coordinate, in mm
+        :type y: float
+        :param radius: The search radius, in mm
+        :type radius: float
+        :return: The :class:`Well` objects, closest first
+        :rtype: List[:class:`Well`]
+        """
+        found = []
+        for labware, index in self._well_indexes():
+            found.extend(
+                (d, labware.well_at_index(i)) for i, d in index.within(x, y, radius)
+            )
+        found.sort(key=lambda item: item[0])
+        return [well for _, well in found]
@@ -0,0 +1,140 @@
+from dataclasses import dataclass, field
+from math import atan2, degrees
+from typing import List
+
+import numpy as np
+
+
+@dataclass
+class Calibration:
+    """A map from the coordinates of a labware definition to measured deck coordinates.
+
+    X and Y follow an affine transform (translation, rotation, per-axis scale and skew). Z is shifted
+    by a plane, which accounts for a labware that sits tilted on the deck; when no heights were
+    measured, Z is left as it is.
+
+    :param matrix: The 2x3 affine transform, such that ``[x', y'] = matrix @ [x, y, 1]``
+    :type matrix: np.ndarray
+    :param plane: The coefficients (a, b, c) of the Z correction ``z' = z + a * x + b * y + c``,
+        defaults to None (Z not calibrated)
+    :type plane: np.ndarray, optional
+    :param names: The names of the wells that were measured
+    :type names: List[str], optional
+    :param residuals: The measured minus the fitted coordinates of each measured well
+    :type residuals: np.ndarray, optional
+    """
+
+    matrix: np.ndarray
+    plane: np.ndarray = None
+    names: List[str] = field(default_factory=list)
+    residuals: np.ndarray = None
+
+    @classmethod
+    def fit(cls, nominal, measured, names: List[str] = None):
+        """Fit the calibration mapping `nominal` onto `measured` by least squares.
+
+        One point fits a translation, two points add a rotation and a uniform scale, and three or
+        more points fit the full affine transform. Z is fitted as a constant offset from one or two
+        heights, and as a plane from three or more.
+
+        :param nominal: The definition coordinates of the measured wells, of shape (n, 3)
+        :type nominal: np.ndarray
+        :param measured: The measured coordinates of the same wells, of shape (n, 2) or (n, 3)
+        :type measured: np.ndarray
+        :param names: The names of the measured wells, defaults to None
+        :type names: List[str], optional
+        :raises ValueError: If no points are given, two points are at the same place, or three or
+            more points are all on one line
+        :return: The fitted calibration
+        :rtype: :class:`Calibration`
+        """
+        nominal = np.asarray(nominal, dtype=float)
+        measured = np.asarray(measured, dtype=float)
+        n = len(measured)
+        if n == 0 or measured.ndim != 2 or measured.shape[1] not in (2, 3):
+            raise ValueError("Expected one or more (x, y) or (x, y, z) points")
+        xy, target = nominal[:, :2], measured[:, :2]
+
+        if n == 1:
+            matrix = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+            matrix[:, 2] = target[0] - xy[0]
+        elif n == 2:
+            # A similarity transform is the complex map w = a * z + b
+            z = xy[:, 0] + 1j * xy[:, 1]
+            w = target[:, 0] + 1j * target[:, 1]
+            if z[1] == z[0]:
+                raise ValueError("Calibration points must not be the same well twice")
+            a = (w[1] - w[0]) / (z[1] - z[0])
+            b = w[0] - a * z[0]
+            matrix = np.array([[a.real, -a.imag, b.real], [a.imag, a.real, b.imag]])
+        else:
+            A = np.column_stack((xy, np.ones(n)))
+            if np.linalg.matrix_rank(A) < 3:
+                raise ValueError("Calibration points must not all lie on one line")
+            matrix = np.linalg.lstsq(A, target, rcond=None)[0].T
+
+        plane = None
+        if measured.shape[1] == 3:
+            dz = measured[:, 2] - nominal[:, 2]
+            A = np.column_stack((xy, np.ones(n)))
+            if n >= 3 and np.linalg.matrix_rank(A) == 3:
+                plane = np.linalg.lstsq(A, dz, rcond=None)[0]
+            else:
+                plane = np.array([0.0, 0.0, dz.mean()])
+
+        calibration = cls(matrix, plane, list(names or []))
+        fitted = calibration.apply(nominal)[:, : measured.shape[1]]
+        calibration.residuals = measured - fitted
+        return calibration
+
+    def apply(self, points):
+        """Map definition coordinates to deck coordinates.
+
+        :param points: The definition coordinates, of shape (n, 3)
+        :type points: np.ndarray
+        :return: The calibrated coordinates, of shape (n, 3)
+        :rtype: np.ndarray
+        """
+        points = np.asarray(points, dtype=float)
+        out = points.copy()
+        xy1 = np.column_stack((points[:, :2], np.ones(len(points))))
+        out[:, :2] = xy1 @ self.matrix.T
+        if self.plane is not None:
+            out[:, 2] += xy1 @ self.plane
+        return out
+
+    @property
+    def rms(self):
+        """The root mean square distance between the measured and fitted points, in mm."""
+        if self.residuals is None or len(self.residuals) == 0:
+            return 0.0
+        return float(np.sqrt(np.mean(np.sum(self.residuals**2, axis=1))))
+
+    @property
+    def translation(self):
+        """The (x, y) translation of the transform."""
+        return tuple(self.matrix[:, 2])
+
+    @property
+    def rotation(self):
+        """The rotation of the labware x-axis, in degrees."""
+        return degrees(atan2(self.matrix[1, 0], self.matrix[0, 0]))
+
+    @property
+    def scale(self):
+        """The (x, y) scale of the transform."""
+        sx = float(np.hypot(*self.matrix[:, 0]))
+        return sx, float(np.linalg.det(self.matrix[:, :2])) / sx
+
+    @property
+    def skew(self):
+        """The angle between the transformed axes, less 90, in degrees."""
+        a, b = self.matrix[:, 0], self.matrix[:, 1]
+        return degrees(atan2(a[0] * b[1] - a[1] * b[0], np.dot(a, b))) - 90
+
+    def __repr__(self):
+        return (
+            f"Calibration(translation=({self.translation[0]:.3f}, {self.translation[1]:.3f}),"
+            f" rotation={self.rotation:.3f}°, scale=({self.scale[0]:.4f}, {self.scale[1]:.4f}),"
+            f" skew={self.skew:.3f}°, rms={self.rms:.3f} mm)"
+        )
@@ -1,6 +1,6 @@
+import copy
 import json
 import os
-import string
 from dataclasses import dataclass
 from itertools import chain
 from math import acos, cos, sin, sqrt
@@ -8,33 +8,219 @@ from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
 
 import numpy as np
 
+from science_jubilee.labware.Calibration import Calibration
+from science_jubilee.utils.DefinitionCache import COMPILED_CACHE, definitions
+from science_jubilee.utils.SpatialIndex import GridIndex
+
+
+class WellGeometry:
+    """The coordinates and dimensions of a set of wells, stored as one NumPy array per field.
+
+    A :class:`Labware` keeps the geometry of all its wells in a single :class:`WellGeometry`, and
+    each :class:`Well` reads and writes its own entry. Offsets and calibrations are then applied to
+    every well at once.
+
+    :param n: The number of wells
+    :type n: int
+    """
+
+    FIELDS = (
+        "x",
+        "y",
+        "z",
+        "depth",
+        "diameter",
+        "xDimension",
+        "yDimension",
+        "totalLiquidVolume",
+    )
+
+    def __init__(self, n: int):
+        for field in self.FIELDS:
+            # Dimensions a well does not have (e.g. the diameter of a rectangular well) are NaN
+            setattr(self, field, np.full(n, np.nan))
+        self.row = np.zeros(n, dtype=int)
+        self.column = np.zeros(n, dtype=int)
+        self.offset = None
+        # Incremented whenever wells move, so that indexes of their positions know to rebuild
+        self.version = 0
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_definition(cls, wells_data: dict, ordering: List[List[str]]):
+        """Create the geometry of the wells of a labware definition.
+
+        :param wells_data: The `wells` field of the labware definition
+        :type wells_data: dict
+        :param ordering: The names of the wells, as a list of rows
+        :type ordering: List[List[str]]
+        :return: The geometry of the wells, in row by row order
+        :rtype: :class:`WellGeometry`
+        """
+        names = [name for row in ordering for name in row]
+        geometry = cls(len(names))
+        for field in cls.FIELDS:
+            values = [wells_data[name].get(field) for name in names]
+            getattr(geometry, field)[:] = [np.nan if v is None else v for v in values]
+        n_columns = len(ordering[0]) if len(ordering) else 0
+        index = np.arange(len(names))
+        geometry.row = index // max(n_columns, 1)
+        geometry.column = index % max(n_columns, 1)
+        return geometry
+
+    def copy(self):
+        """Return a copy of the geometry, which does not share its arrays.
+
+        :rtype: :class:`WellGeometry`
+        """
+        geometry = WellGeometry.__new__(WellGeometry)
+        for field in self.FIELDS + ("row", "column"):
+            setattr(geometry, field, getattr(self, field).copy())
+        geometry.offset = self.offset
+        geometry.version = 0
+        return geometry
+
+    def to_arrays(self):
+        """Return the arrays of the geometry by name, e.g. to save them with :func:`numpy.savez`.
+
+        :rtype: Dict[str, np.ndarray]
+        """
+        arrays = {field: getattr(self, field) for field in self.FIELDS}
+        arrays.update(row=self.row, column=self.column)
+        if self.offset is not None:
+            arrays["offset"] = np.asarray(self.offset, dtype=float)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]):
+        """Create a geometry from the arrays returned by :meth:`to_arrays`.
+
+        :param arrays: The arrays of the geometry by name
+        :type arrays: Dict[str, np.ndarray]
+        :rtype: :class:`WellGeometry`
+        """
+        geometry = cls(len(arrays["x"]))
+        for field in cls.FIELDS + ("row", "column"):
+            setattr(geometry, field, np.array(arrays[field]))
+        if "offset" in arrays:
+            geometry.offset = tuple(arrays["offset"].tolist())
+        return geometry
+
+    @property
+    def points(self):
+        """The (x, y, z) coordinates of the wells, as an array of shape (n, 3)."""
+        return np.column_stack((self.x, self.y, self.z))
+
+    def translate(self, offset: Tuple[float], index=slice(None)):
+        """Move wells by `offset`.
+
+        :param offset: The (x, y) or (x, y, z) translation
+        :type offset: Tuple[float]
+        :param index: The wells to move, defaults to all of them
+        :type index: Union[int, slice, np.ndarray], optional
+        """
+        self.x[index] += offset[0]
+        self.y[index] += offset[1]
+        if len(offset) == 3:
+            self.z[index] += offset[2]
+        self.version += 1
+
+
+# Saved with compiled labware definitions, see `Labware.compile_definitions`
+definitions.register("geometry", WellGeometry.to_arrays, WellGeometry.from_arrays)
+
+
+def _optional(value):
+    """Convert a stored dimension back to a float, or None if the well does not have it."""
+    value = float(value)
+    return None if np.isnan(value) else value
+
 
-@dataclass
 class Well:
     """A class representing a well of a labware.
 
     Each Well is associated with a specific name, depth, total liquid volume, shape, diameter,
-    x, y, and z dimension, y-dimension, as well as its coordinates and any applied offset
+    x, y, and z dimension, y-dimension, as well as its coordinates and any applied offset.
+
+    The coordinates and dimensions of the well are an entry of a :class:`WellGeometry`, shared with
+    the other wells of its labware. A well created on its own gets a geometry of its own.
 
     :return: A :class:`Well` object with various information about the geometry of the well and its position in the labware
     :rtype: :class:`Well`
     """
 
-    name: str
-    depth: float
-    totalLiquidVolume: float
-    shape: str
-    diameter: float = None
-    xDimension: float = None
-    yDimension: float = None
-    x: float
-    y: float
-    z: float
-    offset: Tuple[float] = None
-    slot: int = None
-    has_tip: bool = False
-    clean_tip: bool = False
-    labware_name: str = None
+    __slots__ = (
+        "name",
+        "shape",
+        "slot",
+        "has_tip",
+        "clean_tip",
+        "labware_name",
+        "_geometry",
+        "_index",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        depth: float,
+        totalLiquidVolume: float,
+        shape: str,
+        diameter: float = None,
+        xDimension: float = None,
+        yDimension: float = None,
+        x: float = 0.0,
+        y: float = 0.0,
+        z: float = 0.0,
+        offset: Tuple[float] = None,
+        slot: int = None,
+        has_tip: bool = False,
+        clean_tip: bool = False,
+        labware_name: str = None,
+    ):
+        geometry = WellGeometry(1)
+        for field, value in zip(
+            WellGeometry.FIELDS,
+            (x, y, z, depth, diameter, xDimension, yDimension, totalLiquidVolume),
+        ):
+            getattr(geometry, field)[0] = np.nan if value is None else value
+        geometry.offset = offset
+        self._bind(geometry, 0, name, shape)
+        self.slot = slot
+        self.has_tip = has_tip
+        self.clean_tip = clean_tip
+        self.labware_name = labware_name
+
+    @classmethod
+    def view(cls, geometry: WellGeometry, index: int, name: str, shape: str):
+        """Create a well whose coordinates and dimensions are entry `index` of `geometry`.
+
+        :param geometry: The geometry of the wells of a labware
+        :type geometry: :class:`WellGeometry`
+        :param index: The index of the well in `geometry`
+        :type index: int
+        :param name: The name of the well, e.g. 'A1'
+        :type name: str
+        :param shape: The shape of the well, e.g. 'circular'
+        :type shape: str
+        :return: The well
+        :rtype: :class:`Well`
+        """
+        well = cls.__new__(cls)
+        well._bind(geometry, index, name, shape)
+        well.slot = None
+        well.has_tip = False
+        well.clean_tip = False
+        well.labware_name = None
+        return well
+
+    def _bind(self, geometry, index, name, shape):
+        self._geometry = geometry
+        self._index = index
+        self.name = name
+        self.shape = shape
 
     @property
     def x(self):
@@ -43,7 +229,7 @@ class Well:
         :return: The x-coordinate of the well
         :rtype: float
         """
-        return self._x
+        return float(self._geometry.x[self._index])
 
     @x.setter
     def x(self, new_x):
@@ -52,7 +238,8 @@ class Well:
         :param new_x: the new y-coordinate of the well
         :type new_x: float
         """
-        self._x = new_x
+        self._geometry.x[self._index] = new_x
+        self._geometry.version += 1
 
     @property
     def y(self):
@@ -61,7 +248,7 @@ class Well:
         :return: The y-coordinate of the well
         :rtype: float
         """
-        return self._y
+        return float(self._geometry.y[self._index])
 
     @y.setter
     def y(self, new_y):
@@ -71,7 +258,8 @@ class Well:
         :type new_y: float
         """
 
-        self._y = new_y
+        self._geometry.y[self._index] = new_y
+        self._geometry.version += 1
 
     @property
     def z(self):
@@ -80,7 +268,7 @@ class Well:
         :return: The z-coordinate of the well
         :rtype: float
         """
-        return self._z
+        return float(self._geometry.z[self._index])
 
     @z.setter
     def z(self, new_z):
@@ -89,7 +277,56 @@ class Well:
         :param new_z: The new z-coordinate of the well
         :type new_z: flaot
         """
-        self._z = new_z
+        self._geometry.z[self._index] = new_z
+        self._geometry.version += 1
+
+    @property
+    def depth(self):
+        """The depth of the well
+
+        :rtype: float
+        """
+        return float(self._geometry.depth[self._index])
+
+    @property
+    def diameter(self):
+        """The diameter of the well, or None if the well is not circular
+
+        :rtype: float
+        """
+        return _optional(self._geometry.diameter[self._index])
+
+    @property
+    def xDimension(self):
+        """The x-dimension of a rectangular well, or None
+
+        :rtype: float
+        """
+        return _optional(self._geometry.xDimension[self._index])
+
+    @property
+    def yDimension(self):
+        """The y-dimension of a rectangular well, or None
+
+        :rtype: float
+        """
+        return _optional(self._geometry.yDimension[self._index])
+
+    @property
+    def totalLiquidVolume(self):
+        """The volume of liquid the well holds
+
+        :rtype: float
+        """
+        return _optional(self._geometry.totalLiquidVolume[self._index])
+
+    @property
+    def offset(self):
+        """The offset last applied to the labware of the well
+
+        :rtype: Tuple[float]
+        """
+        return self._geometry.offset
 
     def apply_offset(self, offset: Tuple[float]):
         """Allows the user to offset the coordinates of the well with respect to the deck-slot coordinates
@@ -97,13 +334,8 @@ class Well:
         :param offset: A tuple of floats with the new offset of the well
         :type offset: Tuple[float]
         """
-        self._x = self.x + offset[0]
-        self._y = self.y + offset[1]
-
-        if len(offset) == 3:
-            self._z = self.z + offset[2]
-
-        self.offset = offset
+        self._geometry.translate(offset, self._index)
+        self._geometry.offset = offset
 
     @property
     def top_(self):
@@ -213,31 +445,63 @@ class WellSet:
         """
         return str(f"{list(self.wells.keys())}")
 
-    def __getitem__(self, id_: Union[str, int]):
+    def _positions(self):
+        """Index the wells by position and by name, again whenever :attr:`wells` is replaced or resized.
+
+        :return: An array of the :class:`Well` objects in order, and the position of each by name
+        :rtype: np.ndarray, Dict[str, int]
+        """
+        lookup = self.__dict__.get("_lookup")
+        if (
+            lookup is None
+            or lookup[0] is not self.wells
+            or len(lookup[1]) != len(self.wells)
+        ):
+            order = np.empty(len(self.wells), dtype=object)
+            order[:] = list(self.wells.values())
+            positions = {name: i for i, name in enumerate(self.wells)}
+            lookup = self._lookup = (self.wells, order, positions)
+        return lookup[1], lookup[2]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def __iter__(self):
+        return iter(self.wells.values())
+
+    def __getitem__(self, id_):
         """Allows the user to select a :class:`Well` object by either their :attribute:`Well.name` or
             their index in a :list:
 
+        Several wells can be selected at once as with NumPy arrays: by a slice, a list or array of
+        indices or names, or a boolean mask. They are returned as a :list: of :class:`Well` objects,
+        or as a NumPy array when the selection has more than one dimension.
+
         :param id_: The :attribute:`Well.name` or index representing a :class:`Well` in the labware
-        :type id_: Union[str, int]
-        :return: The :class:`Well` object
-        :rtype: :class:`Well`
+        :type id_: Union[str, int, slice, list, np.ndarray]
+        :return: The :class:`Well` object, or a list or array of them
+        :rtype: Union[:class:`Well`, list, np.ndarray]
         """
-        try:
-            if isinstance(id_, slice):
-                well_list = []
-                start = id_.start
-                stop = id_.stop
-                if id_.step is not None:
-                    step = id_.step
-                else:
-                    step = 1
-                for sub_id in range(start, stop, step):
-                    well_list.append(self.wells[sub_id])
-                return well_list
-            else:
-                return self.wells[id_]
-        except KeyError:
-            return list(self.wells.values())[id_]
+        if isinstance(id_, str):
+            return self.wells[id_]
+        order, positions = self._positions()
+        if isinstance(id_, (int, np.integer)):
+            return order[id_]
+        if isinstance(id_, slice):
+            return _selection(order[id_])
+        keys = np.asarray(id_)
+        if keys.dtype.kind in "US":
+            keys = np.array([positions[k] for k in keys.ravel()], dtype=int).reshape(
+                keys.shape
+            )
+        return _selection(order[keys])
+
+
+def _selection(wells: np.ndarray):
+    """Return a 1D selection of wells as a list, which is what the tools accept."""
+    if isinstance(wells, np.ndarray) and wells.ndim == 1:
+        return wells.tolist()
+    return wells
 
 
 @dataclass(repr=False)
@@ -303,15 +567,20 @@ class Labware(WellSet):
 
         config_path = os.path.join(path, f"{labware_filename}")
 
-        with open(config_path, "r") as f:
-            # this will be the raw .json file data and fields should not be modified directly
-            # current exceptions is 'manual_offset' field to allow to save custom data for easier handling
-            # of recurrent slot-labware combinations
-            self.data = json.load(f)
+        # this will be the raw .json file data and fields should not be modified directly
+        # current exceptions is 'manual_offset' field to allow to save custom data for easier handling
+        # of recurrent slot-labware combinations. The file is parsed once and shared by every labware
+        # loaded from it, so the fields this labware records into are copied
+        self.data = dict(definitions.load(config_path))
+        for field in ("manual_offset", "calibration"):
+            if field in self.data:
+                self.data[field] = copy.deepcopy(self.data[field])
 
         self.config_path = config_path
         self.wells_data = self.data.get("wells", {})
         self.row_data, self.column_data, self.wells = self._create_rows_and_columns()
+        # The coordinates from the definition, before any offset or calibration
+        self._definition_points = self.geometry.points
 
         order_options = [
             "rows",
@@ -336,6 +605,8 @@ class Labware(WellSet):
         else:
             # otherwise initialize manual_offset instance variable
             self.manualOffset = {}
+        self.calibrations = dict(self.data.get("calibration", {}))
+        self.calibration = None
 
     def __repr__(self):
         """Displayed representation of a :class:`Labware` object indicating the type of labware and
@@ -349,6 +620,21 @@ class Labware(WellSet):
             display = display + " " + f" on {self.slot}"
         return display
 
+    def __getitem__(self, id_):
+        """Select wells as in :meth:`WellSet.__getitem__`, or by their row and column index.
+
+        For example, ``labware[0, 0]`` is well A1, ``labware[:, 0]`` the first column as a list and
+        ``labware[::2, ::2]`` every other well of every other row, as a 2D array.
+
+        :param id_: The name, index or `(row, column)` indices of the wells
+        :type id_: Union[str, int, slice, list, np.ndarray, tuple]
+        :return: The :class:`Well` object, or a list or array of them
+        :rtype: Union[:class:`Well`, list, np.ndarray]
+        """
+        if isinstance(id_, tuple):
+            return _selection(self._grid[id_])
+        return super().__getitem__(id_)
+
     def _create_rows_and_columns(self):
         """Creates a dictionary of :class:`Row` and :class:`Column` and :class:`Well` objects from the data in the config `.json` file.
 
@@ -359,17 +645,26 @@ class Labware(WellSet):
         columns = {}
         wells = {}
 
-        for row_order, column_data in enumerate(self.ordering):
+        ordering = self.ordering
+        # The wells laid out as on the labware, for [row, column] indexing
+        self._grid = np.empty(ordering.shape, dtype=object)
+        # Compiled once per definition file, and copied so that each labware can be moved on its own
+        self.geometry = definitions.compiled(
+            self.config_path, "geometry", self._compile_geometry
+        ).copy()
+
+        for row_order, column_data in enumerate(ordering):
             # Assumes the first char is the row identifier, e.g., "A" in "A1"
             row_id = column_data[0][0]
-            # Extracts column number, e.g., "1" in "A1"
-            col_ids = [int(well[1:]) for well in column_data]
 
             if row_id not in rows:
                 rows[row_id] = {}
 
             for col_order, well_id in enumerate(column_data):
-                well = Well(name=well_id, **self.wells_data[well_id])
+                index = row_order * len(column_data) + col_order
+                shape = self.wells_data[well_id]["shape"]
+                well = Well.view(self.geometry, index, well_id, shape)
+                self._grid[row_order, col_order] = well
                 rows[row_id][well_id] = well
 
                 if col_order + 1 not in columns:  # +1 since indexing starts at 0
@@ -394,6 +689,18 @@ class Labware(WellSet):
 
         return _rows, _columns, wells
 
+    @staticmethod
+    def _compile_geometry(data: dict):
+        """Create the well geometry described by a labware definition, before any offset
+
+        :param data: The labware definition
+        :type data: dict
+        :rtype: :class:`WellGeometry`
+        """
+        return WellGeometry.from_definition(
+            data.get("wells", {}), np.array(data["ordering"]).T
+        )
+
     def get_row(self, row_id: str) -> Row:
         """Fucntions to fetch the :class:`Well.name` of the indicated row.
 
@@ -564,8 +871,8 @@ class Labware(WellSet):
         """
         self._offset = new_offset
         if new_offset is not None:
-            for w in self:
-                w.apply_offset(new_offset)
+            self.geometry.translate(new_offset)
+            self.geometry.offset = new_offset
 
     def add_slot(self, slot_):
         """Add name of deck slot after labware has been loaded
@@ -597,44 +904,36 @@ class Labware(WellSet):
 
         self.wells = ordered_wells
 
-    # @staticmethod
-    def _translate_point(
+    def _translate_points(
         self,
-        well: Well,
         theta: float,
         x_space: float,
         y_space: float,
         upper_left: Tuple[float],
     ):
         """
-        Helper function to translate the coordinates of a well by a given angle theta.
+        Helper function to translate the coordinates of all the wells by a given angle theta.
 
-        :param well: A :class:`Well` object
-        :type well: :class:`Well`
-        :param theta: The angle by which to translate the coordinates of the well
+        :param theta: The angle by which to translate the coordinates of the wells
         :type theta: float
 
-        :return: The new x and y coordinates of the well
-        :rtype: float, float
+        :return: The new x and y coordinates of the wells
+        :rtype: np.ndarray, np.ndarray
         """
-        x_nom, y_nom = self._nominal_coordinates(well, x_space, y_space)
+        x_nom, y_nom = self._nominal_coordinates(x_space, y_space)
 
         x_translated = upper_left[0] + x_nom * cos(theta) - y_nom * sin(theta)
         y_translated = upper_left[1] - (x_nom * sin(theta) + y_nom * cos(theta))
 
         return x_translated, y_translated
 
-    @staticmethod
-    def _nominal_coordinates(well: Well, x_space: float, y_space: float):
+    def _nominal_coordinates(self, x_space: float, y_space: float):
         """
-        Helper function to calculate the nominal coordinates of a well in a labware
-        based on its row and column index.
+        Helper function to calculate the nominal coordinates of the wells in a labware
+        based on their row and column index.
         """
-        col_index = int(well.name[1:]) - 1
-        row_index = list(string.ascii_uppercase).index(well.name[0])
-
-        x_nominal = col_index * x_space
-        y_nominal = row_index * y_space
+        x_nominal = self.geometry.column * x_space
+        y_nominal = self.geometry.row * y_space
 
         return x_nominal, y_nominal
 
@@ -642,6 +941,7 @@ class Labware(WellSet):
         """Allows the user to manually offset the coordinates of the labware based on three corner wells.
 
         Adapted from `https://github.com/machineagency/sonication_station` labware calibration procedure.
+        To calibrate from more than three wells, or to correct scale, skew and tilt, see :meth:`calibrate`.
 
         :param offset: A list containing tuples of floats
         :type offset: Tuple[float]
@@ -694,12 +994,10 @@ class Labware(WellSet):
 
         # apply offset to all wells in the labware object
 
-        for well in self:
-            new_x, new_y = self._translate_point(
-                well, theta, x_space, y_space, upper_left
-            )
-            well.x = new_x
-            well.y = new_y
+        self.geometry.x[:], self.geometry.y[:] = self._translate_points(
+            theta, x_space, y_space, upper_left
+        )
+        self.geometry.version += 1
         print(f'New manual offset applied to {self.parameters()["loadName"]}')
 
         if save:
@@ -746,6 +1044,86 @@ class Labware(WellSet):
         else:
             return self.data["manual_offset"][self.slot]
 
+    def calibrate(self, measured: Dict[str, Tuple[float]], save: bool = False):
+        """Calibrate the coordinates of all the wells from the measured positions of some of them.
+
+        The wells' definition coordinates are fitted onto the measured positions by least squares,
+        see :meth:`Calibration.fit`: any number of wells can be measured, and measuring more than
+        three averages out the error of each measurement. The fit replaces the offset of the
+        labware and any manual offset.
+
+        :param measured: The measured (x, y) or (x, y, z) deck coordinates of some wells, by well name
+        :type measured: Dict[str, Tuple[float]]
+        :param save: Option to save the measurements for this slot to the config `.json` file, defaults to False
+        :type save: bool, optional
+        :return: The fitted calibration, with the residual of each measured well
+        :rtype: :class:`Calibration`
+        """
+        assert (
+            self.slot is not None
+        ), "Labware has not been assigned to a slot yet. Use the 'add_slot' method to assign a slot"
+        names = list(measured)
+        index = [self.wells[name]._index for name in names]
+        calibration = Calibration.fit(
+            self._definition_points[index], [measured[n] for n in names], names
+        )
+        points = calibration.apply(self._definition_points)
+        if calibration.plane is None:
+            # Heights were not measured, keep the current ones
+            points[:, 2] = self.geometry.z
+        self.geometry.x[:], self.geometry.y[:], self.geometry.z[:] = points.T
+        self.geometry.version += 1
+        self.calibration = calibration
+
+        self.calibrations[str(self.slot)] = {n: list(measured[n]) for n in names}
+        if save:
+            self.data["calibration"] = self.calibrations
+            with open(self.config_path, "w") as f:
+                json.dump(self.data, f, indent=4)
+        return calibration
+
+    def load_calibration(self, apply: bool = True):
+        """Loads the calibration measurements of a labware from its config `.json` file for its slot
+
+        :param apply: Option to apply the calibration to the labware or return the measurements, defaults to True
+        :type apply: bool, optional
+        :return: The fitted :class:`Calibration`, or the measurements if `apply` is False
+        :rtype: Union[:class:`Calibration`, Dict[str, List[float]]]
+        """
+        assert (
+            self.slot is not None
+        ), "Labware has not been assigned to a slot yet. Use the 'add_slot' method to assign a slot"
+        measured = self.calibrations.get(str(self.slot))
+        assert measured, f"No calibration saved for slot {self.slot}"
+        if apply:
+            return self.calibrate(measured)
+        return measured
+
+    def spatial_index(self):
+        """Index the footprints of the wells, to find the wells at or near an (x, y) position.
+
+        Circular wells are indexed by their diameter, and rectangular ones by their x and y dimensions.
+        The index holds the positions at the time it is built; :class:`Deck` rebuilds it when the
+        wells move.
+
+        :return: The index, whose footprint `i` is the well ``labware.well_at_index(i)``
+        :rtype: :class:`GridIndex`
+        """
+        g = self.geometry
+        circular = ~np.isnan(g.diameter)
+        half_x = np.where(circular, g.diameter, g.xDimension) / 2
+        half_y = np.where(circular, g.diameter, g.yDimension) / 2
+        return GridIndex(g.x, g.y, half_x, half_y, circular)
+
+    def well_at_index(self, index: int):
+        """Returns the well at position `index` of :attr:`geometry`
+
+        :param index: The index of the well in :attr:`geometry`
+        :type index: int
+        :rtype: :class:`Well`
+        """
+        return self._grid.flat[index]
+
     @staticmethod
     def _getxyz(location: Union[Well, Tuple, "Location"]):
         """Helper function to extract the x, y, z coordinates of a location object.
@@ -776,7 +1154,34 @@ class Labware(WellSet):
         :rtype: List[str]
         """
         path = os.path.join(os.path.dirname(__file__), "labware_definition")
-        return os.listdir(path)
+        return [f for f in os.listdir(path) if f.endswith(".json")]
+
+    @staticmethod
+    def compile_definitions(
+        path: str = os.path.join(os.path.dirname(__file__), "labware_definition"),
+    ):
+        """Parse every labware definition in a folder and save the result next to them.
+
+        Labware loaded from the folder afterwards, in this or any later process, skips parsing the
+        `.json` files and building their well geometry. Definitions edited after compiling are
+        parsed again as usual, so compiling is only ever needed again to regain the speed-up.
+
+        :param path: Path to the folder containing the configuration `.json` files for the labware,
+                defaults to the 'labware_definition/' in the science_jubilee/labware directory.
+        :type path: str, optional
+        :return: The path of the compiled cache file
+        :rtype: str
+        """
+        paths = [
+            os.path.join(path, f)
+            for f in sorted(os.listdir(path))
+            if f.endswith(".json")
+        ]
+        for config_path in paths:
+            definitions.compiled(config_path, "geometry", Labware._compile_geometry)
+        cache_file = os.path.join(path, COMPILED_CACHE)
+        definitions.save(paths, cache_file)
+        return cache_file
 
 
 ## Adapted from Opentrons API  opentrons.types##
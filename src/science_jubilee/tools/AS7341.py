@@ -4,15 +4,18 @@ import time
 import warnings
 from typing import Any, Dict, List, Optional, Union
 
-import serial
-from serial.tools import list_ports
-
 from science_jubilee.tools.Tool import (
     Tool,
     ToolConfigurationError,
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.Tracing import traced
+
+# Imported on first use, so that loading the tool stays fast
+serial = lazy_import("serial")
+list_ports = lazy_import("serial.tools.list_ports")
 
 
 class AS7341(Tool):
@@ -55,7 +58,7 @@ class AS7341(Tool):
                 "Error: Not enough information provided in configuration file."
             )
 
-    def find_seeed(self) -> List[serial.Serial]:
+    def find_seeed(self) -> "List[serial.Serial]":
         """Find all Seeed Studio or Espressif devices connected to the system
 
         :return: List of serial ports for connected Seeed devices
@@ -90,7 +93,7 @@ class AS7341(Tool):
         # Return Serial objects
         return ser_list
 
-    def connect_seeed(self, ser_port_index: int = 0) -> serial.Serial:
+    def connect_seeed(self, ser_port_index: int = 0) -> "serial.Serial":
         """Connect to a Seeed device at the specified port index
 
         :param ser_port_index: Index of the serial port to connect to, defaults to 0
@@ -175,6 +178,7 @@ class AS7341(Tool):
 
         self.serial_port.write(bcmd)
 
+    @traced
     def measure_spectrum(self, duty_cycle: int = 100) -> Dict[str, Any]:
         """Measure the spectral values from the AS7341 sensor
 
@@ -200,6 +204,10 @@ class AS7341(Tool):
         cmd += self.lineEnding
         bcmd = cmd.encode()
 
+        if self._machine is not None:
+            # Measure at the final position, not on the way there
+            self._machine.sync()
+
         # Clear buffers
         self.serial_port.reset_output_buffer()
         self.serial_port.reset_input_buffer()
@@ -276,6 +284,10 @@ class AS7341(Tool):
         cmd += self.lineEnding
         bcmd = cmd.encode()
 
+        if self._machine is not None:
+            # Measure at the final position, not on the way there
+            self._machine.sync()
+
         # Clear buffers
         self.serial_port.reset_output_buffer()
         self.serial_port.reset_input_buffer()
@@ -1,21 +1,26 @@
-import platform
 import time
-
-import cv2
-import matplotlib
-import numpy as np
-
-matplotlib.use("TkAgg")
 from typing import Tuple
 
-import yaml
-from matplotlib import pyplot as plt
+import numpy as np
 
 from science_jubilee.labware.Labware import Well
 from science_jubilee.tools.Tool import Tool, requires_active_tool
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.Tracing import traced
+
+
+def _use_tk():
+    import matplotlib
+
+    matplotlib.use("TkAgg")
+
 
-if platform.system() == "Linux":
-    import picamera  # Note that this can only be installed on raspbery pi.
+# Imported on first use, so that loading the tool stays fast
+cv2 = lazy_import("cv2")
+yaml = lazy_import("yaml")
+plt = lazy_import("matplotlib.pyplot", before=_use_tk)
+# Note that this can only be installed on raspbery pi.
+picamera = lazy_import("picamera")
 
 
 class Camera(Tool):
@@ -165,6 +170,7 @@ class Camera(Tool):
         cv2.destroyAllWindows()
 
     @requires_active_tool
+    @traced
     def image_wells(self, resolution=[1200, 1200], uvc=False, wells: Well = None):
         """Move to a number of wells to take and show images.
 
@@ -181,14 +187,14 @@ class Camera(Tool):
 
         for well in wells:
             x, y, z_bottom = self._get_xyz(well=well)
-            self._machine.safe_z_movement()
-            self._machine.move_to(x=x, y=y)
-            self._machine.move_to(z=30)  # focus height; read in from config
-            time.sleep(1)  # ToDo: Better way to sync gcode movements & images
+            self._machine.travel_to(x=x, y=y, z=30)  # focus height; read in from config
+            self._machine.sync()
+            time.sleep(1)  # let the camera settle before grabbing a frame
             f = self.get_frame()
             self.show_frame(f)
 
     @requires_active_tool
+    @traced
     def get_well_image(self, resolution=[1200, 1200], uvc=False, well: Well = None):
         """Move to a single well to take a picture and return the frame.
 
@@ -202,10 +208,9 @@ class Camera(Tool):
         :rtype: ndarray
         """
         x, y, z_bottom = self._get_xyz(well=well)
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=30)  # focus height; read in from config
-        time.sleep(1)  # ToDo: Better way to sync gcode movements & images
+        self._machine.travel_to(x=x, y=y, z=30)  # focus height; read in from config
+        self._machine.sync()
+        time.sleep(1)  # let the camera settle before grabbing a frame
         f = self.get_frame()
         return f
 
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -15,6 +16,9 @@ from science_jubilee.tools.Tool import (
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.AsyncTransport import AsyncHTTPClient
+from science_jubilee.utils.Retry import RetryPolicy
+from science_jubilee.utils.Tracing import traced
 
 
 class HTTPSyringe(Tool):
@@ -26,15 +30,16 @@ class HTTPSyringe(Tool):
         print("Syringe name: ", name)
         self.name = name
         self.index = index
+        self.retry_policy = RetryPolicy()
         # get config things from HTTP interface
-        config_r = requests.post(url + "/get_config", json={"name": name})
+        config_r = self._request(url, "/get_config", {"name": name}, idempotent=True)
 
         config = config_r.json()
         print(config)
 
         super().__init__(index, **config, url=url)
 
-        status_r = requests.post(url + "/get_status", json={"name": name})
+        status_r = self._request(url, "/get_status", {"name": name}, idempotent=True)
 
         status = status_r.json()
 
@@ -43,6 +48,12 @@ class HTTPSyringe(Tool):
 
         return
 
+    def _request(self, url, endpoint, data, idempotent=False):
+        """POST to the syringe server; only idempotent requests are retried once they arrived."""
+        return self.retry_policy.request(
+            requests, "POST", url + endpoint, idempotent=idempotent, json=data
+        )
+
     @classmethod
     def from_config(cls, index, fp):
         with open(fp) as f:
@@ -55,7 +66,7 @@ class HTTPSyringe(Tool):
         Fetch and update status
         """
 
-        r = requests.post(self.url + "/get_status", json={"name": self.name})
+        r = self._request(self.url, "/get_status", {"name": self.name}, idempotent=True)
         status = r.json()
 
         self.syringe_loaded = status["syringe_loaded"]
@@ -76,7 +87,7 @@ class HTTPSyringe(Tool):
         data["pulsewidth"] = pulsewidth
         data["name"] = self.name
 
-        requests.post(self.url + "/load_syringe", json=data)
+        self._request(self.url, "/load_syringe", data)
 
         status = self.status()
 
@@ -94,13 +105,15 @@ class HTTPSyringe(Tool):
             vol < self.capacity - self.remaining_volume
         ), f"Error: Syringe {self.name} available volume is {self.capacity - self.remaining_volume} uL, {vol} mL aspiration requested"
 
-        r = requests.post(
-            self.url + "/aspirate", json={"volume": vol, "name": self.name, "speed": s}
+        r = self._request(
+            self.url, "/aspirate", {"volume": vol, "name": self.name, "speed": s}
         )
 
         assert r.status_code == 200, f"Error in aspirate request: {r.content}"
 
-        status_r = requests.post(self.url + "/get_status", json={"name": self.name})
+        status_r = self._request(
+            self.url, "/get_status", {"name": self.name}, idempotent=True
+        )
 
         status_dict = status_r.json()
 
@@ -117,18 +130,21 @@ class HTTPSyringe(Tool):
             vol <= self.remaining_volume
         ), f"Error: Syringe {self.name} remaining volume is {self.remaining_volume} uL, but {vol} uL dispense requested"
 
-        r = requests.post(
-            self.url + "/dispense", json={"volume": vol, "name": self.name, "speed": s}
+        r = self._request(
+            self.url, "/dispense", {"volume": vol, "name": self.name, "speed": s}
         )
 
         assert r.status_code == 200, f"Error in dispense request: {r.content}"
 
-        status_r = requests.post(self.url + "/get_status", json={"name": self.name})
+        status_r = self._request(
+            self.url, "/get_status", {"name": self.name}, idempotent=True
+        )
         status_dict = status_r.json()
         self.remaining_volume = status_dict["remaining_volume"]
         return
 
     @requires_active_tool
+    @traced
     def dispense(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 100
     ):
@@ -156,12 +172,12 @@ class HTTPSyringe(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y, wait=True)
-        self._machine.move_to(z=z, wait=True)
+        self._machine.travel_to(x=x, y=y, z=z)
+        self._machine.sync()
         self._dispense(vol, s)
 
     @requires_active_tool
+    @traced
     def aspirate(
         self,
         vol: float,
@@ -189,14 +205,14 @@ class HTTPSyringe(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y, wait=True)
-        self._machine.move_to(z=z, wait=True)
+        self._machine.travel_to(x=x, y=y, z=z)
+        self._machine.sync()
         time.sleep(dwell_before)
         self._aspirate(vol, s)
         time.sleep(dwell_after)
 
     @requires_active_tool
+    @traced
     def mix(
         self,
         vol: float,
@@ -229,12 +245,13 @@ class HTTPSyringe(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y, wait=True)
+        self._machine.travel_to(x=x, y=y)
+        self._machine.sync()
         self._aspirate(
             0.05 * self.capacity, s_aspirate
         )  # pre-aspirate 500 uL then blow this out at the end to avoid holding onto extra solution
-        self._machine.move_to(z=z, wait=True)
+        self._machine.move_to(z=z)
+        self._machine.sync()
 
         for _ in range(n_mix):
             self._aspirate(vol, s_aspirate)
@@ -259,11 +276,196 @@ class HTTPSyringe(Tool):
         assert pulsewidth > self.full_position
         assert pulsewidth < self.empty_position
 
-        r = requests.post(
-            self.url + "/set_pulsewidth",
-            json={"pulsewidth": pulsewidth, "name": self.name, "speed": s},
+        r = self._request(
+            self.url,
+            "/set_pulsewidth",
+            {"pulsewidth": pulsewidth, "name": self.name, "speed": s},
         )
 
         status = self.status()
 
         return
+
+
+class AsyncHTTPSyringe(HTTPSyringe):
+    """Awaitable version of :class:`HTTPSyringe`, for use with :class:`AsyncMachine`.
+
+    The syringe server is queried without blocking the event loop, so other instruments and the
+    machine can be driven while a syringe aspirates or dispenses. The syringe configuration is
+    still read when the tool is created.
+    """
+
+    def __init__(self, index, name, url):
+        super().__init__(index, name, url)
+        self._client = AsyncHTTPClient(retry_policy=self.retry_policy)
+
+    async def _post(self, endpoint, data, idempotent=False):
+        return await self._client.post(
+            self.url + endpoint, json=data, idempotent=idempotent
+        )
+
+    async def status(self):
+        """
+        Fetch and update status
+        """
+        status = (
+            await self._post("/get_status", {"name": self.name}, idempotent=True)
+        ).json()
+
+        self.syringe_loaded = status["syringe_loaded"]
+        self.remaining_volume = status["remaining_volume"]
+
+        return status
+
+    async def load_syringe(self, volume, pulsewidth):
+        """
+        Configure a syringe after physically loading it
+
+        volume: Current loaded volume in syringe
+        pulsewidth: current pulsewidth position of servo
+        """
+        data = {"volume": volume, "pulsewidth": pulsewidth, "name": self.name}
+        await self._post("/load_syringe", data)
+
+        status = await self.status()
+
+        print(f'Loaded syringe, remaining volume {status["remaining_volume"]} uL')
+
+    @requires_active_tool
+    async def _aspirate(self, vol, s):
+        assert isinstance(vol, float) or isinstance(
+            vol, int
+        ), "Vol must be float or int"
+
+        assert (
+            vol < self.capacity - self.remaining_volume
+        ), f"Error: Syringe {self.name} available volume is {self.capacity - self.remaining_volume} uL, {vol} mL aspiration requested"
+
+        r = await self._post(
+            "/aspirate", {"volume": vol, "name": self.name, "speed": s}
+        )
+
+        assert r.status_code == 200, f"Error in aspirate request: {r.content}"
+
+        await self.status()
+
+    @requires_active_tool
+    async def _dispense(self, vol, s):
+        assert isinstance(vol, float) or isinstance(
+            vol, int
+        ), "Vol must be float or int"
+        assert (
+            vol <= self.remaining_volume
+        ), f"Error: Syringe {self.name} remaining volume is {self.remaining_volume} uL, but {vol} uL dispense requested"
+
+        r = await self._post(
+            "/dispense", {"volume": vol, "name": self.name, "speed": s}
+        )
+
+        assert r.status_code == 200, f"Error in dispense request: {r.content}"
+
+        await self.status()
+
+    @requires_active_tool
+    async def dispense(
+        self, vol: float, location: Union[Well, Tuple, Location], s: int = 100
+    ):
+        """Moves the pipette to the specified location and dispenses the desired volume of liquid
+
+        :param vol: The volume of liquid to dispense in uL
+        :type vol: float
+        :param location: The location to dispense the liquid into.
+        :type location: Union[Well, Tuple, Location]
+        :param s: Speed at which to dispense. Best effort compliance based on constraints of system. uL/S
+        :type s: int
+        """
+        x, y, z = Labware._getxyz(location)
+
+        if type(location) == Well:
+            self.current_well = location
+            if z == location.z:
+                z = z + 10
+        elif type(location) == Location:
+            self.current_well = location._labware
+
+        await self._machine.travel_to(x=x, y=y, z=z)
+        await self._machine.sync()
+        await self._dispense(vol, s)
+
+    @requires_active_tool
+    async def aspirate(
+        self,
+        vol: float,
+        location: Union[Well, Tuple, Location],
+        s: int = 100,
+        dwell_before=0,
+        dwell_after=0,
+    ):
+        """Moves the pipette to the specified location and aspirates the desired volume of liquid
+
+        :param vol: The volume of liquid to aspirate in uL
+        :type vol: float
+        :param location: The location from where to aspirate the liquid from.
+        :type location: Union[Well, Tuple, Location]
+        :param s: Speed at which to aspirate. Best effort compliance based on constraints of system. uL/S.
+        :type s: int
+        """
+        x, y, z = Labware._getxyz(location)
+
+        if type(location) == Well:
+            self.current_well = location
+        elif type(location) == Location:
+            self.current_well = location._labware
+
+        await self._machine.travel_to(x=x, y=y, z=z)
+        await self._machine.sync()
+        await asyncio.sleep(dwell_before)
+        await self._aspirate(vol, s)
+        await asyncio.sleep(dwell_after)
+
+    @requires_active_tool
+    async def mix(
+        self,
+        vol: float,
+        n_mix: int,
+        location: Union[Well, Tuple, Location],
+        t_hold: int = 1,
+        s_aspirate: int = 100,
+        s_dispense: int = 100,
+    ):
+        """
+        Mixes n times with volume vol, see :meth:`HTTPSyringe.mix`
+        """
+        x, y, z = Labware._getxyz(location)
+
+        if type(location) == Well:
+            self.current_well = location
+        elif type(location) == Location:
+            self.current_well = location._labware
+
+        await self._machine.travel_to(x=x, y=y)
+        await self._machine.sync()
+        await self._aspirate(0.05 * self.capacity, s_aspirate)
+        await self._machine.move_to(z=z)
+        await self._machine.sync()
+
+        for _ in range(n_mix):
+            await self._aspirate(vol, s_aspirate)
+            await asyncio.sleep(t_hold)
+            await self._dispense(vol, s_dispense)
+            await asyncio.sleep(t_hold)
+
+        await self._dispense(self.capacity * 0.05, s_dispense)
+
+    async def set_pulsewidth(self, pulsewidth: int, s: int = 100):
+        """
+        Manually move the servo actuator to a new location, see :meth:`HTTPSyringe.set_pulsewidth`.
+        """
+        assert pulsewidth > self.full_position
+        assert pulsewidth < self.empty_position
+
+        await self._post(
+            "/set_pulsewidth", {"pulsewidth": pulsewidth, "name": self.name, "speed": s}
+        )
+
+        await self.status()
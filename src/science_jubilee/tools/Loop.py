@@ -8,6 +8,7 @@ import numpy as np
 
 from science_jubilee.labware.Labware import Well
 from science_jubilee.tools.Tool import Tool, requires_active_tool
+from science_jubilee.utils.Tracing import traced
 
 
 class Loop(Tool):
@@ -22,6 +23,7 @@ class Loop(Tool):
         super().__init__(index, name)
 
     @requires_active_tool
+    @traced
     def transfer(
         self,
         source: Well = None,
@@ -97,9 +99,7 @@ class Loop(Tool):
                 ys += ry
             xd, yd, zd = self._get_xyz(well=destination_well)
 
-            self._machine.safe_z_movement()
-            self._machine.move_to(x=xs, y=ys)
-            self._machine.move_to(z=zs + 5)
+            self._machine.travel_to(x=xs, y=ys, z=zs + 5)
             # slowly sweep in the reservoir to pick up duckweed
             # can tune these default values
             self._machine.move(dx=sweep_x, s=sweep_speed)
@@ -108,9 +108,7 @@ class Loop(Tool):
             self.current_well = source_well
             # self._aspirate(vol, s=s)
 
-            self._machine.safe_z_movement()
-            self._machine.move_to(x=xd, y=yd)
-            self._machine.move_to(z=zd + 5)
+            self._machine.travel_to(x=xd, y=yd, z=zd + 5)
             # sweep again to drop off duckweed
             # make smaller movements and move opposite direction
             self._machine.move(dx=sweep_x / 2, s=sweep_speed)
@@ -11,6 +11,7 @@ from science_jubilee.tools.Tool import (
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.Tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -137,7 +138,7 @@ class Pipette(Tool):
         :param s: The speed of the plunger movement in mm/min
         :type s: int
         """
-        self._machine.move_to(v=self.zero_position, s=s, wait=True)
+        self._machine.move_to(v=self.zero_position, s=s)
         self.is_primed = True
 
     @requires_active_tool
@@ -162,6 +163,7 @@ class Pipette(Tool):
 
     @requires_active_tool
     @tip_check
+    @traced
     def aspirate(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
@@ -184,9 +186,7 @@ class Pipette(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
         self._aspirate(vol, s=s)
 
     @requires_active_tool
@@ -214,6 +214,7 @@ class Pipette(Tool):
 
     @requires_active_tool
     @tip_check
+    @traced
     def dispense(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
@@ -240,12 +241,11 @@ class Pipette(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
         self._dispense(vol, s=s)
 
     @requires_active_tool
+    @traced
     def transfer(
         self,
         vol: Union[float, list[float]],
@@ -362,12 +362,8 @@ class Pipette(Tool):
 
                 # --------------- Aspirate ----------------
 
-                self._machine.safe_z_movement()
-                self._machine.move_to(x=xs, y=ys)
-
                 self.current_well = src
-
-                self._machine.move_to(z=zs)
+                self._machine.travel_to(x=xs, y=ys, z=zs)
                 self._aspirate(step_vol, s=s)
 
                 if air_gap > 0:
@@ -383,13 +379,11 @@ class Pipette(Tool):
 
                 # --------------- Dispense  ----------------
 
-                self._machine.safe_z_movement()
-                self._machine.move_to(x=xd, y=yd)
                 if type(dest) == Well:
                     self.current_well = dest
                 elif type(dest) == Location:
                     self.current_well = dest._labware
-                self._machine.move_to(z=zd)
+                self._machine.travel_to(x=xd, y=yd, z=zd)
                 self._dispense(step_vol, s=s)
 
                 # mix after dispensing into destination well
@@ -554,6 +548,7 @@ class Pipette(Tool):
 
     @requires_active_tool
     @tip_check
+    @traced
     def mix(self, vol: float, n: int, s: int = 5500):
         """Mixes liquid by alternating aspirate and dispense steps for the specified number of times
 
@@ -665,12 +660,14 @@ class Pipette(Tool):
         """
         if self.has_tip == False:
             # self._machine.move_to(z=z-10 , s=1200) # test this- we might benefit from a faster approach to pickingup pipette and then slowing down
-            self._machine.move_to(z=z, s=800, param="H4")
+            self._machine.sync()
+            self._machine.move_to(z=z, s=800, param="H4", wait=True)
         else:
             raise ToolStateError("Error: Pipette already equipped with a tip.")
         # TODO: Should this be an error or a warning?
 
     @requires_active_tool
+    @traced
     def pickup_tip(self, tip_: Union[Well, Tuple] = None):
         """Moves the pipette to the specified location and picks up a tip
 
@@ -689,8 +686,7 @@ class Pipette(Tool):
             tip_.set_clean_tip(False)
 
         x, y, z = Labware._getxyz(tip)
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
+        self._machine.travel_to(x=x, y=y)
         self._pickup_tip(z)
         self.has_tip = True
         self.update_z_offset(tip=True)
@@ -698,6 +694,7 @@ class Pipette(Tool):
         self._machine.move_to(z=self._machine.deck.safe_z + 10)
 
     @requires_active_tool
+    @traced
     def return_tip(self, location: Well = None):
         """Returns the pipette tip to the either the specified location or to where the tip was picked up from
 
@@ -719,10 +716,8 @@ class Pipette(Tool):
             w
         )  # this will still setthe pipette tip as not clean!
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
         # z moves up/down to make sure tip actually makes it into rack
-        self._machine.move_to(z=w.bottom_ + 20)
+        self._machine.travel_to(x=x, y=y, z=w.bottom_ + 20)
         self._drop_tip()
         self.prime()
         self._machine.move_to(z=w.bottom_ + 30)
@@ -740,6 +735,7 @@ class Pipette(Tool):
 
     @requires_active_tool
     @tip_check
+    @traced
     def drop_tip(self, location: Union[Well, Tuple] = None):
         """Moves the pipette to the specified location and drops the pipette tip
 
@@ -756,8 +752,7 @@ class Pipette(Tool):
                 "Error: No location specified to drop tip into. Either specify a location or set the trash location for the Pipette"
             )
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
+        self._machine.travel_to(x=x, y=y)
         self._drop_tip()
         self.prime()
         self.has_tip = False
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 from typing import Optional
@@ -12,6 +13,9 @@ from science_jubilee.tools.Tool import (
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.AsyncTransport import AsyncHTTPClient, maybe_await
+from science_jubilee.utils.Retry import RetryPolicy
+from science_jubilee.utils.Tracing import traced
 
 
 class PneumaticSampleLoader(Tool):
@@ -36,14 +40,23 @@ class PneumaticSampleLoader(Tool):
         self.password = password
 
         self.arm_down_delay = 10
+        self.retry_policy = RetryPolicy()
 
         self.login()
         self.update_status()
         self.index = None
 
+    def _request(self, method, endpoint, idempotent=None, **kwargs):
+        """Request an endpoint of the loader; only idempotent requests are retried once they arrived."""
+        return self.retry_policy.request(
+            requests, method, self.url + endpoint, idempotent=idempotent, **kwargs
+        )
+
     def login(self):
-        r = requests.post(
-            self.url + "/login",
+        r = self._request(
+            "POST",
+            "/login",
+            idempotent=True,
             json={"username": self.username, "password": self.password},
         )
 
@@ -58,6 +71,7 @@ class PneumaticSampleLoader(Tool):
         return cls(index, **kwargs)
 
     # @requires_active_tool
+    @traced
     def load_sample(self, tool, sample_location: str, volume) -> bool:
         """
         Load a sample into the sample cell using pneumatic pressure.
@@ -84,11 +98,8 @@ class PneumaticSampleLoader(Tool):
         tool.aspirate(volume, sample_location)
         tool.dispense(volume, self.cell_location)
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(z=self.safe_position[2])
-        self._machine.move_to(
-            x=self.safe_position[0], y=self.safe_position[1], z=self.safe_position[2]
-        )
+        self._machine.travel_to(tuple(self.safe_position))
+        self._machine.sync()
 
         self._load_sample(volume)
 
@@ -167,7 +178,7 @@ class PneumaticSampleLoader(Tool):
                  and current pressure settings.
         """
         # Get status from HTTP endpoint
-        r = requests.get(self.url + "/driver_status", headers=self.auth_header)
+        r = self._request("GET", "/driver_status", headers=self.auth_header)
         # print("status r code", r.status_code)
         # print("status: ", r.content)
         status_str = r.content.decode("utf-8")
@@ -222,7 +233,7 @@ class PneumaticSampleLoader(Tool):
         returns task uuid
         """
 
-        r = requests.post(self.url + "/enqueue", headers=self.auth_header, json=task)
+        r = self._request("POST", "/enqueue", headers=self.auth_header, json=task)
 
         if r.status_code != 200:
             raise Exception(f"Error enqueuing task: {r.json()}")
@@ -231,8 +242,12 @@ class PneumaticSampleLoader(Tool):
 
     def unpause_queue(self):
 
-        r = requests.post(
-            self.url + "/pause", headers=self.auth_header, json={"state": False}
+        r = self._request(
+            "POST",
+            "/pause",
+            idempotent=True,
+            headers=self.auth_header,
+            json={"state": False},
         )
 
         if r.status_code != 200:
@@ -242,8 +257,12 @@ class PneumaticSampleLoader(Tool):
 
     def pause_queue(self):
 
-        r = requests.post(
-            self.url + "/pause", headers=self.auth_header, json={"state": True}
+        r = self._request(
+            "POST",
+            "/pause",
+            idempotent=True,
+            headers=self.auth_header,
+            json={"state": True},
         )
 
         if r.status_code != 200:
@@ -256,12 +275,7 @@ class PneumaticSampleLoader(Tool):
         Check if currentlu in safe postion, and if not, move to it
         """
         if not self.get_safety_state():
-            self._machine.safe_z_movement()
-            self._machine.move_to(
-                x=self.safe_position[0],
-                y=self.safe_position[1],
-                z=self.safe_position[2],
-            )
+            self._machine.travel_to(tuple(self.safe_position))
 
         return
 
@@ -283,3 +297,187 @@ class PneumaticSampleLoader(Tool):
             return False
 
         return True
+
+
+class AsyncPneumaticSampleLoader(PneumaticSampleLoader):
+    """Awaitable version of :class:`PneumaticSampleLoader`, for use with :class:`AsyncMachine`.
+
+    Waiting for the loader to prepare, load or rinse the cell no longer blocks, so the machine and
+    other instruments can be driven in the meantime. Call :meth:`connect` before use.
+    """
+
+    def __init__(
+        self, url, port, name, cell_location, safe_position, username, password
+    ):
+        self.name = name
+        self.url = url + ":" + port
+        self.port = port
+        self.safe_position = safe_position
+        self.cell_location = cell_location
+
+        self.username = username
+        self.password = password
+
+        self.arm_down_delay = 10
+        self.poll_interval = 1
+
+        self.auth_header = None
+        self.status_list = []
+        self.cell_state, self.arm_state = "UNKNOWN", "UNKNOWN"
+        self.index = None
+        self.retry_policy = RetryPolicy()
+        self._client = AsyncHTTPClient(retry_policy=self.retry_policy)
+
+    async def connect(self):
+        """Log in to the sample loader and read its status."""
+        await self.login()
+        await self.update_status()
+        return self
+
+    async def login(self):
+        r = await self._client.post(
+            self.url + "/login",
+            idempotent=True,
+            json={"username": self.username, "password": self.password},
+        )
+
+        token = r.json()["token"]
+        self.auth_header = {"Authorization": f"Bearer {token}"}
+
+    async def load_sample(self, tool, sample_location: str, volume) -> bool:
+        """
+        Load a sample into the sample cell, see :meth:`PneumaticSampleLoader.load_sample`.
+        The tool may be a synchronous or an asynchronous pipette-like tool.
+        """
+        await self.prepare_cell()
+
+        # verify arm is raised
+        if self.arm_state != "UP":
+            raise ValueError("Arm is not raised")
+
+        # sample transfer
+        if await self._machine.active_tool_index() != tool.index:
+            await self._machine.park_tool()
+            await self._machine.pickup_tool(tool)
+
+        await maybe_await(tool.aspirate(volume, sample_location))
+        await maybe_await(tool.dispense(volume, self.cell_location))
+
+        await self._machine.travel_to(tuple(self.safe_position))
+        await self._machine.sync()
+
+        await self._load_sample(volume)
+
+    async def rinse_cell(self) -> bool:
+        """
+        Clean the sample cell, see :meth:`PneumaticSampleLoader.rinse_cell`.
+        """
+        await self._safe_position()
+        await self._rinse_cell()
+
+    async def prepare_cell(self):
+        """
+        Prepare the cell for loading - raise arm and make sure it is clean
+        """
+        if await self.get_cell_state() not in ("RINSED", "READY"):
+            await self.rinse_cell()
+
+        await self._safe_position()
+
+        await self._prepare_load()
+
+        await self.update_status()
+
+    async def _wait_for_cell_state(self, state: str):
+        """Poll the loader until the cell reaches `state`."""
+        while await self.get_cell_state() != state:
+            await asyncio.sleep(self.poll_interval)
+
+    async def _prepare_load(self):
+        await self.enqueue({"task_name": "prepareLoad"})
+        await self._wait_for_cell_state("READY")
+
+    async def _load_sample(self, volume):
+        await self.enqueue({"task_name": "loadSample", "sampleVolume": volume})
+        await self._wait_for_cell_state("LOADED")
+
+    async def _rinse_cell(self):
+        await self.enqueue({"task_name": "rinseCell"})
+        await self._wait_for_cell_state("RINSED")
+
+    async def update_status(self) -> dict:
+        """
+        Get the current status of the sample loader.
+        """
+        r = await self._client.get(
+            self.url + "/driver_status", headers=self.auth_header
+        )
+
+        self.status_list = json.loads(r.text)
+        self.cell_state, self.arm_state = self.parse_state(self.status_list)
+
+    async def get_cell_state(self) -> str:
+        """
+        Get the current state of the sample cell, e.g. 'LOADED' or 'IDLE'.
+        """
+        await self.update_status()
+        return self.cell_state
+
+    async def enqueue(self, task: dict):
+        """
+        Enqueue a task to be executed by the pneumatic sample loader.
+
+        returns task uuid
+        """
+        r = await self._client.post(
+            self.url + "/enqueue", headers=self.auth_header, json=task
+        )
+
+        if r.status_code != 200:
+            raise Exception(f"Error enqueuing task: {r.json()}")
+
+        return r.text
+
+    async def _set_paused(self, state: bool):
+        r = await self._client.post(
+            self.url + "/pause",
+            idempotent=True,
+            headers=self.auth_header,
+            json={"state": state},
+        )
+
+        if r.status_code != 200:
+            action = "pausing" if state else "unpausing"
+            raise Exception(f"Error {action} queue: {r.json()}")
+
+    async def unpause_queue(self):
+        await self._set_paused(False)
+
+    async def pause_queue(self):
+        await self._set_paused(True)
+
+    async def _safe_position(self):
+        """
+        Check if currently in safe position, and if not, move to it
+        """
+        if not await self.get_safety_state():
+            await self._machine.travel_to(tuple(self.safe_position))
+
+    async def get_safety_state(self):
+        """
+        Returns the safety state of the machine.
+        """
+        pos = await self._machine.get_position()
+        x, y, z = float(pos["X"]), float(pos["Y"]), float(pos["Z"])
+
+        # Check if position is within safe bounds
+        if x > self.safe_position[0]:
+            return False
+
+        if y < self.safe_position[1]:
+            return False
+
+        if z < self.safe_position[2]:
+            return False
+
+        return True
@@ -5,6 +5,7 @@ from typing import Tuple, Union
 
 from science_jubilee.labware.Labware import Labware, Location, Well
 from science_jubilee.tools.Tool import Tool
+from science_jubilee.utils.Tracing import traced
 
 
 class PumpDispenser(Tool):
@@ -101,6 +102,7 @@ class PumpDispenser(Tool):
         ), "location must be a well, tuple, or location"
         self.waste = location
 
+    @traced
     def dispense(
         self,
         vol: Union[float, int, list],
@@ -157,12 +159,11 @@ class PumpDispenser(Tool):
                 x_tip = x + tip_offsets[0]
                 y_tip = y + tip_offsets[1]
 
-                self._machine.safe_z_movement()
-                self._machine.move_to(x=x_tip, y=y_tip)
-                self._machine.move_to(z=z)
+                self._machine.travel_to(x=x_tip, y=y_tip, z=z)
 
                 self.pump_group.pump(iter_vol)
 
+    @traced
     def prime_lines(
         self,
         volume: Union[int, float] = None,
@@ -202,9 +203,7 @@ class PumpDispenser(Tool):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
 
         self.pump_group.pump(volume)
 
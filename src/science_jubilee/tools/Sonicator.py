@@ -2,10 +2,14 @@ import logging
 import time
 from typing import List, Tuple, Union
 
-import serial
-
 from science_jubilee.labware.Labware import Labware, Location, Well
 from science_jubilee.tools.Tool import Tool, requires_active_tool
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.Tracing import traced
+
+serial = lazy_import(
+    "serial"
+)  # Imported on first use, so that loading the tool stays fast
 
 logger = logging.getLogger(__name__)
 
@@ -192,6 +196,7 @@ class Sonicator(Tool):
         self._set_sonication_power(0.0)
 
     @requires_active_tool
+    @traced
     def sonicate_well(
         self,
         location: Union[Well, Tuple, Location],
@@ -257,9 +262,8 @@ class Sonicator(Tool):
 
         x, y, z = Labware._getxyz(location)
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)  # Position over the well at safe z height.
-        self._machine.move_to(z=plunge_height, wait=True)
+        self._machine.travel_to(x=x, y=y, z=plunge_height)
+        self._machine.sync()
         print(f"Sonicating for {sonication_time} seconds!!")
         self._sonicate(
             sonication_time, power, pulse_duty_cycle, pulse_interval, verbose=verbose
@@ -4,7 +4,6 @@ import os
 from datetime import date
 from typing import Tuple, Union
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 # this is the Ocean Optics SDK, which is (very unfortunately) not open-source
@@ -17,6 +16,7 @@ except ImportError:
 
 from science_jubilee.labware.Labware import Labware, Location, Well
 from science_jubilee.tools.Tool import Tool, requires_active_tool
+from science_jubilee.utils.Tracing import traced
 
 
 class SpectroscopyTool(Tool, OceanDirectAPI):
@@ -37,7 +37,7 @@ class SpectroscopyTool(Tool, OceanDirectAPI):
     @property
     def _api_version(self):
         """The version of the Ocean Insight SDK"""
-        (major, minor, point) = self.connection.get_api_version_numbers()
+        major, minor, point = self.connection.get_api_version_numbers()
         API_vers = "%d.%d.%d" % (major, minor, point)
         return API_vers
 
@@ -261,6 +261,7 @@ class SpectroscopyTool(Tool, OceanDirectAPI):
         return spectrum
 
     @requires_active_tool
+    @traced
     def collect_spectrum(
         self,
         location: Union[Well, Tuple, Location],
@@ -283,9 +284,8 @@ class SpectroscopyTool(Tool, OceanDirectAPI):
         else:
             pass
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
+        self._machine.sync()
         intensities = self._collect_raw_spectrum(
             int_time, scan_num, boxcar_w, int_time_units=int_time_units
         )
@@ -12,6 +12,7 @@ from science_jubilee.tools.Tool import (
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.Tracing import traced
 
 
 class Syringe(Tool):
@@ -63,8 +64,10 @@ class Syringe(Tool):
 
         # To read the position of an extruder, we need to know which extruder number to look at
         # Query the object model to find this
-        tool_info = json.loads(self._machine.gcode('M409 K"tools[]"'))["result"]
+        tool_info = self._machine.object_model.get("tools")
         for tool in tool_info:
+            if tool is None:
+                continue
             if tool["number"] == self.index:
                 self.e_drive = (
                     f"E{tool['extruders'][0]}"  # Syringe tool has only 1 extruder
@@ -92,7 +95,7 @@ class Syringe(Tool):
         :type s: int, optional
         """
         de = vol * self.mm_to_ml
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
     def retract_syringe(self, vol: float, s: int = 2000):
@@ -104,7 +107,7 @@ class Syringe(Tool):
         :type s: int, optional
         """
         de = vol * -1 * self.mm_to_ml
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
     def _aspirate(self, vol: float, s: int = 2000):
@@ -119,7 +122,7 @@ class Syringe(Tool):
         pos = self._machine.get_position()
         end_pos = float(pos[self.e_drive]) + de
         self.check_bounds(end_pos)
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
     def _dispense(self, vol, s: int = 2000):
@@ -134,9 +137,10 @@ class Syringe(Tool):
         pos = self._machine.get_position()
         end_pos = float(pos[self.e_drive]) + de
         self.check_bounds(end_pos)
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
+    @traced
     def aspirate(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
@@ -151,12 +155,11 @@ class Syringe(Tool):
         """
         x, y, z = Labware._getxyz(location)
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
         self._aspirate(vol, s=s)
 
     @requires_active_tool
+    @traced
     def dispense(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
@@ -172,12 +175,11 @@ class Syringe(Tool):
         """
         x, y, z = Labware._getxyz(location)
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y)
-        self._machine.move_to(z=z)
+        self._machine.travel_to(x=x, y=y, z=z)
         self._dispense(vol, s=s)
 
     @requires_active_tool
+    @traced
     def mix(self, vol: float, n: int, s: int = 5500):
         """Mixes liquid by alternating aspirate and dispense steps for the specified number of times
 
@@ -198,6 +200,7 @@ class Syringe(Tool):
             self._dispense(vol, s=s)
 
     @requires_active_tool
+    @traced
     def transfer(
         self,
         vol: float,
@@ -257,9 +260,7 @@ class Syringe(Tool):
             xs, ys, zs = Labware._getxyz(source_well)
             xd, yd, zd = Labware._getxyz(destination_well)
 
-            self._machine.safe_z_movement()
-            self._machine.move_to(x=xs, y=ys)
-            self._machine.move_to(z=zs + 5)
+            self._machine.travel_to(x=xs, y=ys, z=zs + 5)
             self.current_well = source_well
             self._aspirate(vol, s=s)
 
@@ -268,9 +269,7 @@ class Syringe(Tool):
             #             else:
             #                 pass
 
-            self._machine.safe_z_movement()
-            self._machine.move_to(x=xd, y=yd)
-            self._machine.move_to(z=zd + 5)
+            self._machine.travel_to(x=xd, y=yd, z=zd + 5)
             self.current_well = destination_well
             self._dispense(vol, s=s)
 
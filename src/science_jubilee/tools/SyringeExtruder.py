@@ -13,6 +13,7 @@ from science_jubilee.tools.Tool import (
     ToolStateError,
     requires_active_tool,
 )
+from science_jubilee.utils.Tracing import traced
 
 
 class SyringeExtruder(Tool):
@@ -67,7 +68,7 @@ class SyringeExtruder(Tool):
 
         # To read the position of an extruder, we need to know which extruder number to look at
         # Query the object model to find this
-        tool_info = json.loads(self._machine.gcode('M409 K"tools[]"'))["result"]
+        tool_info = self._machine.object_model.get("tools")
         for tool in tool_info:
             if tool is None:
                 continue
@@ -152,6 +153,26 @@ class SyringeExtruder(Tool):
         cmd = f"G0 {z_cmd} {x_cmd} {y_cmd} {e_cmd} {f_cmd}"
         self._machine.gcode(cmd)
 
+    @requires_active_tool
+    @traced
+    def extrude_path(self, points: np.ndarray, s=180, multiplier=1, chunk_size=200):
+        """Extrude along a dense path of X/Y/Z points, see :meth:`Machine.stream_path`.
+
+        The same amount is extruded per mm of travel as with :meth:`move_extrude`, but the whole
+        path is computed at once and streamed to the machine in large chunks.
+
+        :param points: The positions to move through, an (N, 3) array of X, Y and Z in mm
+        :type points: :class:`numpy.ndarray`
+        :param s: Speed at which to move in mm/min, defaults to 180
+        :type s: float, optional
+        :param multiplier: Factor applied to the extrusion amount, defaults to 1
+        :type multiplier: float, optional
+        :param chunk_size: The number of commands sent per request, defaults to 200
+        :type chunk_size: int, optional
+        """
+        e_per_mm = 2 * (self.nozzle_diameter / self.syringe_diameter) ** 2 * multiplier
+        self._machine.stream_path(points, s=s, e_per_mm=e_per_mm, chunk_size=chunk_size)
+
     @requires_active_tool
     def _aspirate(self, vol: float, s: int = 2000):
         """Aspirate a certain volume in milliliters. Used only to move the syringe; to aspirate from a particular well, see aspirate()
@@ -165,7 +186,7 @@ class SyringeExtruder(Tool):
         pos = self._machine.get_position()
         end_pos = float(pos[self.e_drive]) + de
         self.check_bounds(end_pos)
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
     def _dispense(self, vol, s: int = 2000):
@@ -180,9 +201,10 @@ class SyringeExtruder(Tool):
         pos = self._machine.get_position()
         end_pos = float(pos[self.e_drive]) + de
         self.check_bounds(end_pos)
-        self._machine.move(de=de, wait=True)
+        self._machine.move(de=de)
 
     @requires_active_tool
+    @traced
     def aspirate(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
@@ -203,6 +225,7 @@ class SyringeExtruder(Tool):
         self._aspirate(vol, s=s)
 
     @requires_active_tool
+    @traced
     def dispense(
         self, vol: float, location: Union[Well, Tuple, Location], s: int = 2000
     ):
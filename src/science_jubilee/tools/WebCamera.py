@@ -1,16 +1,23 @@
+import asyncio
 import json
 import os
 import time
 import webbrowser
 from typing import Tuple, Union
 
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 import requests
 
 from science_jubilee.labware.Labware import Labware, Location, Well
 from science_jubilee.tools.Tool import Tool, requires_active_tool
+from science_jubilee.utils.AsyncTransport import AsyncHTTPClient
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.Retry import RetryPolicy
+from science_jubilee.utils.Tracing import traced
+
+# Imported on first use, so that loading the tool stays fast
+cv2 = lazy_import("cv2")
+plt = lazy_import("matplotlib.pyplot")
 
 
 class Camera(Tool):
@@ -65,6 +72,7 @@ class Camera(Tool):
         )
         self.still_url = f"http://{self.ip_address}:{self.port}/{self.still_endpoint}"
         self.video_url = f"http://{self.ip_address}:{self.port}/{self.video_endpoint}"
+        self.retry_policy = RetryPolicy()
 
         # TODO: Ping camera server and make sure that it is reachable
 
@@ -107,15 +115,18 @@ class Camera(Tool):
         """
         time.sleep(1)
         try:
-            response = requests.get(self.still_url, timeout=timeout)
-        except [ConnectionError, ConnectionRefusedError]:
-            raise AssertionError
+            response = self.retry_policy.request(
+                requests, "GET", self.still_url, timeout=timeout
+            )
+        except requests.ConnectionError as e:
+            raise AssertionError(f"Camera server not reachable: {e}") from e
         time.sleep(2)
         assert response.status_code == 200
 
         return response.content
 
     @requires_active_tool
+    @traced
     def capture_image(
         self,
         location: Union[Well, Tuple],
@@ -138,11 +149,9 @@ class Camera(Tool):
 
         x, y, z = Labware._getxyz(location)
 
-        self._machine.safe_z_movement()
-        self._machine.move_to(x=x, y=y, wait=True)
-
         picture_heigth = self.focus_height - abs(self.tool_offset)
-        self._machine.move_to(z=picture_heigth, wait=True)
+        self._machine.travel_to(x=x, y=y, z=picture_heigth)
+        self._machine.sync()
         if light is True:
             self._machine.gcode(f"M42 P{self.light_pin} S{light_intensity}")
             image = self._capture_image(timeout=timeout)
@@ -248,3 +257,60 @@ class Camera(Tool):
         fig, ax = plt.subplots(figsize=(3, 4))
         plt.setp(plt.gca(), autoscale_on=True)
         ax.imshow(image)
+
+
+class AsyncCamera(Camera):
+    """Awaitable version of :class:`Camera`, for use with :class:`AsyncMachine`.
+
+    Images are fetched without blocking the event loop, so other instruments can be driven while
+    the camera settles and captures.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = AsyncHTTPClient(retry_policy=self.retry_policy)
+
+    @requires_active_tool
+    async def _capture_image(self, timeout=30):
+        """Capture image from raspberry pi, see :meth:`Camera._capture_image`
+
+        :param timeout: the timeout for the http request, defaults to 30
+        :type timeout: int, optional
+        :return: the image as a bstring
+        :rtype: bytes
+        """
+        await asyncio.sleep(1)
+        response = await self._client.get(self.still_url, timeout=timeout)
+        await asyncio.sleep(2)
+        assert response.status_code == 200
+
+        return response.content
+
+    @requires_active_tool
+    async def capture_image(
+        self,
+        location: Union[Well, Tuple],
+        light: bool = False,
+        light_intensity: int = 0,
+        timeout=30,
+    ):
+        """Capture an image from the WebCamera at the specified location, see :meth:`Camera.capture_image`
+
+        :return: the image as an bstring
+        :rtype: bytes
+        """
+        assert 0 <= light_intensity <= 1, "Light intensity must be between 0 and 1"
+
+        x, y, z = Labware._getxyz(location)
+
+        picture_heigth = self.focus_height - abs(self.tool_offset)
+        await self._machine.travel_to(x=x, y=y, z=picture_heigth)
+        await self._machine.sync()
+        if light is True:
+            await self._machine.gcode(f"M42 P{self.light_pin} S{light_intensity}")
+            image = await self._capture_image(timeout=timeout)
+            await self._machine.gcode(f"M42 P{self.light_pin} S0")
+        else:
+            image = await self._capture_image()
+
+        return image
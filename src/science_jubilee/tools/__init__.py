@@ -1,18 +1,107 @@
-# # Iterate through and import all modules in the plates/
-# # this allows us to add new plates in the plates folder and have it automatically usable in Machine.py
-# from inspect import isclass
-# from pkgutil import iter_modules
-# from pathlib import Path
-# from importlib import import_module
-
-# # iterate through the modules in the current package
-# package_dir = Path(__file__).resolve().parent
-# for (_, module_name, _) in iter_modules([package_dir]):
-#     # import the module and iterate through its attributes
-#     module = import_module(f"{__name__}.{module_name}")
-#     for attribute_name in dir(module):
-#         attribute = getattr(module, attribute_name)
-
-#         if isclass(attribute):
-#             # Add the class to this package's variables
-#             globals()[attribute_name] = attribute
+"""Tools that can be loaded on a :class:`Machine`.
+
+Tool modules are only imported when they are first used, so loading one tool does not pull in
+the dependencies of the others (e.g. OpenCV for the cameras)::
+
+    from science_jubilee.tools import Pipette    # the Pipette module, as before
+    Pipette = tools.get_tool("Pipette")        # the Pipette class
+
+Tools from other packages are found through the ``science_jubilee.tools`` entry point group,
+or can be added with :func:`register_tool`.
+"""
+
+import importlib
+
+ENTRY_POINT_GROUP = "science_jubilee.tools"
+
+# Tool class name -> "module:Class"
+TOOLS = {
+    "AS7341": "science_jubilee.tools.AS7341:AS7341",
+    "AsyncCamera": "science_jubilee.tools.WebCamera:AsyncCamera",
+    "AsyncHTTPSyringe": "science_jubilee.tools.HTTPSyringe:AsyncHTTPSyringe",
+    "AsyncPneumaticSampleLoader": "science_jubilee.tools.PneumaticSampleLoader:AsyncPneumaticSampleLoader",
+    "Camera": "science_jubilee.tools.Camera:Camera",
+    "HTTPSyringe": "science_jubilee.tools.HTTPSyringe:HTTPSyringe",
+    "Loop": "science_jubilee.tools.Loop:Loop",
+    "PeristalticPumps": "science_jubilee.tools.PeristalticPumps:PeristalticPumps",
+    "Pipette": "science_jubilee.tools.Pipette:Pipette",
+    "PneumaticSampleLoader": "science_jubilee.tools.PneumaticSampleLoader:PneumaticSampleLoader",
+    "PumpDispenser": "science_jubilee.tools.PumpDispenser:PumpDispenser",
+    "Sonicator": "science_jubilee.tools.Sonicator:Sonicator",
+    "SpectroscopyTool": "science_jubilee.tools.Spectrometer:SpectroscopyTool",
+    "Syringe": "science_jubilee.tools.Syringe:Syringe",
+    "SyringeExtruder": "science_jubilee.tools.SyringeExtruder:SyringeExtruder",
+    "Tool": "science_jubilee.tools.Tool:Tool",
+    "WebCamera": "science_jubilee.tools.WebCamera:Camera",
+}
+
+_MODULES = {target.split(":")[0].rsplit(".", 1)[1] for target in TOOLS.values()}
+_entry_points_loaded = False
+
+
+def register_tool(name: str, target: str):
+    """Make a tool class available to :func:`get_tool` without importing it.
+
+    :param name: The name to look the tool up by
+    :type name: str
+    :param target: Where the class is defined, as ``"package.module:Class"``
+    :type target: str
+    """
+    TOOLS[name] = target
+
+
+def _load_entry_points():
+    """Add the tools registered by installed packages, once."""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    group = (
+        eps.select(group=ENTRY_POINT_GROUP)
+        if hasattr(eps, "select")
+        else eps.get(ENTRY_POINT_GROUP, [])
+    )
+    for ep in group:
+        TOOLS.setdefault(ep.name, ep.value)
+
+
+def available_tools():
+    """Return the names of all tools that :func:`get_tool` can load, without importing them.
+
+    :rtype: List[str]
+    """
+    _load_entry_points()
+    return sorted(TOOLS)
+
+
+def get_tool(name: str):
+    """Import and return a tool class by name, e.g. ``get_tool("Pipette")``.
+
+    :param name: The name of the tool class, see :func:`available_tools`
+    :type name: str
+    :raises KeyError: If no tool is registered under that name
+    :return: The tool class
+    :rtype: type
+    """
+    if name not in TOOLS:
+        _load_entry_points()
+    if name not in TOOLS:
+        raise KeyError(
+            f"Unknown tool {name!r}; available tools: {', '.join(available_tools())}"
+        )
+    module_name, _, attr = TOOLS[name].partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def __getattr__(name: str):
+    # `science_jubilee.tools.Pipette` etc. import the tool module on first access
+    if name in _MODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _MODULES)
@@ -0,0 +1,382 @@
+"""Awaitable counterparts of :mod:`science_jubilee.utils.Transport`, used by :class:`AsyncMachine` and the async tools."""
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import time
+
+import requests
+
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.Retry import (
+    IDEMPOTENT_METHODS,
+    QUERY,
+    RETRY_STATUSES,
+    CircuitBreaker,
+    RequestNotSent,
+    RetryableStatus,
+    RetryPolicy,
+    idempotency,
+)
+from science_jubilee.utils.Transport import (
+    POLL_SCHEDULES,
+    GCodeBuffer,
+    HTTPTransport,
+    command_class,
+    split_response_objects,
+)
+
+# Optional; imported on the first request rather than with the module
+aiohttp = lazy_import("aiohttp", optional=True)
+
+logger = logging.getLogger(__name__)
+
+
+async def maybe_await(result):
+    """Await `result` if it is awaitable, e.g. when calling a method that may be sync or async."""
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AsyncResponse:
+    """A fully read HTTP response, with the parts of the :class:`requests.Response` API used here."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHTTPClient:
+    """Awaitable HTTP requests over one keep-alive session.
+
+    Requests go through `aiohttp` when it is installed. Otherwise each request is made with
+    `requests` on the event loop's default executor, so the loop is never blocked either way.
+    Connection errors are raised as :class:`requests.RequestException` in both cases, after the
+    retries allowed by `retry_policy`.
+
+    :param base_url: Prefix of every requested url, defaults to ""
+    :type base_url: str, optional
+    :param pool_maxsize: The maximum number of connections kept open, defaults to 2
+    :type pool_maxsize: int, optional
+    :param retry_policy: How failed requests are retried, defaults to None (a :class:`RetryPolicy`)
+    :type retry_policy: :class:`RetryPolicy`, optional
+    """
+
+    def __init__(
+        self,
+        base_url: str = "",
+        pool_maxsize: int = 2,
+        retry_policy: RetryPolicy = None,
+    ):
+        self.base_url = base_url
+        self.pool_maxsize = pool_maxsize
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._session = None
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        timeout: float = None,
+        idempotent: bool = None,
+        **kwargs,
+    ):
+        """Issue a request and read the whole response, see :meth:`RetryPolicy.request`.
+
+        :param method: The HTTP method, e.g. ``GET``
+        :type method: str
+        :param url: The url, appended to :attr:`base_url`
+        :type url: str
+        :param timeout: The time to wait for the response, defaults to None
+        :type timeout: float, optional
+        :param idempotent: Whether the request can safely be sent twice, defaults to None (by method)
+        :type idempotent: bool, optional
+        :return: The response
+        :rtype: :class:`AsyncResponse`
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        async def attempt():
+            response = await self._request(method, url, timeout=timeout, **kwargs)
+            if idempotent and response.status_code in RETRY_STATUSES:
+                raise RetryableStatus(
+                    f"{method} {url} answered {response.status_code}",
+                    response=response,
+                )
+            return response
+
+        try:
+            return await self.retry_policy.acall(attempt, idempotent=idempotent)
+        except RetryableStatus as e:
+            return e.response
+
+    async def _request(self, method: str, url: str, timeout: float = None, **kwargs):
+        """Issue a single request, without retries."""
+        url = self.base_url + url
+        if aiohttp is None:
+            if self._session is None:
+                self._session = requests.Session()
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    self._session.request, method, url, timeout=timeout, **kwargs
+                ),
+            )
+            return AsyncResponse(response.status_code, response.content)
+
+        if self._session is None:
+            # Sessions are bound to the running event loop, so they are opened on first use
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize)
+            )
+        try:
+            async with self._session.request(
+                method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs
+            ) as response:
+                return AsyncResponse(response.status, await response.read())
+        except aiohttp.ClientConnectorError as e:
+            # No connection could be opened, so nothing was sent
+            raise RequestNotSent(f"{method} {url} failed: {e!r}") from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise requests.RequestException(f"{method} {url} failed: {e!r}") from e
+
+    async def get(self, url: str, timeout: float = None, idempotent=True, **kwargs):
+        """Issue a GET request, see :meth:`request`."""
+        return await self.request(
+            "GET", url, timeout=timeout, idempotent=idempotent, **kwargs
+        )
+
+    async def post(self, url: str, timeout: float = None, idempotent=False, **kwargs):
+        """Issue a POST request, see :meth:`request`."""
+        return await self.request(
+            "POST", url, timeout=timeout, idempotent=idempotent, **kwargs
+        )
+
+    async def close(self):
+        """Close the session. The client can still be used afterwards."""
+        session, self._session = self._session, None
+        if session is None:
+            return
+        if aiohttp is None:
+            session.close()
+        else:
+            await session.close()
+
+
+class AsyncHTTPTransport:
+    """Awaitable version of :class:`HTTPTransport`, talking to a Duet controller over one session.
+
+    :param address: The IP address (optionally with port) of the controller
+    :type address: str
+    :param pool_maxsize: The maximum number of connections kept open to the controller, defaults to 2
+    :type pool_maxsize: int, optional
+    :param retry_policy: How failed requests are retried, defaults to None (a :class:`RetryPolicy`
+        with its own :class:`CircuitBreaker`)
+    :type retry_policy: :class:`RetryPolicy`, optional
+    """
+
+    DSF = "dsf"
+    STANDALONE = "standalone"
+
+    def __init__(
+        self, address: str, pool_maxsize: int = 2, retry_policy: RetryPolicy = None
+    ):
+        self.address = address
+        self.mode = None
+        self.client = AsyncHTTPClient(
+            f"http://{address}/",
+            pool_maxsize=pool_maxsize,
+            retry_policy=retry_policy or RetryPolicy(breaker=CircuitBreaker()),
+        )
+        self.last_polls = 0
+        self._gcode_buffer = GCodeBuffer(HTTPTransport.GCODE_BUFFER)
+
+    async def send_code(
+        self,
+        cmd: str,
+        timeout: float = None,
+        response_wait: float = 60,
+        until: str = None,
+    ):
+        """Send a G-Code command and return the controller's reply, see :meth:`HTTPTransport.send_code`.
+
+        :param cmd: The G-Code command to send
+        :type cmd: str
+        :param timeout: The time to wait for the HTTP request to complete, defaults to None
+        :type timeout: float, optional
+        :param response_wait: The time to wait for a reply in standalone mode, defaults to 60
+        :type response_wait: float, optional
+        :param until: In standalone mode, keep collecting replies until this text shows up, defaults to None
+        :type until: str, optional
+        :return: The reply from the controller, or None if no reply was received
+        :rtype: str
+        """
+        if self.mode == self.DSF:
+            return await self._send_dsf(cmd, timeout=timeout)
+        if self.mode == self.STANDALONE:
+            return await self._send_standalone(
+                cmd, timeout=timeout, response_wait=response_wait, until=until
+            )
+
+        try:
+            response = await self.client.post(
+                "machine/code",
+                data=cmd,
+                timeout=timeout,
+                idempotent=idempotency(cmd) == QUERY,
+            )
+            if not response.ok or "rejected" in response.text:
+                raise requests.RequestException
+            self.mode = self.DSF
+            return response.text
+        except requests.RequestException:
+            response = await self._send_standalone(
+                cmd, timeout=timeout, response_wait=response_wait, until=until
+            )
+            if response is not None:
+                self.mode = self.STANDALONE
+            return response
+
+    async def _send_dsf(self, cmd: str, timeout: float = None):
+        """Send a command to a controller running DSF, which replies once the code completes."""
+        try:
+            response = await self.client.post(
+                "machine/code",
+                data=cmd,
+                timeout=timeout,
+                idempotent=idempotency(cmd) == QUERY,
+            )
+            return response.text
+        except requests.RequestException as e:
+            print(f"`machine/code` request failed: {e}")
+            return None
+
+    async def _send_standalone(
+        self, cmd: str, timeout: float = None, response_wait: float = 60, until=None
+    ):
+        """Send a command to a standalone controller and poll `seqs.reply` for its reply."""
+        try:
+            reply_count = await self._reply_seq(timeout)
+            await self._queue_code(cmd, timeout=timeout, wait=response_wait)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Both `machine/code` and `rr_gcode` requests failed: {e}")
+            return None
+
+        cls, dwell = command_class(cmd)
+        tic = time.time()
+        polls = 0
+        collected = ""
+        try:
+            for delay in POLL_SCHEDULES[cls].delays(first=dwell):
+                await asyncio.sleep(delay)
+                polls += 1
+                try:
+                    new_reply_count = await self._reply_seq(timeout)
+                    if new_reply_count != reply_count:
+                        # Reading the reply clears it, so a read that failed is not repeated
+                        response = (
+                            await self.client.get(
+                                "rr_reply", timeout=timeout, idempotent=False
+                            )
+                        ).text
+                        if until is not None:
+                            collected += response + "\n"
+                            reply_count = new_reply_count
+                            if until in collected:
+                                return collected
+                            continue
+                        responses = split_response_objects(response)
+                        if len(responses) > 0:
+                            return responses[-1]
+                        return None
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    logger.debug(f"Error in gcode reply wait loop: {e}")
+                if time.time() - tic > response_wait:
+                    return collected or None
+        finally:
+            self.last_polls = polls
+
+    async def _queue_code(self, cmd: str, timeout: float = None, wait: float = 60):
+        """Hand a block of code to a standalone controller, see :meth:`HTTPTransport._queue_code`."""
+        for delay, code in self._gcode_buffer.pieces(cmd, wait):
+            if delay:
+                await asyncio.sleep(delay)
+            # Polling the free space is a query, sending code is not
+            response = await self.client.get(
+                "rr_gcode", params={"gcode": code}, timeout=timeout, idempotent=not code
+            )
+            self._gcode_buffer.update(response)
+
+    async def _reply_seq(self, timeout: float = None):
+        """Return the reply sequence number of a standalone controller."""
+        response = await self.client.get("rr_model?key=seqs", timeout=timeout)
+        return response.json()["result"]["reply"]
+
+    async def get_model(
+        self, key: str = "", flags: str = "d99v", timeout: float = None
+    ):
+        """Read (part of) the controller's object model in a single request, see :meth:`HTTPTransport.get_model`.
+
+        :param key: The object model key to read; an empty key reads the whole model, defaults to ""
+        :type key: str, optional
+        :param flags: The ``M409`` flags, defaults to "d99v" (verbose, full depth)
+        :type flags: str, optional
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :return: The value of the key in the object model
+        :rtype: Union[dict, list]
+        """
+        if self.mode != self.STANDALONE:
+            try:
+                response = await self.client.post(
+                    "machine/code",
+                    data=f'M409 K"{key}" F"{flags}"',
+                    timeout=timeout,
+                    idempotent=True,
+                )
+                if not response.ok or "rejected" in response.text:
+                    raise requests.RequestException
+                self.mode = self.DSF
+                return json.loads(response.text)["result"]
+            except requests.RequestException:
+                if self.mode == self.DSF:
+                    raise
+        response = await self.client.get(
+            "rr_model", params={"key": key, "flags": flags}, timeout=timeout
+        )
+        self.mode = self.STANDALONE
+        return response.json()["result"]
+
+    async def download(self, filepath: str, timeout: float = None):
+        """Download a file from the controller's SD card.
+
+        :param filepath: The full filepath of the file to download, e.g. ``/sys/tfree0.g``
+        :type filepath: str
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :return: The response holding the file contents
+        :rtype: :class:`AsyncResponse`
+        """
+        return await self.client.get(
+            "rr_download", params={"name": filepath}, timeout=timeout
+        )
+
+    async def close(self):
+        """Close all pooled connections."""
+        await self.client.close()
@@ -0,0 +1,203 @@
+"""Out-of-band crash detection for :class:`Machine`.
+
+The crash detection trigger of the tool changer (see the crash detection guide in the docs) can run
+a macro that reports the crash instead of e-stopping the machine, e.g. ``trigger0.g``::
+
+    M291 P"crash detected" R"Jubilee" S1 ; shows a message box, read from the object model
+    M118 P0 S"crash detected"             ; or a message, pushed to DSF clients
+
+:class:`CrashMonitor` watches the object model subscription for these messages. Messages that only
+show up in command replies (``echo`` or ``M118`` on standalone controllers) are found in the replies
+to the protocol's commands, so they are only seen once the protocol sends its next command.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class CrashMonitor:
+    """Watches a machine's controller for crash reports and holds its motion until they are handled.
+
+    When a crash is reported, no further command is sent to the controller by the protocol, the
+    machine is stopped, and the handler is run on a separate thread. Commands the handler sends go
+    through. Once the handler returns, the protocol carries on; if it raises, the machine stays held
+    until :meth:`resume` is called.
+
+    How the machine is stopped depends on `stop`:
+
+    - ``"halt"`` sends an emergency stop (``M112``), which discards the queued moves, then resets
+      the controller (``M999``). The machine has to be homed again before it moves.
+    - ``"pause"`` pauses a job running from the SD card with ``M25``, and resumes it with ``M24``
+      once the crash is handled. The firmware cannot pause moves sent by the host, so when no
+      job is running the machine is halted instead.
+
+    :param machine: The machine to watch
+    :type machine: :class:`Machine`
+    :param handler: An object with a ``handle_crash()`` method, e.g. :class:`SlackInputHandler`, or a
+        function called with the crash message, defaults to None (only hold the machine until :meth:`resume`)
+    :type handler: object, optional
+    :param pattern: Text that marks a message as a crash report (case-insensitive), defaults to "crash detected"
+    :type pattern: str, optional
+    :param stop: How the machine is stopped, "halt" or "pause", defaults to "halt"
+    :type stop: str, optional
+    """
+
+    WATCHED_SECTIONS = ("state", "job")  # hold the message box and the file being run
+
+    STOP_POLICIES = ("halt", "pause")
+
+    def __init__(
+        self,
+        machine,
+        handler=None,
+        pattern: str = "crash detected",
+        stop: str = "halt",
+    ):
+        if stop not in self.STOP_POLICIES:
+            raise ValueError(
+                f"Unknown stop policy {stop!r}, expected one of {self.STOP_POLICIES}"
+            )
+        self.machine = machine
+        self.stop = stop
+        self.handler = handler
+        self.pattern = pattern.lower()
+        self.crashes = []  # (time, message) of every crash reported
+        self._clear = threading.Event()
+        self._clear.set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_box = None
+        self._job_file = None  # The file of the job running from the SD card, if any
+        self._paused = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="crash-handler"
+        )
+
+    @property
+    def crashed(self):
+        """Whether a crash has been reported and not yet handled."""
+        return not self._clear.is_set()
+
+    def check(self, delta: dict):
+        """Look for a crash report in an object model update. Called from the subscription thread.
+
+        Only the message box and the messages are looked at, and the message box only when its
+        sequence number changes.
+
+        :param delta: The (partial) object model update
+        :type delta: dict
+        """
+        state = delta.get("state")
+        if isinstance(state, dict):
+            box = state.get("messageBox")
+            if box:
+                key = (box.get("seq"), box.get("message"))
+                if key != self._last_box:
+                    self._last_box = key
+                    self._inspect(
+                        f"{box.get('title') or ''} {box.get('message') or ''}"
+                    )
+            elif "messageBox" in state:
+                self._last_box = None
+        job = delta.get("job")
+        if isinstance(job, dict) and "file" in job:
+            self._job_file = (job["file"] or {}).get("fileName")
+        for message in delta.get("messages") or []:
+            if isinstance(message, dict):
+                self._inspect(message.get("content") or "")
+
+    def check_reply(self, reply: str):
+        """Look for a crash report in the reply to a command. Called from the protocol thread.
+
+        Trigger macros that report with ``echo`` or ``M118`` are not seen in the object model of
+        standalone controllers, but their output is returned with the reply to the next command.
+
+        :param reply: The reply from the controller
+        :type reply: str
+        """
+        for line in reply.splitlines():
+            self._inspect(line)
+
+    def _inspect(self, text: str):
+        if self.pattern in text.lower():
+            self.trigger(text.strip())
+
+    def trigger(self, message: str = "crash detected"):
+        """Hold the machine and dispatch the handler, as if a crash had been reported.
+
+        :param message: The crash report, defaults to "crash detected"
+        :type message: str, optional
+        """
+        with self._lock:
+            if self.crashed:
+                return
+            self._clear.clear()
+            self.crashes.append((time.time(), message))
+        logger.error(f"Jubilee crash detected: {message}")
+        if self.stop == "pause" and self._job_file:
+            self._send("M25")
+            self._paused = True
+        else:
+            if self.stop == "pause":
+                logger.warning("No job is running from the SD card to pause; halting")
+            # Queued moves are discarded, and the positions and homing are lost with the reset
+            self._send("M112")
+            self._send("M999")
+            self.machine.axes_homed = [False] * 4
+            self.machine.object_model.invalidate()
+            self.machine.motion_state.invalidate()
+        self._executor.submit(self._dispatch, message)
+
+    def _send(self, cmd: str):
+        """Send a command straight to the controller, ahead of the held protocol.
+
+        The reply is not waited for, so that a protocol command still waiting for its own reply
+        (from before the crash) is not answered with this one.
+        """
+        try:
+            self.machine.transport.send_code_nowait(cmd)
+        except Exception as e:
+            logger.error(f"Could not send {cmd} after the crash: {e}")
+
+    def _dispatch(self, message: str):
+        """Run the handler on the handler thread, then resume."""
+        self._local.handling = True
+        try:
+            if self.handler is None:
+                return
+            if hasattr(self.handler, "handle_crash"):
+                self.handler.handle_crash()
+            else:
+                self.handler(message)
+        except Exception:
+            logger.exception(
+                "Crash handler failed; call resume() once the crash is cleared"
+            )
+            return
+        finally:
+            self._local.handling = False
+        if self.handler is not None:
+            self.resume()
+
+    def resume(self):
+        """Resume a job paused by the crash and let the protocol send commands again."""
+        if self._paused:
+            self._send("M24")
+            self._paused = False
+        self._clear.set()
+
+    def wait_until_clear(self, timeout: float = None):
+        """Block until the crash has been handled. Returns at once on the handler thread.
+
+        :param timeout: The time to wait, defaults to None (no limit)
+        :type timeout: float, optional
+        :return: Whether the machine is clear to move
+        :rtype: bool
+        """
+        if getattr(self._local, "handling", False):
+            return True
+        return self._clear.wait(timeout)
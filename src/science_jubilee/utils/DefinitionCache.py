@@ -0,0 +1,206 @@
+"""A process-wide cache of the labware and deck definition files.
+
+Each definition file is parsed once and kept, keyed by its path and stamped with its modification
+time and size, so editing a file (e.g. saving a manual offset to it) reloads it on next use. Along
+with the parsed JSON, a cache entry can hold data compiled from it, such as the well geometry of a
+labware, which every labware loaded from the same file then starts from.
+
+The cache can also be written to disk for a whole definition directory, see
+:meth:`DefinitionCache.save`. A saved cache found next to the definitions is read the first time one
+of them is loaded, so that a new process sets up a large deck without parsing any file. It holds
+only JSON and NumPy arrays, never pickles, so reading one cannot run code; compiled data is saved
+for the keys registered with :meth:`DefinitionCache.register`.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, Iterable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Name of the file a directory's compiled cache is saved to
+COMPILED_CACHE = ".compiled_definitions.npz"
+# Bumped whenever the layout of the saved cache changes
+_FORMAT = 2
+
+
+def _cache_version():
+    """The version a saved cache must have been written with to be read."""
+    import science_jubilee
+
+    return f"{science_jubilee.__version__}/{_FORMAT}"
+
+
+class _Entry:
+    __slots__ = ("stamp", "data", "compiled")
+
+    def __init__(self, stamp, data, compiled=None):
+        self.stamp = stamp
+        self.data = data
+        self.compiled = {} if compiled is None else compiled
+
+
+class DefinitionCache:
+    """Parsed definition files, shared by everything that loads them.
+
+    The returned definitions are shared, and must not be modified: callers that modify their copy
+    (e.g. :class:`Labware` recording a manual offset) copy it first.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._directories = set()  # Directories whose saved cache was read
+        self._codecs = {}  # key -> (dump, restore) of the compiled data saved to disk
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _stamp(path: str):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _entry(self, path: str):
+        path = os.path.realpath(path)
+        with self._lock:
+            self._read_saved(os.path.dirname(path))
+            stamp = self._stamp(path)
+            entry = self._entries.get(path)
+            if entry is not None and entry.stamp == stamp:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            with open(path, "r") as f:
+                entry = _Entry(stamp, json.load(f))
+            self._entries[path] = entry
+            return entry
+
+    def load(self, path: str):
+        """Return the parsed JSON definition at `path`.
+
+        :param path: The path to the definition `.json` file
+        :type path: str
+        :return: The parsed definition, shared with other callers
+        :rtype: dict
+        """
+        return self._entry(path).data
+
+    def compiled(self, path: str, key: str, compile: Callable):
+        """Return ``compile(definition)`` for the definition at `path`, computed once per version of the file.
+
+        :param path: The path to the definition `.json` file
+        :type path: str
+        :param key: Names what `compile` computes, e.g. 'labware'
+        :type key: str
+        :param compile: Called with the parsed definition; what it returns is shared, like the definition
+        :type compile: Callable
+        :return: What `compile` returned
+        """
+        entry = self._entry(path)
+        with self._lock:
+            if key not in entry.compiled:
+                entry.compiled[key] = compile(entry.data)
+            return entry.compiled[key]
+
+    def register(
+        self,
+        key: str,
+        dump: Callable[[object], Dict[str, np.ndarray]],
+        restore: Callable[[Dict[str, np.ndarray]], object],
+    ):
+        """Save the data compiled under `key` along with the definitions, see :meth:`save`.
+
+        :param key: The key passed to :meth:`compiled`
+        :type key: str
+        :param dump: Converts the compiled data to a dictionary of NumPy arrays
+        :type dump: Callable
+        :param restore: Converts the dictionary of arrays back to the compiled data
+        :type restore: Callable
+        """
+        self._codecs[key] = (dump, restore)
+
+    def save(self, paths: Iterable[str], cache_file: str):
+        """Write the cache entries of `paths` to `cache_file`.
+
+        The definitions are saved as JSON and the compiled data of registered keys as NumPy arrays,
+        in one `.npz` file.
+
+        :param paths: The definition files to save, which are loaded first if needed
+        :type paths: Iterable[str]
+        :param cache_file: The file to write
+        :type cache_file: str
+        """
+        entries = []
+        arrays = {}
+        for i, path in enumerate(paths):
+            entry = self._entry(path)
+            keys = [key for key in entry.compiled if key in self._codecs]
+            for key in keys:
+                dump = self._codecs[key][0]
+                for name, array in dump(entry.compiled[key]).items():
+                    arrays[f"{i}/{key}/{name}"] = array
+            entries.append(
+                {
+                    "path": os.path.realpath(path),
+                    "stamp": list(entry.stamp),
+                    "data": entry.data,
+                    "compiled": keys,
+                }
+            )
+        index = {"version": _cache_version(), "entries": entries}
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, index=np.array(json.dumps(index)), **arrays)
+        os.replace(tmp, cache_file)
+
+    def _read_saved(self, directory: str):
+        """Read the saved cache of `directory`, the first time a definition from it is loaded."""
+        if directory in self._directories:
+            return
+        self._directories.add(directory)
+        cache_file = os.path.join(directory, COMPILED_CACHE)
+        if not os.path.exists(cache_file):
+            return
+        try:
+            with np.load(cache_file, allow_pickle=False) as saved:
+                index = json.loads(str(saved["index"]))
+                if index.get("version") != _cache_version():
+                    return
+                for i, saved_entry in enumerate(index["entries"]):
+                    path = saved_entry["path"]
+                    if path in self._entries:
+                        continue
+                    compiled = {}
+                    for key in saved_entry["compiled"]:
+                        if key not in self._codecs:
+                            continue
+                        prefix = f"{i}/{key}/"
+                        restore = self._codecs[key][1]
+                        compiled[key] = restore(
+                            {
+                                name[len(prefix) :]: saved[name]
+                                for name in saved.files
+                                if name.startswith(prefix)
+                            }
+                        )
+                    # Stale entries are replaced when their file is loaded, as the stamps differ
+                    self._entries[path] = _Entry(
+                        tuple(saved_entry["stamp"]), saved_entry["data"], compiled
+                    )
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable definition cache {cache_file}: {e}")
+
+    def clear(self):
+        """Forget every cached definition."""
+        with self._lock:
+            self._entries.clear()
+            self._directories.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+definitions = DefinitionCache()
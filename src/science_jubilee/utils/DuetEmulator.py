@@ -0,0 +1,872 @@
+"""Local stand-in for a Duet controller, for running and profiling protocols without a machine.
+
+Example::
+
+    from science_jubilee.Machine import Machine
+    from science_jubilee.utils.DuetEmulator import DuetEmulator
+
+    with DuetEmulator(latency=0.005, time_scale=0) as duet:
+        m = Machine(address=duet.address)
+        m.home_all()
+        m.move_to(x=100, y=100)
+"""
+
+import json
+import logging
+import math
+import os
+import queue
+import re
+import select
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from science_jubilee.utils.MotionState import parse_command
+from science_jubilee.utils.SerialTransport import checksum
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AXES = [
+    {"letter": "X", "min": 0.0, "max": 300.0, "speed": 18000.0},
+    {"letter": "Y", "min": 0.0, "max": 300.0, "speed": 18000.0},
+    {"letter": "Z", "min": 0.0, "max": 300.0, "speed": 1200.0},
+    {"letter": "U", "min": 0.0, "max": 200.0, "speed": 6000.0},
+    {"letter": "V", "min": 0.0, "max": 100.0, "speed": 6000.0},
+]
+
+
+class DuetInterpreter:
+    """Executes G-Code against an in-memory model of a Jubilee with a Duet controller.
+
+    The interpreter tracks positions, positioning modes, homing, tools and their offsets, and
+    answers ``M409`` object model queries from the same state. Moves are given a duration from
+    their length and feed rate; the time is spent (scaled by `time_scale`) when a command has to
+    wait for motion to finish (``M400``, ``G4``, homing, tool changes).
+
+    :param axes: The configured axes, each a dictionary with `letter`, `min`, `max` and optionally
+        `speed` (mm/min), defaults to X, Y, Z, U and V
+    :type axes: list, optional
+    :param tools: The configured tools, each a dictionary with `number`, `name` and optionally
+        `offsets` and `extruders`, defaults to four tools driving one extruder each
+    :type tools: list, optional
+    :param homed: Whether the axes start out homed, defaults to False
+    :type homed: bool, optional
+    :param time_scale: Factor applied to modeled durations before sleeping; 0 never sleeps, defaults to 1.0
+    :type time_scale: float, optional
+    :param files: Files on the emulated SD card, by full path (e.g. ``/macros/tool_lock.g``), defaults to None
+    :type files: dict, optional
+    :param command_time: Seconds the controller takes to process each line of G-Code, defaults to 0.0
+    :type command_time: float, optional
+    """
+
+    def __init__(
+        self,
+        axes: list = None,
+        tools: list = None,
+        homed: bool = False,
+        time_scale: float = 1.0,
+        files: dict = None,
+        command_time: float = 0.0,
+    ):
+        axes = [dict(a) for a in (axes or DEFAULT_AXES)]
+        if tools is None:
+            tools = [
+                {"number": i, "name": f"tool{i}", "extruders": [i]} for i in range(4)
+            ]
+        self.letters = [a["letter"] for a in axes]
+        extruder_count = max(
+            [e + 1 for t in tools for e in t.get("extruders", [])] or [0]
+        )
+        self.model = {
+            "move": {
+                "axes": [
+                    {
+                        "letter": a["letter"],
+                        "homed": homed,
+                        "min": a["min"],
+                        "max": a["max"],
+                        "speed": a.get("speed", 6000.0),
+                        "machinePosition": 0.0,
+                        "userPosition": 0.0,
+                    }
+                    for a in axes
+                ],
+                "extruders": [{"position": 0.0} for _ in range(extruder_count)],
+            },
+            "tools": [
+                {
+                    "number": t["number"],
+                    "name": t["name"],
+                    "offsets": list(t.get("offsets", [0.0] * len(axes))),
+                    "extruders": list(t.get("extruders", [])),
+                    "state": "off",
+                }
+                for t in tools
+            ],
+            "state": {
+                "currentTool": -1,
+                "status": "idle",
+                "upTime": 0,
+                "messageBox": None,
+            },
+            "job": {
+                "file": {"fileName": None, "size": 0},
+                "filePosition": 0,
+                "lastFileName": None,
+            },
+            "seqs": {"reply": 0},
+        }
+        self.files = dict(files or {})
+        self.time_scale = time_scale
+        self.command_time = command_time
+        self.lock = threading.RLock()
+
+        self.machine_position = {letter: 0.0 for letter in self.letters}
+        self.absolute_positioning = True
+        self.absolute_extrusion = True
+        self.feed_rate = 6000.0  # mm/min
+        self._stack = []
+        self._motion_done = 0.0  # host time at which queued motion finishes
+        self._job_thread = None  # Runs the file started with M32
+        self._message_seq = 0  # Sequence number of the last M291 message box
+        # Statistics
+        self.codes = []  # Every line of G-Code executed, in order
+        self.motion_time = 0.0  # Modeled seconds of motion
+
+    # --------------------------- state ---------------------------
+    @property
+    def axes(self):
+        return self.model["move"]["axes"]
+
+    @property
+    def current_tool(self):
+        return self.model["state"]["currentTool"]
+
+    def _tool(self, number):
+        for tool in self.model["tools"]:
+            if tool is not None and tool["number"] == number:
+                return tool
+        return None
+
+    def _offset(self, letter):
+        tool = self._tool(self.current_tool)
+        if tool is None:
+            return 0.0
+        return tool["offsets"][self.letters.index(letter)]
+
+    def user_position(self, letter):
+        """Return the position of an axis in user coordinates, i.e. including the tool offset."""
+        return self.machine_position[letter] + self._offset(letter)
+
+    def _sync_model(self):
+        for axis in self.axes:
+            axis["machinePosition"] = round(self.machine_position[axis["letter"]], 3)
+            axis["userPosition"] = round(self.user_position(axis["letter"]), 3)
+
+    # --------------------------- execution ---------------------------
+    def execute(self, code: str) -> str:
+        """Execute one or more newline-separated lines of G-Code.
+
+        :param code: The G-Code to execute
+        :type code: str
+        :return: The combined reply to all the lines
+        :rtype: str
+        """
+        replies = [self.execute_line(line) for line in code.split("\n")]
+        return "\n".join(r for r in replies if r)
+
+    def execute_line(self, line: str) -> str:
+        """Execute a single line of G-Code and return its reply."""
+        if self.command_time > 0:
+            time.sleep(self.command_time)
+        with self.lock:
+            self.codes.append(line)
+            stripped = line.strip()
+            if stripped.lower().startswith("echo"):
+                return " ".join(re.findall(r'"([^"]*)"', stripped))
+            cmd, params = parse_command(line)
+            if cmd is None:
+                return ""
+            handler = getattr(self, f"_{cmd.replace('.', '_')}", None)
+            if cmd.startswith("T"):
+                reply = self._select_tool(cmd)
+            elif handler is None:
+                reply = ""  # Unsupported codes are accepted and ignored
+            else:
+                reply = handler(params, line)
+            self._sync_model()
+            return reply or ""
+
+    def _wait_for_motion(self):
+        """Spend the remaining time of the queued moves, as M400 does."""
+        remaining = self._motion_done - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _spend(self, seconds):
+        """Model a blocking action taking `seconds` of machine time."""
+        self._wait_for_motion()
+        self.motion_time += seconds
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _queue_motion(self, seconds):
+        """Queue a move of `seconds` machine time behind any move already queued."""
+        self.motion_time += seconds
+        start = max(time.time(), self._motion_done)
+        self._motion_done = start + seconds * self.time_scale
+
+    def _G0(self, params, line):
+        if "F" in params:
+            self.feed_rate = float(params["F"])
+        targets = {}
+        for letter in self.letters:
+            if letter in params:
+                value = float(params[letter])
+                if self.absolute_positioning:
+                    targets[letter] = value - self._offset(letter)
+                else:
+                    targets[letter] = self.machine_position[letter] + value
+        if "E" in params:
+            self._extrude(params["E"])
+        if not targets:
+            return ""
+        for letter in targets:
+            axis = self.axes[self.letters.index(letter)]
+            moving = abs(targets[letter] - self.machine_position[letter]) > 1e-9
+            if moving and not axis["homed"] and params.get("H", "0") in ("", "0"):
+                return "Error: G0/G1: insufficient axes homed"
+        distance = math.sqrt(
+            sum((targets[a] - self.machine_position[a]) ** 2 for a in targets)
+        )
+        feed = self.feed_rate
+        for letter in targets:
+            feed = min(feed, self.axes[self.letters.index(letter)]["speed"])
+        self._queue_motion(distance / (feed / 60.0) if feed > 0 else 0.0)
+        self.machine_position.update(targets)
+        return ""
+
+    _G1 = _G0
+    _G2 = _G0
+    _G3 = _G0
+
+    def _extrude(self, value):
+        tool = self._tool(self.current_tool)
+        if tool is None:
+            return
+        amounts = [float(v) for v in value.split(":")]
+        for i, extruder in enumerate(tool["extruders"]):
+            amount = amounts[min(i, len(amounts) - 1)]
+            drive = self.model["move"]["extruders"][extruder]
+            if self.absolute_extrusion:
+                drive["position"] = amount
+            else:
+                drive["position"] += amount
+
+    def _G4(self, params, line):
+        if "P" in params:
+            self._spend(float(params["P"]) / 1000)
+        elif "S" in params:
+            self._spend(float(params["S"]))
+        return ""
+
+    def _G10(self, params, line):
+        if "P" not in params:
+            return ""
+        tool = self._tool(int(float(params["P"])))
+        if tool is None:
+            return f"Error: G10: tool {params['P']} not found"
+        for i, letter in enumerate(self.letters):
+            if letter in params and params[letter] != "":
+                tool["offsets"][i] = float(params[letter])
+        return ""
+
+    def _G28(self, params, line):
+        letters = [letter for letter in self.letters if letter in params]
+        if not letters:
+            letters = list(self.letters)  # homeall.g
+        self._spend(2.0 * len(letters))
+        for letter in letters:
+            self.machine_position[letter] = 0.0
+            self.axes[self.letters.index(letter)]["homed"] = True
+        return ""
+
+    def _G90(self, params, line):
+        self.absolute_positioning = True
+
+    def _G91(self, params, line):
+        self.absolute_positioning = False
+
+    def _G92(self, params, line):
+        for letter in self.letters:
+            if letter in params:
+                self.machine_position[letter] = float(params[letter]) - self._offset(
+                    letter
+                )
+
+    def _M82(self, params, line):
+        self.absolute_extrusion = True
+
+    def _M83(self, params, line):
+        self.absolute_extrusion = False
+
+    def _M24(self, params, line):
+        if self.model["state"]["status"] == "paused":
+            self.model["state"]["status"] = "processing"
+
+    def _M25(self, params, line):
+        # Only a file job can be paused; moves queued from the host carry on
+        if self.model["state"]["status"] == "processing":
+            self.model["state"]["status"] = "paused"
+        elif self.model["state"]["status"] != "paused":
+            return "Error: M25: Cannot pause print, because no file is being printed!"
+
+    def _M112(self, params, line):
+        # Queued moves and any running job are abandoned until the controller is reset
+        self._motion_done = time.time()
+        self.model["job"]["file"] = {"fileName": None, "size": 0}
+        self.model["state"]["status"] = "halted"
+
+    def _M291(self, params, line):
+        message = re.search(r'P"([^"]*)"', line)
+        title = re.search(r'R"([^"]*)"', line)
+        self._message_seq += 1
+        self.model["state"]["messageBox"] = {
+            "message": message.group(1) if message else "",
+            "title": title.group(1) if title else "",
+            "mode": int(float(params.get("S", 1) or 1)),
+            "seq": self._message_seq,
+        }
+
+    def _M292(self, params, line):
+        self.model["state"]["messageBox"] = None
+
+    def _M32(self, params, line):
+        match = re.search(r'"([^"]*)"', line)
+        name = sd_path(match.group(1)) if match else ""
+        if name not in self.files:
+            return f"Error: M32: file {name} not found"
+        if self.model["state"]["status"] == "processing":
+            return "Error: M32: a file is already being processed"
+        text = self.files[name]
+        self.model["job"]["file"] = {
+            "fileName": f"0:{name}",
+            "size": len(text.encode()),
+        }
+        self.model["job"]["filePosition"] = 0
+        self.model["state"]["status"] = "processing"
+        self._job_thread = threading.Thread(
+            target=self._run_job, args=(text,), daemon=True
+        )
+        self._job_thread.start()
+        return ""
+
+    def _run_job(self, text):
+        """Run a file started with M32 line by line, updating the job progress, like the firmware does."""
+        position = 0
+        for line in text.splitlines(keepends=True):
+            while self.model["state"]["status"] == "paused":
+                time.sleep(0.01)
+            if self.model["state"]["status"] == "halted":
+                return
+            reply = self.execute_line(line.rstrip("\r\n"))
+            if reply.startswith("Error"):
+                logger.warning(f"Job line {line.strip()!r}: {reply}")
+            position += len(line.encode())
+            with self.lock:
+                self.model["job"]["filePosition"] = position
+        with self.lock:
+            self._wait_for_motion()
+            job = self.model["job"]
+            job["lastFileName"] = job["file"]["fileName"]
+            job["file"] = {"fileName": None, "size": 0}
+            self.model["state"]["status"] = "idle"
+
+    def wait_for_job(self, timeout: float = None):
+        """Block until the file started with M32, if any, has finished."""
+        if self._job_thread is not None:
+            self._job_thread.join(timeout)
+
+    def _M98(self, params, line):
+        match = re.search(r'P"([^"]*)"', line)
+        name = sd_path(match.group(1) if match else "")
+        if name not in self.files:
+            return f"Error: Macro file {name} not found"
+        return self.execute(self.files[name])
+
+    def _M114(self, params, line):
+        self._sync_model()
+        positions = " ".join(
+            f"{letter}:{self.user_position(letter):.3f}" for letter in self.letters
+        )
+        extruders = self.model["move"]["extruders"]
+        first = extruders[0]["position"] if extruders else 0.0
+        drives = " ".join(f"E{i}:{e['position']:.1f}" for i, e in enumerate(extruders))
+        counts = " ".join("0" for _ in self.letters)
+        return f"{positions} E:{first:.3f} {drives} Count {counts} Machine {counts} Bed comp 0.000"
+
+    def _M120(self, params, line):
+        self._stack.append(
+            (self.absolute_positioning, self.absolute_extrusion, self.feed_rate)
+        )
+
+    def _M121(self, params, line):
+        if self._stack:
+            (
+                self.absolute_positioning,
+                self.absolute_extrusion,
+                self.feed_rate,
+            ) = self._stack.pop()
+
+    def _M400(self, params, line):
+        self._wait_for_motion()
+
+    def _M409(self, params, line):
+        key = re.search(r'K"([^"]*)"', line)
+        flags = re.search(r'F"([^"]*)"', line)
+        key = key.group(1) if key else ""
+        flags = flags.group(1) if flags else ""
+        return json.dumps(
+            {"key": key, "flags": flags, "result": self.lookup(key, flags)},
+            default=str,
+        )
+
+    def _M999(self, params, line):
+        self._motion_done = time.time()
+        self.model["state"]["status"] = "idle"
+        for axis in self.axes:
+            axis["homed"] = False
+        self.model["state"]["currentTool"] = -1
+        self.absolute_positioning = True
+        self.absolute_extrusion = True
+
+    def _select_tool(self, cmd):
+        if cmd == "T":
+            if self.current_tool < 0:
+                return "No tool is selected."
+            return f"Tool {self.current_tool} is selected."
+        number = int(cmd[1:])
+        if number >= 0 and self._tool(number) is None:
+            return f"Error: Invalid tool number {number}"
+        if number != self.current_tool:
+            self._spend(3.0)  # tool change macros
+            old = self._tool(self.current_tool)
+            if old is not None:
+                old["state"] = "off"
+            self.model["state"]["currentTool"] = number if number >= 0 else -1
+            new = self._tool(number)
+            if new is not None:
+                new["state"] = "active"
+        return ""
+
+    def lookup(self, key: str, flags: str = ""):
+        """Return the value of an object model key, e.g. ``move.axes[].homed`` or ``tools[0]``.
+
+        With the ``f`` flag only the frequently-changing values are returned, like the controller
+        does: positions, the status, the current tool and the job progress.
+        """
+        with self.lock:
+            self._sync_model()
+            model = _frequent(self.model) if "f" in flags else self.model
+            parts = [p for p in key.split(".") if p] if key else []
+            try:
+                return _lookup(model, parts)
+            except (KeyError, IndexError, TypeError):
+                return None
+
+
+def sd_path(name: str):
+    """Normalize a path on the SD card, e.g. ``0:/gcodes/job.g`` -> ``/gcodes/job.g``."""
+    return "/" + name.split(":", 1)[-1].lstrip("/")
+
+
+def _frequent(model):
+    """Return the frequently-changing values of the object model, as read with the ``f`` flag."""
+    move, state = model["move"], model["state"]
+    return {
+        "move": {
+            "axes": [
+                {key: axis[key] for key in ("machinePosition", "userPosition")}
+                for axis in move["axes"]
+            ],
+            "extruders": [{"position": e["position"]} for e in move["extruders"]],
+        },
+        "state": {key: state[key] for key in ("currentTool", "status", "upTime")},
+        "job": {"filePosition": model["job"]["filePosition"]},
+        "seqs": dict(model["seqs"]),
+    }
+
+
+def _lookup(obj, parts):
+    if not parts:
+        return obj
+    part, rest = parts[0], parts[1:]
+    match = re.fullmatch(r"(\w*)\[(\d*)\]", part)
+    if match is None:
+        return _lookup(obj[part], rest)
+    name, index = match.groups()
+    value = obj[name] if name else obj
+    if index == "":
+        return [None if item is None else _lookup(item, rest) for item in value]
+    return _lookup(value[int(index)], rest)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real controller
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _reply(self, body, status=200, content_type="text/plain"):
+        if getattr(self, "drop_reply", False):
+            # The request was handled, but the connection fails before the reply is sent
+            self.close_connection = True
+            return
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.emulator._request(self, "GET")
+
+    def do_POST(self):
+        self.server.emulator._request(self, "POST")
+
+    def do_PUT(self):
+        self.server.emulator._request(self, "PUT")
+
+
+class DuetEmulator:
+    """An HTTP server speaking the subset of the Duet API used by :class:`Machine`.
+
+    In ``dsf`` mode it answers ``POST /machine/code``, which blocks until the code has run. In
+    ``standalone`` mode it answers ``rr_gcode``, ``rr_model`` (including ``key=seqs``) and
+    ``rr_reply``, running codes in the background like the firmware does, from an input buffer of
+    :attr:`GCODE_BUFFER` bytes whose free space ``rr_gcode`` reports. Both modes serve
+    ``rr_download`` from :attr:`files`, and take uploads (``PUT /machine/file`` or ``rr_upload``)
+    into it; ``M32`` runs an uploaded file in the background.
+
+    :param mode: Either ``dsf`` or ``standalone``, defaults to "dsf"
+    :type mode: str, optional
+    :param latency: Seconds added to every HTTP request to model the network, defaults to 0.0
+    :type latency: float, optional
+    :param host: The interface to listen on, defaults to "127.0.0.1"
+    :type host: str, optional
+    :param port: The port to listen on; 0 picks a free port, defaults to 0
+    :type port: int, optional
+    :param kwargs: Passed on to :class:`DuetInterpreter`
+    """
+
+    GCODE_BUFFER = 255
+
+    def __init__(
+        self,
+        mode: str = "dsf",
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        **kwargs,
+    ):
+        if mode not in ("dsf", "standalone"):
+            raise ValueError(f"Unknown controller mode {mode}")
+        self.mode = mode
+        self.latency = latency
+        self.interpreter = DuetInterpreter(**kwargs)
+        self.request_count = 0
+        self._reply_buffer = []
+        self._queue = queue.Queue()
+        self._buffered = 0  # Bytes of code sent with `rr_gcode` and not yet run
+        self._buffer_lock = threading.Lock()
+        self.rejected_codes = 0
+        self._faults = []  # (status, drop) for the next requests, see `fail_requests`
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        self._threads = []
+
+    @property
+    def address(self):
+        """The address to pass to :class:`Machine`, e.g. ``127.0.0.1:54321``."""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def files(self):
+        """Files on the emulated SD card, by full path."""
+        return self.interpreter.files
+
+    def fail_requests(self, n: int = 1, status: int = 503, drop: bool = False):
+        """Make the next `n` requests fail, e.g. to test how they are retried.
+
+        :param n: The number of requests to fail, defaults to 1
+        :type n: int, optional
+        :param status: The status to answer with instead of handling the request, defaults to 503
+        :type status: int, optional
+        :param drop: Handle the requests, then close the connection without replying, as when the
+            network fails after the controller received them, defaults to False
+        :type drop: bool, optional
+        """
+        with self._buffer_lock:
+            self._faults.extend([(status, drop)] * n)
+
+    def start(self):
+        """Start serving in background threads."""
+        serve = lambda: self._server.serve_forever(poll_interval=0.05)
+        for target in (serve, self._run_queued):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self._queue.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run_queued(self):
+        """Run codes sent with `rr_gcode` one line at a time, appending each reply to the buffer."""
+        while True:
+            code = self._queue.get()
+            if code is None:
+                return
+            for line in code.split("\n"):
+                reply = self.interpreter.execute_line(line)
+                with self._buffer_lock:
+                    self._buffered -= len(line.encode()) + 1
+                with self.interpreter.lock:
+                    self._reply_buffer.append(reply)
+                    self.interpreter.model["seqs"]["reply"] += 1
+
+    def _request(self, handler, method):
+        self.request_count += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._buffer_lock:
+            fault = self._faults.pop(0) if self._faults else None
+        if fault is not None:
+            status, drop = fault
+            if not drop:
+                handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+                return handler._reply("Service unavailable", status=status)
+            handler.drop_reply = True
+        url = urlparse(handler.path)
+        query = {
+            k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()
+        }
+        endpoint = url.path.lstrip("/")
+
+        if method == "POST" and endpoint == "machine/code" and self.mode == "dsf":
+            length = int(handler.headers.get("Content-Length", 0))
+            code = handler.rfile.read(length).decode()
+            return handler._reply(self.interpreter.execute(code))
+        if (
+            method == "PUT"
+            and endpoint.startswith("machine/file/")
+            and self.mode == "dsf"
+        ):
+            length = int(handler.headers.get("Content-Length", 0))
+            name = sd_path(unquote(endpoint[len("machine/file/") :]))
+            self.files[name] = handler.rfile.read(length).decode()
+            return handler._reply("", status=201)
+        if method == "POST" and endpoint == "rr_upload" and self.mode == "standalone":
+            length = int(handler.headers.get("Content-Length", 0))
+            body = handler.rfile.read(length)
+            crc = query.get("crc32")
+            if crc is not None and int(crc, 16) != zlib.crc32(body) & 0xFFFFFFFF:
+                return handler._reply(json.dumps({"err": 1}))
+            self.files[sd_path(query.get("name", ""))] = body.decode()
+            return handler._reply(
+                json.dumps({"err": 0}), content_type="application/json"
+            )
+        if method == "GET" and endpoint == "rr_download":
+            name = query.get("name", "")
+            if name not in self.files:
+                return handler._reply(json.dumps({"err": 1}), status=404)
+            return handler._reply(
+                self.files[name], content_type="application/octet-stream"
+            )
+        if method == "GET" and self.mode == "standalone":
+            if endpoint == "rr_gcode":
+                code = query.get("gcode", "")
+                size = len(code.encode()) + 1
+                with self._buffer_lock:
+                    # Code that does not fit is dropped. A single line longer than the whole
+                    # buffer is taken into an empty buffer.
+                    if (
+                        code
+                        and size > self.GCODE_BUFFER - self._buffered
+                        and (self._buffered > 0 or "\n" in code)
+                    ):
+                        logger.warning(f"rr_gcode buffer full, dropped {code!r}")
+                        self.rejected_codes += 1
+                    elif code:
+                        self._buffered += size
+                        self._queue.put(code)
+                    space = max(self.GCODE_BUFFER - self._buffered, 0)
+                return handler._reply(
+                    json.dumps({"buff": space}), content_type="application/json"
+                )
+            if endpoint == "rr_model":
+                key = query.get("key", "")
+                flags = query.get("flags", "")
+                with self.interpreter.lock:
+                    body = json.dumps(
+                        {
+                            "key": key,
+                            "flags": flags,
+                            "result": self.interpreter.lookup(key, flags),
+                        },
+                        default=str,
+                    )
+                return handler._reply(body, content_type="application/json")
+            if endpoint == "rr_reply":
+                with self.interpreter.lock:
+                    reply = "\n".join(self._reply_buffer)
+                    self._reply_buffer = []
+                return handler._reply(reply)
+        if method in ("POST", "PUT"):
+            # Drain the body so the connection can be reused
+            handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        return handler._reply("Not found", status=404)
+
+
+class SerialDuetEmulator:
+    """A Duet controller on a pseudo-terminal, speaking the line-numbered serial protocol.
+
+    Lines may carry a line number and checksum (``N3 G0 X10*41``). A line with a bad checksum is
+    answered with ``Resend: N`` and ``ok``; lines that arrive after it are dropped until line `N`
+    is sent again. Each line is acknowledged with ``ok`` once run, after any reply text.
+
+    Example::
+
+        with SerialDuetEmulator(time_scale=0) as duet:
+            m = Machine(port=duet.port)
+
+    :param corrupt_lines: Line numbers whose first transmission is treated as corrupted, to
+        exercise resends, defaults to ()
+    :type corrupt_lines: Iterable[int], optional
+    :param kwargs: Passed on to :class:`DuetInterpreter`
+    """
+
+    def __init__(self, corrupt_lines=(), **kwargs):
+        self.interpreter = DuetInterpreter(**kwargs)
+        self.corrupt_lines = set(corrupt_lines)
+        self.lines_received = 0
+        self.resends_requested = 0
+        self._expected = None  # Next line number, once numbering has started
+        self._resending = False
+        self._upload = None  # (name, lines) while receiving a file after M560
+        self._stop = threading.Event()
+        self._thread = None
+        import tty  # POSIX only
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+
+    @property
+    def port(self):
+        """The device to open, e.g. ``/dev/pts/3``."""
+        return os.ttyname(self._slave)
+
+    @property
+    def files(self):
+        """Files on the emulated SD card, by full path."""
+        return self.interpreter.files
+
+    def start(self):
+        """Start answering in a background thread."""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop answering and close the pseudo-terminal."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _serve(self):
+        buffer = b""
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                buffer += os.read(self._master, 4096)
+            except OSError:
+                return
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.decode(errors="replace").strip("\r")
+                if line.strip():
+                    self._write(self._handle_line(line))
+
+    def _write(self, text):
+        if text:
+            os.write(self._master, text.encode())
+
+    def _handle_line(self, line: str) -> str:
+        """Run one received line and return what the controller sends back."""
+        self.lines_received += 1
+        if self._upload is not None:
+            name, lines = self._upload
+            if line.strip() == "<!-- **EoF** -->":
+                self.files[name] = "".join(lines)
+                self._upload = None
+                return "ok\n"
+            lines.append(line + "\n")
+            return ""
+
+        match = re.fullmatch(r"N(\d+)\s+(.*)\*(\d+)", line.strip())
+        if match is not None:
+            number, cmd = int(match.group(1)), match.group(2)
+            if self._resending and number != self._expected:
+                return ""  # Still waiting for the line that was asked for again
+            corrupted = int(match.group(3)) != checksum(f"N{number} {cmd}")
+            if number in self.corrupt_lines:
+                self.corrupt_lines.discard(number)
+                corrupted = True
+            code, params = parse_command(cmd)
+            if code == "M110":
+                self._expected = int(params.get("N", number)) + 1
+                self._resending = False
+                return "ok\n"
+            if corrupted or (self._expected is not None and number != self._expected):
+                self._resending = True
+                self.resends_requested += 1
+                return f"Resend: {self._expected}\nok\n"
+            self._resending = False
+            self._expected = number + 1
+        else:
+            cmd = line.strip()
+
+        code, params = parse_command(cmd)
+        if code == "M560":
+            name = re.search(r'P"([^"]*)"', cmd)
+            self._upload = (sd_path(name.group(1) if name else ""), [])
+            return "ok\n"
+        reply = self.interpreter.execute_line(cmd)
+        return (reply + "\n" if reply else "") + "ok\n"
@@ -0,0 +1,209 @@
+"""G-Code formatting shared by :class:`Machine` and :class:`AsyncMachine`, so both send the same commands."""
+
+from typing import List
+
+import numpy as np
+
+ABSOLUTE_POSITIONING = "G90"
+RELATIVE_POSITIONING = "G91"
+ABSOLUTE_EXTRUSION = "M82"
+RELATIVE_EXTRUSION = "M83"
+WAIT_FOR_MOVES = "M400"
+GET_POSITION = "M114"
+PUSH_STATE = "M120"
+POP_STATE = "M121"
+PARK_TOOL = "T-1"
+
+BATCH_MARKER = "science_jubilee batch "  # echoed after each command of a batch
+
+
+def _number(value: float):
+    """Format a coordinate or speed the way the controller is sent them."""
+    return "{0:.2f}".format(value)
+
+
+def move(
+    x: float = None,
+    y: float = None,
+    z: float = None,
+    e: float = None,
+    v: float = None,
+    s: float = 6000,
+    param: str = None,
+):
+    """Return the ``G0`` command moving the X/Y/Z/E/V axes. Absolute/relative mode is set separately.
+
+    :param x: x position on the bed, in whatever units have been set (default mm)
+    :type x: float, optional
+    :param y: y position on the bed, in whatever units have been set (default mm)
+    :type y: float, optional
+    :param z: z position on the bed, in whatever units have been set (default mm)
+    :type z: float, optional
+    :param e: extruder position, in whatever units have been set (default mm)
+    :type e: float, optional
+    :param v: v axis position, in whatever units have been set (default mm)
+    :type v: float, optional
+    :param s: speed at which to move (default 6000 mm/min)
+    :type s: float, optional
+    :param param: Extra parameters appended to the command, defaults to None
+    :type param: str, optional
+    :return: The G-Code command
+    :rtype: str
+    """
+    x_cmd = f"X{_number(x)}" if x is not None else ""
+    y_cmd = f"Y{_number(y)}" if y is not None else ""
+    z_cmd = f"Z{_number(z)}" if z is not None else ""
+    e_cmd = f"E{_number(e)}" if e is not None else ""
+    v_cmd = f"V{_number(v)}" if v is not None else ""
+    f_cmd = f"F{_number(s)}" if s is not None else ""
+    param_cmd = param if param is not None else ""
+    return f"G0 {z_cmd} {x_cmd} {y_cmd} {e_cmd} {v_cmd} {f_cmd} {param_cmd}"
+
+
+def tool_offset(tool_idx: int, x: float = None, y: float = None, z: float = None):
+    """Return the ``G10`` command setting the offsets of a tool.
+
+    :param tool_idx: The tool index
+    :type tool_idx: int
+    :param x: The x offset, defaults to None (unchanged)
+    :type x: float, optional
+    :param y: The y offset, defaults to None (unchanged)
+    :type y: float, optional
+    :param z: The z offset, defaults to None (unchanged)
+    :type z: float, optional
+    :return: The G-Code command
+    :rtype: str
+    """
+    x_cmd = f"X{_number(x)}" if x is not None else ""
+    y_cmd = f"Y{_number(y)}" if y is not None else ""
+    z_cmd = f"Z{_number(z)}" if z is not None else ""
+    return f"G10 P{tool_idx} {z_cmd} {x_cmd} {y_cmd}"
+
+
+def dwell(t: float, millis: bool = True):
+    """Return the ``G4`` command pausing the machine.
+
+    :param t: time to pause, in milliseconds by default
+    :type t: float
+    :param millis: boolean, set to false to use seconds. default unit is milliseconds.
+    :type millis: bool, optional
+    :return: The G-Code command
+    :rtype: str
+    """
+    param = "P" if millis else "S"
+    return f"G4 {param}{t}"
+
+
+def select_tool(tool_index: int):
+    """Return the command picking up a tool, or parking the current one for index -1."""
+    return f"T{tool_index}"
+
+
+def home(*axes: str):
+    """Return the ``G28`` command homing the given axes, or all axes if none are given."""
+    return " ".join(["G28"] + [axis.upper() for axis in axes])
+
+
+def set_position(**positions: float):
+    """Return the ``G92`` command setting the current position of axes, e.g. ``set_position(X=0)``."""
+    return " ".join(
+        ["G92"] + [f"{axis.upper()}{pos}" for axis, pos in positions.items()]
+    )
+
+
+def linear_path(
+    points: np.ndarray,
+    start: np.ndarray = None,
+    s: float = None,
+    e: np.ndarray = None,
+    decimals: int = 3,
+):
+    """Return the ``G1`` commands moving through a sequence of X/Y/Z points, all formatted at once.
+
+    Coordinates that do not change from one point to the next are left out, and the feed rate is
+    only given on the first command, which keeps dense paths short. Points that would not move
+    any axis are skipped.
+
+    :param points: The positions to move through, an (N, 3) array of X, Y and Z
+    :type points: :class:`numpy.ndarray`
+    :param start: The position before the first point, defaults to None (give every axis of the first point)
+    :type start: :class:`numpy.ndarray`, optional
+    :param s: speed at which to move, defaults to None (unchanged)
+    :type s: float, optional
+    :param e: The extrusion of each segment in relative extrusion mode, defaults to None (no extrusion). The
+        amounts are rounded so that their running total does not drift.
+    :type e: :class:`numpy.ndarray`, optional
+    :param decimals: The number of decimals of the coordinates, defaults to 3
+    :type decimals: int, optional
+    :return: The G-Code commands
+    :rtype: List[str]
+    """
+    points = np.round(np.asarray(points, dtype=float), decimals)
+    previous = np.empty_like(points)
+    previous[0] = np.nan if start is None else np.round(start, decimals)
+    previous[1:] = points[:-1]
+    changed = points != previous
+
+    columns = []
+    for i, axis in enumerate("XYZ"):
+        words = np.char.add(axis, np.char.mod(f"%.{decimals}f", points[:, i]))
+        columns.append(np.where(changed[:, i], words, "").tolist())
+    if e is not None:
+        # Rounding the running total, rather than each amount, keeps the error from adding up
+        total = np.round(np.cumsum(e), 5)
+        amounts = np.diff(total, prepend=0.0)
+        words = np.char.add("E", np.char.mod("%.5f", amounts))
+        columns.append(np.where(amounts != 0, words, "").tolist())
+
+    cmds = []
+    for words in zip(*columns):
+        cmd = " ".join(word for word in words if word)
+        if cmd:
+            cmds.append(f"G1 {cmd}")
+    if cmds and s is not None:
+        cmds[0] += f" F{_number(s)}"
+    return cmds
+
+
+def batch_request(cmds: List[str], marker: str = BATCH_MARKER):
+    """Pack several commands into one request, with an ``echo`` marker after each of them.
+
+    :param cmds: The G-Code commands to send, in order
+    :type cmds: List[str]
+    :param marker: The text echoed after each command, followed by its position, defaults to :data:`BATCH_MARKER`
+    :type marker: str, optional
+    :return: The request body, and the marker that ends the reply to the last command
+    :rtype: Tuple[str, str]
+    """
+    lines = []
+    for i, cmd in enumerate(cmds):
+        lines.append(cmd)
+        lines.append(f'echo "{marker}{i}"')
+    return "\n".join(lines), f"{marker}{len(cmds) - 1}"
+
+
+def split_batch_reply(response: str, n: int, marker: str = BATCH_MARKER):
+    """Split the combined reply of a :func:`batch_request` at the echo markers.
+
+    :param response: The reply to the whole request
+    :type response: str
+    :param n: The number of commands in the request
+    :type n: int
+    :param marker: The marker passed to :func:`batch_request`, defaults to :data:`BATCH_MARKER`
+    :type marker: str, optional
+    :return: The reply to each command, in order. A reply is None if it never arrived.
+    :rtype: list
+    """
+    if response is None:
+        return [None] * n
+    replies = [[] for _ in range(n)]
+    completed = 0
+    for line in response.split("\n"):
+        if completed < n and line.strip() == f"{marker}{completed}":
+            completed += 1
+        elif completed < n:
+            replies[completed].append(line)
+    return [
+        "\n".join(lines).strip() if i < completed or lines else None
+        for i, lines in enumerate(replies)
+    ]
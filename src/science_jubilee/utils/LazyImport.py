@@ -0,0 +1,64 @@
+"""Deferred imports of heavy or optional dependencies, so that importing science_jubilee stays fast.
+
+A module that is only needed by a few methods (e.g. OpenCV in the cameras) is bound to a
+stand-in at import time and only imported the first time one of its attributes is used::
+
+    cv2 = lazy_import("cv2")
+    plt = lazy_import("matplotlib.pyplot")
+"""
+
+import importlib
+import importlib.util
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A stand-in for a module, imported the first time one of its attributes is used.
+
+    :param name: The full name of the module, e.g. ``matplotlib.pyplot``
+    :type name: str
+    :param before: Called with no arguments right before the module is imported, defaults to None
+    :type before: callable, optional
+    """
+
+    def __init__(self, name: str, before=None):
+        super().__init__(name)
+        self._before = before
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            if self._before is not None:
+                self._before()
+            self._module = importlib.import_module(self.__name__)
+            # Later lookups are served from this module's own namespace
+            self.__dict__.update(self._module.__dict__)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name: str, before=None, optional: bool = False):
+    """Return a :class:`LazyModule` standing in for a module until it is used.
+
+    :param name: The full name of the module, e.g. ``matplotlib.pyplot``
+    :type name: str
+    :param before: Called with no arguments right before the module is imported, defaults to None
+    :type before: callable, optional
+    :param optional: Whether to return None rather than a stand-in if the module is not
+        installed, like ``try: import ... except ImportError`` would, defaults to False
+    :type optional: bool, optional
+    :return: The stand-in, or None if `optional` and the module is not installed
+    :rtype: :class:`LazyModule`
+    """
+    if optional and importlib.util.find_spec(name.split(".")[0]) is None:
+        return None
+    return LazyModule(name, before=before)
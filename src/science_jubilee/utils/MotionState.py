@@ -0,0 +1,271 @@
+"""Local model of the controller's motion state, kept up to date from the G-code sent to it."""
+
+import copy
+import re
+from typing import Dict
+
+# Axis letters that can appear in a move, other than the extruder.
+AXES = "XYZUVWABC"
+# Commands after which the position can no longer be predicted from the commands alone,
+# e.g. homing, probing, macros and resets. The position is re-read from the controller next time.
+RESYNC_COMMANDS = {
+    "G28",
+    "G29",
+    "G30",
+    "G32",
+    "G38.2",
+    "G38.3",
+    "G38.4",
+    "G38.5",
+    "G53",
+    "M23",
+    "M24",
+    "M32",
+    "M98",
+    "M121",
+    "M584",
+    "M999",
+}
+MOVE_COMMANDS = {"G0", "G1", "G2", "G3"}
+# Commands that only complete once every queued move has finished.
+SETTLE_COMMANDS = {"M400", "G4"}
+
+_WORD = re.compile(r"([A-Za-z])\s*([-+]?[0-9.:\-+]*)")
+
+
+def parse_command(line: str):
+    """Split a single line of G-Code into its command and parameter words.
+
+    :param line: A line of G-Code, e.g. ``G0 X10 Y20 F6000``
+    :type line: str
+    :return: The command (e.g. ``G0``), or None for a blank or meta-command line, and a
+        dictionary mapping each parameter letter to its (string) value
+    :rtype: Tuple[str, Dict[str, str]]
+    """
+    # Drop comments and quoted strings, which may contain letters that are not parameters.
+    line = line.split(";", 1)[0]
+    line = re.sub(r'"[^"]*"', '""', line).strip()
+    if not line or not line[0].upper() in "GMT":
+        return None, {}
+    words = _WORD.findall(line)
+    letter, number = words[0]
+    cmd = f"{letter.upper()}{number}"
+    if letter.upper() in "GM" and number:
+        # Normalize G00 -> G0, M082 -> M82, keeping decimal subcodes such as G38.2
+        whole, _, sub = number.partition(".")
+        cmd = f"{letter.upper()}{int(whole)}" + (f".{sub}" if sub else "")
+    params = {}
+    for param_letter, value in words[1:]:
+        params[param_letter.upper()] = value
+    return cmd, params
+
+
+def parse_m114(reply: str) -> Dict[str, str]:
+    """Parse the axis positions out of an ``M114`` reply.
+
+    :param reply: The reply to ``M114``, e.g. ``X:0.000 Y:0.000 Z:0.000 E:0.000 Count 0 0 0``
+    :type reply: str
+    :return: A dictionary mapping each axis name to its position, as reported
+    :rtype: Dict[str, str]
+    """
+    positions = {}
+    keyword = " Count "  # this is the keyword hosts like e.g. pronterface search for to track position
+    keyword_idx = reply.find(keyword)
+    if keyword_idx > -1:
+        reply = reply[:keyword_idx]
+        for e in reply.split(" "):
+            if ":" not in e:
+                continue
+            axis, pos = e.split(":", 2)
+            positions[axis] = pos
+    return positions
+
+
+class MotionState:
+    """Shadow copy of the controller's axis positions, positioning modes and tool offsets.
+
+    The state is updated from every command sent to the controller so that positions can be
+    read without querying it. Whenever a command makes the outcome unpredictable (homing,
+    probing moves, tool changes, macros, errors) the state is marked invalid and must be
+    re-synchronized from an ``M114`` reply.
+    """
+
+    def __init__(self):
+        self.positions = {}  # axis -> position in user coordinates, as reported by M114
+        self.valid = False
+        self.absolute_positioning = True
+        self.absolute_extrusion = True
+        self.active_tool = None  # None if unknown, -1 if no tool is selected
+        self.tool_offsets = {}  # tool number -> [x, y, z, ...] offsets
+        self.tool_extruders = {}  # tool number -> extruder numbers driven by the tool
+        # Whether moves were sent since the last command that waits for them to finish
+        self.moves_pending = False
+
+    def invalidate(self):
+        """Mark the positions as unknown until the next :meth:`sync`."""
+        self.valid = False
+
+    def copy(self):
+        """Return a copy of the state, e.g. to :meth:`restore` it if queued commands are not sent.
+
+        :rtype: :class:`MotionState`
+        """
+        return copy.deepcopy(self)
+
+    def restore(self, state):
+        """Reset the state to a copy taken with :meth:`copy`.
+
+        :param state: The saved state
+        :type state: :class:`MotionState`
+        """
+        self.__dict__.update(copy.deepcopy(state.__dict__))
+
+    def sync(self, positions: Dict[str, str]):
+        """Reset the positions from the controller, e.g. from a parsed ``M114`` reply.
+
+        :param positions: A dictionary mapping each axis name to its position
+        :type positions: Dict[str, str]
+        """
+        self.positions = {axis: float(pos) for axis, pos in positions.items()}
+        self.valid = len(self.positions) > 0
+
+    def as_dict(self) -> Dict[str, str]:
+        """Return the positions in the same format as :meth:`Machine.get_position`.
+
+        :return: A dictionary mapping each axis name to its position formatted as a string
+        :rtype: Dict[str, str]
+        """
+        return {axis: f"{pos:.3f}" for axis, pos in self.positions.items()}
+
+    def update(self, cmd: str):
+        """Apply the effect of one or more newline-separated commands to the state.
+
+        :param cmd: The G-Code sent to the controller
+        :type cmd: str
+        """
+        for line in cmd.split("\n"):
+            self._update_line(line)
+
+    def _update_line(self, line: str):
+        """Apply the effect of a single line of G-Code to the state."""
+        cmd, params = parse_command(line)
+        if cmd is None:
+            return
+        if cmd in MOVE_COMMANDS:
+            self.moves_pending = True
+            self._move(params)
+        elif cmd in SETTLE_COMMANDS:
+            self.moves_pending = False
+        elif cmd == "G90":
+            self.absolute_positioning = True
+        elif cmd == "G91":
+            self.absolute_positioning = False
+        elif cmd == "M82":
+            self.absolute_extrusion = True
+        elif cmd == "M83":
+            self.absolute_extrusion = False
+        elif cmd == "G92":
+            self._set_position(params)
+        elif cmd == "G10":
+            self._set_tool_offset(params)
+        elif cmd.startswith("T"):
+            if cmd != "T":  # A bare `T` only queries the current tool
+                # Tool change macros move the machine
+                self.active_tool = int(cmd[1:])
+                self.invalidate()
+        elif cmd in RESYNC_COMMANDS:
+            if cmd == "M999":
+                self.active_tool = None
+            elif cmd == "M121":
+                # The popped positioning modes are unknown
+                self.absolute_positioning = None
+                self.absolute_extrusion = None
+            self.invalidate()
+
+    def _move(self, params: Dict[str, str]):
+        """Apply a G0/G1/G2/G3 move."""
+        if not self.valid:
+            return
+        if "H" in params and params["H"] not in ("", "0"):
+            # Moves that stop on an endstop or probe end at an unknown position
+            self.invalidate()
+            return
+        for axis in AXES:
+            if axis not in params:
+                continue
+            value = _to_float(params[axis])
+            if value is None or self.absolute_positioning is None:
+                self.invalidate()
+                return
+            if self.absolute_positioning:
+                self.positions[axis] = value
+            elif axis in self.positions:
+                self.positions[axis] += value
+            elif value != 0:
+                # A relative move of an axis whose position was never reported
+                self.invalidate()
+                return
+        if "E" in params:
+            self._extrude(params["E"])
+
+    def _extrude(self, value: str):
+        """Apply the E parameter of a move to the extruders of the active tool."""
+        extruders = self.tool_extruders.get(self.active_tool)
+        amounts = [_to_float(v) for v in value.split(":")]
+        if self.active_tool == -1:
+            # Extrusion is ignored by the firmware when no tool is selected
+            return
+        if self.absolute_extrusion is False and all(a == 0 for a in amounts):
+            return
+        if (
+            not extruders
+            or None in amounts
+            or self.absolute_extrusion is None
+            or len(amounts) not in (1, len(extruders))
+            or (len(amounts) == 1 and len(extruders) > 1)  # mixing tools
+        ):
+            self.invalidate()
+            return
+        for extruder, amount in zip(extruders, amounts):
+            for axis in ("E", f"E{extruder}"):
+                if self.absolute_extrusion:
+                    self.positions[axis] = amount
+                else:
+                    self.positions[axis] = self.positions.get(axis, 0.0) + amount
+
+    def _set_position(self, params: Dict[str, str]):
+        """Apply a G92 set-position command."""
+        if not self.valid:
+            return
+        for axis in AXES + "E":
+            if axis in params:
+                value = _to_float(params[axis])
+                if value is None:
+                    self.invalidate()
+                    return
+                self.positions[axis] = value
+
+    def _set_tool_offset(self, params: Dict[str, str]):
+        """Apply a G10 tool offset command."""
+        if "L" in params or "P" not in params:
+            # Workplace coordinates, or firmware retraction; neither is tracked here
+            if "L" in params:
+                self.invalidate()
+            return
+        tool = int(_to_float(params["P"]))
+        offsets = list(self.tool_offsets.get(tool, [0.0, 0.0, 0.0]))
+        for i, axis in enumerate("XYZ"):
+            if axis in params:
+                offsets[i] = _to_float(params[axis])
+        self.tool_offsets[tool] = offsets
+        if tool == self.active_tool:
+            # The user position of the active tool shifts with its offset
+            self.invalidate()
+
+
+def _to_float(value: str):
+    """Convert a G-Code parameter value to a float, or return None if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
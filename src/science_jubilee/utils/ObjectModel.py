@@ -0,0 +1,331 @@
+"""In-memory cache of the controller's object model, shared by the :class:`Machine` properties."""
+
+import json
+import logging
+import threading
+import time
+
+from science_jubilee.utils.LazyImport import lazy_import
+from science_jubilee.utils.MotionState import parse_command
+
+# websocket-client, used for DSF object model subscriptions; imported once a subscription starts
+websocket = lazy_import("websocket", optional=True)
+
+logger = logging.getLogger(__name__)
+
+# Object model sections each command can change. Commands not listed leave the cache untouched.
+ALL_SECTIONS = None
+INVALIDATING_COMMANDS = {
+    "G10": ("tools",),  # tool offsets
+    "G28": ("move",),  # homed state
+    "M208": ("move",),  # axis limits
+    "M32": ALL_SECTIONS,  # jobs can change anything
+    "M563": ("tools",),  # tool definitions
+    "M584": ("move",),  # axis mapping
+    "M98": ALL_SECTIONS,  # macros can change anything
+    "M999": ALL_SECTIONS,  # reset
+}
+
+
+class ObjectModelCache:
+    """Cache of the controller's object model, filled with a single full-depth query.
+
+    The first read fetches the whole object model in one request. After that, sections are served
+    from memory until a command that can change them is sent, at which point only the affected
+    sections are read again. :attr:`version` is bumped every time the cached data changes.
+
+    The cache is thread-safe, so a :class:`ModelSubscription` can keep it up to date in the
+    background with :meth:`merge`; sections refreshed that way are not read again.
+
+    :param fetch: Function reading a key of the object model from the controller, called as
+        ``fetch(key)``; an empty key reads the whole model.
+    :type fetch: callable
+    """
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._model = None
+        self._stale = set()
+        self._stale_since = {}  # section -> time the section last went out of date
+        self._lock = threading.RLock()
+        self.version = 0
+
+    def get(self, section: str):
+        """Return a top-level section of the object model, e.g. ``move``, ``tools`` or ``state``.
+
+        :param section: The top-level key of the object model
+        :type section: str
+        :return: The cached value of the section
+        :rtype: Union[dict, list]
+        """
+        with self._lock:
+            if self._model is None:
+                self.refresh()
+            elif not self.is_current(section):
+                self.store(section, self._fetch(section))
+            return self._model[section]
+
+    def refresh(self):
+        """Fetch the whole object model from the controller."""
+        with self._lock:
+            self.store("", self._fetch(""))
+
+    def is_current(self, section: str):
+        """Whether a section can be served from memory, without fetching it.
+
+        :param section: The top-level key of the object model; an empty key checks the whole model
+        :type section: str
+        :rtype: bool
+        """
+        with self._lock:
+            if self._model is None:
+                return False
+            if not section:
+                return True
+            return section in self._model and section not in self._stale
+
+    def store(self, section: str, value):
+        """Store a section read from the controller, e.g. by an asynchronous client.
+
+        :param section: The top-level key of the object model; an empty key replaces the whole model
+        :type section: str
+        :param value: The value read from the controller
+        :type value: Union[dict, list]
+        """
+        with self._lock:
+            if not section:
+                self._model = value
+                self._stale = set()
+            else:
+                self._model[section] = value
+                self._stale.discard(section)
+            self.version += 1
+
+    def invalidate(self, *sections: str):
+        """Mark sections of the object model as out of date. With no arguments, drop the whole cache.
+
+        :param sections: The top-level keys to read again on next access
+        :type sections: str
+        """
+        with self._lock:
+            if not sections:
+                self._model = None
+            else:
+                now = time.monotonic()
+                for section in sections:
+                    self._stale.add(section)
+                    self._stale_since[section] = now
+            self.version += 1
+
+    def settle(self):
+        """Restart the out-of-date clock of stale sections once the commands that changed them have completed.
+
+        Background updates requested before this point may still hold the old values.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for section in self._stale:
+                self._stale_since[section] = now
+
+    def merge(
+        self,
+        delta: dict,
+        requested_at: float,
+        null_deletes: bool = False,
+        complete: tuple = None,
+    ):
+        """Merge a (partial) object model update into the cache.
+
+        :param delta: The update, keyed like the object model. Objects are merged key by key and
+            arrays element by element.
+        :type delta: dict
+        :param requested_at: The :func:`time.monotonic` time at which the update was requested;
+            stale sections are only marked up to date by updates requested after they went stale.
+        :type requested_at: float
+        :param null_deletes: Whether a null value removes the key (JSON merge patch), rather than
+            setting it to None, defaults to False
+        :type null_deletes: bool, optional
+        :param complete: The sections of `delta` that hold every value of the section, and so can
+            mark it up to date; sections read with the ``f`` flag leave the other values out.
+            Defaults to None (all of them, e.g. for a websocket patch)
+        :type complete: tuple, optional
+        """
+        with self._lock:
+            if self._model is None:
+                return
+            _merge(self._model, delta, null_deletes)
+            for section in delta if complete is None else complete:
+                if section in self._stale and requested_at > self._stale_since.get(
+                    section, 0
+                ):
+                    self._stale.discard(section)
+            self.version += 1
+
+    def stale_sections(self):
+        """Return the sections marked out of date.
+
+        :rtype: tuple
+        """
+        with self._lock:
+            return tuple(self._stale)
+
+    def update(self, cmd: str):
+        """Invalidate the sections changed by one or more newline-separated commands.
+
+        :param cmd: The G-Code sent to the controller
+        :type cmd: str
+        """
+        for line in cmd.split("\n"):
+            code, _ = parse_command(line)
+            if code is None:
+                continue
+            if code.startswith("T"):
+                if code != "T":
+                    # Tool changes also run the tool change macros
+                    self.invalidate("state", "tools", "move")
+            elif code in INVALIDATING_COMMANDS:
+                sections = INVALIDATING_COMMANDS[code]
+                if sections is ALL_SECTIONS:
+                    self.invalidate()
+                else:
+                    self.invalidate(*sections)
+
+
+def _merge(target, delta, null_deletes):
+    """Recursively merge `delta` into `target` in place and return the merged value."""
+    if isinstance(target, dict) and isinstance(delta, dict):
+        for key, value in delta.items():
+            if value is None and null_deletes:
+                target.pop(key, None)
+            elif key in target:
+                target[key] = _merge(target[key], value, null_deletes)
+            else:
+                target[key] = value
+        return target
+    if isinstance(target, list) and isinstance(delta, list):
+        merged = [
+            _merge(target[i], value, null_deletes) if i < len(target) else value
+            for i, value in enumerate(delta)
+        ]
+        target[:] = merged
+        return target
+    return delta
+
+
+class ModelSubscription:
+    """Background worker streaming object model updates into an :class:`ObjectModelCache`.
+
+    On DSF controllers the ``/machine`` websocket is used when `websocket-client` is installed:
+    the controller pushes a patch whenever the model changes. Otherwise, and on standalone
+    controllers, the frequently-changing part of the model (``flags=d99fn``) is polled every
+    `interval` seconds, along with the `sections` read in full (values that are not
+    frequently-changing, e.g. the message box in ``state``, are left out of the partial poll).
+    Sections marked out of date are read in full too, as only full reads mark them up to date.
+
+    :param cache: The cache to update
+    :type cache: :class:`ObjectModelCache`
+    :param transport: The transport of the controller
+    :type transport: :class:`HTTPTransport`
+    :param interval: Seconds between polls, defaults to 0.25
+    :type interval: float, optional
+    :param on_update: Called with each merged update, defaults to None
+    :type on_update: callable, optional
+    :param sections: Top-level keys of the object model also read in full on each poll, defaults to ()
+    :type sections: tuple, optional
+    """
+
+    def __init__(
+        self,
+        cache,
+        transport,
+        interval: float = 0.25,
+        on_update=None,
+        sections: tuple = (),
+    ):
+        self.cache = cache
+        self.transport = transport
+        self.interval = interval
+        self.on_update = on_update
+        self.sections = tuple(sections)
+        self.updates = 0
+        self.wake_time = None  # Next scheduled poll
+        self.ws = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the worker thread."""
+        if self.running:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="object-model-subscription", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the worker thread and wait for it to finish."""
+        self._stop.set()
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _merged(self, delta, requested_at, null_deletes=False, complete=None):
+        self.cache.merge(
+            delta, requested_at, null_deletes=null_deletes, complete=complete
+        )
+        self.updates += 1
+        if self.on_update is not None:
+            self.on_update(delta)
+
+    def _run(self):
+        if self.transport.mode == self.transport.DSF and websocket is not None:
+            try:
+                return self._run_websocket()
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                logger.warning(f"Object model websocket failed ({e}), polling instead")
+        self._run_polling()
+
+    def _run_websocket(self):
+        """Follow the DSF ``/machine`` websocket, which sends a merge patch each time it is acknowledged."""
+        self.ws = websocket.create_connection(f"ws://{self.transport.address}/machine")
+        requested_at = time.monotonic()
+        while not self._stop.is_set():
+            message = self.ws.recv()
+            self._merged(json.loads(message), requested_at, null_deletes=True)
+            requested_at = time.monotonic()
+            self.ws.send("OK\n")
+
+    def _run_polling(self):
+        """Poll the frequently-changing part of the object model."""
+        delay = self.interval
+        while not self._stop.is_set():
+            requested_at = time.monotonic()
+            try:
+                delta = self.transport.get_model("", flags="d99fn")
+                # The partial poll leaves out most values, so stale sections are read in full
+                complete = tuple(
+                    dict.fromkeys(self.sections + self.cache.stale_sections())
+                )
+                for section in complete:
+                    delta[section] = self.transport.get_model(section, flags="d99vn")
+                self._merged(delta, requested_at, complete=complete)
+                delay = self.interval
+            except Exception as e:
+                # Back off while the controller is unreachable, e.g. during a reset
+                logger.debug(f"Object model poll failed: {e}")
+                delay = min(delay * 2, 5.0)
+            self.wake_time = time.time() + delay
+            self._stop.wait(delay)
@@ -0,0 +1,401 @@
+"""Retry and backoff policy for the requests sent to the controller and to HTTP tools.
+
+Requests are either idempotent (queries, which can be sent again without side effects) or not
+(motion and other commands, which must run exactly once). A failed idempotent request is retried
+after an exponentially growing, jittered delay. A failed command is only sent again when it
+provably never reached the device, e.g. when the connection could not be opened, so a dropped
+reply never makes the machine move twice.
+
+A :class:`CircuitBreaker` stops a policy from retrying against a device that stays unreachable:
+after a run of consecutive failures every request fails at once, until a single trial request
+goes through again.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from science_jubilee.utils.MotionState import parse_command
+
+logger = logging.getLogger(__name__)
+
+QUERY = "query"
+COMMAND = "command"
+
+# Codes that only report state, so sending them twice is harmless
+QUERY_CODES = {
+    "M20",
+    "M27",
+    "M31",
+    "M36",
+    "M39",
+    "M105",
+    "M114",
+    "M115",
+    "M119",
+    "M122",
+    "M408",
+    "M409",
+}
+# Replies worth retrying an idempotent request on
+RETRY_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def idempotency(cmd: str):
+    """Classify a (possibly multi-line) G-Code command by whether it can safely be sent twice.
+
+    :param cmd: The G-Code command
+    :type cmd: str
+    :return: :data:`QUERY` if every code in `cmd` only reports state, otherwise :data:`COMMAND`
+    :rtype: str
+    """
+    for line in cmd.split("\n"):
+        code, _ = parse_command(line)
+        if code is not None and code not in QUERY_CODES:
+            return COMMAND
+    return QUERY
+
+
+class RequestNotSent(requests.ConnectionError):
+    """A request failed before any of it reached the device, so it can be sent again."""
+
+
+class CircuitOpenError(RequestNotSent):
+    """A request was not sent because the device has been failing, see :class:`CircuitBreaker`."""
+
+
+class RetryableStatus(requests.HTTPError):
+    """An idempotent request was answered with a status in :data:`RETRY_STATUSES`."""
+
+
+def request_sent(exc: Exception):
+    """Return whether a failed request may have reached the device.
+
+    :param exc: The exception the request failed with
+    :type exc: Exception
+    :rtype: bool
+    """
+    if isinstance(exc, (RequestNotSent, requests.ConnectTimeout)):
+        return False
+    # `requests` wraps the urllib3 error, whose `reason` tells whether a connection was opened
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    # NewConnectionError (e.g. connection refused) is a ConnectTimeoutError
+    return not isinstance(reason, ConnectTimeoutError)
+
+
+class CircuitBreaker:
+    """Fail requests at once while a device keeps failing, instead of retrying each of them.
+
+    The breaker opens after `threshold` consecutive failed attempts. While open, requests raise
+    :class:`CircuitOpenError` without being sent. After `reset_timeout` seconds one trial request
+    is let through: the breaker closes again if it succeeds, and stays open if it fails.
+
+    :param threshold: Consecutive failures that open the breaker, defaults to 10
+    :type threshold: int, optional
+    :param reset_timeout: Seconds to wait before letting a trial request through, defaults to 3.0
+    :type reset_timeout: float, optional
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold: int = 10, reset_timeout: float = 3.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0  # Times the breaker opened
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """One of :attr:`CLOSED`, :attr:`OPEN` or :attr:`HALF_OPEN`."""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """Check that a request may be sent.
+
+        :raises CircuitOpenError: If the breaker is open, or a trial request is already underway
+        :return: Whether the request is the trial request, which must be settled with
+            :meth:`record_success`, :meth:`record_failure` or :meth:`end_trial`
+        :rtype: bool
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            raise CircuitOpenError(
+                f"Not sent: {self.failures} consecutive requests failed"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (
+                self._opened_at is None and self.failures >= self.threshold
+            ):
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def end_trial(self):
+        """Let another trial request through, if the last one ended without an answer."""
+        with self._lock:
+            self._trial = False
+
+
+class RetryPolicy:
+    """When and how often to retry a failed request.
+
+    The delay before retry `n` is ``first * factor ** (n - 1)``, capped at `maximum`, and shortened by a
+    random fraction of up to `jitter` so that clients recovering from the same outage do not retry
+    in lockstep. Retrying stops after `attempts` attempts or once `deadline` seconds have passed,
+    whichever comes first; the last error is then raised.
+
+    :param attempts: The most attempts made per request, or None for no limit, defaults to 8
+    :type attempts: int, optional
+    :param first: The delay before the first retry, in seconds, defaults to 0.05
+    :type first: float, optional
+    :param factor: The growth of the delay between retries, defaults to 2.0
+    :type factor: float, optional
+    :param maximum: The longest delay between retries, in seconds, defaults to 1.0
+    :type maximum: float, optional
+    :param jitter: The largest fraction of each delay removed at random, defaults to 0.5
+    :type jitter: float, optional
+    :param deadline: The longest time spent on one request, retries included, in seconds, defaults to 10.0
+    :type deadline: float, optional
+    :param retry_on: The errors to retry, defaults to :class:`requests.RequestException`
+    :type retry_on: Tuple[type], optional
+    :param breaker: Shared by all requests to one device, defaults to None (no breaker)
+    :type breaker: :class:`CircuitBreaker`, optional
+    """
+
+    def __init__(
+        self,
+        attempts: int = 8,
+        first: float = 0.05,
+        factor: float = 2.0,
+        maximum: float = 1.0,
+        jitter: float = 0.5,
+        deadline: float = 10.0,
+        retry_on=(requests.RequestException,),
+        breaker: CircuitBreaker = None,
+    ):
+        if first <= 0:
+            raise ValueError("The delay between retries must be positive")
+        if attempts is None and deadline is None:
+            raise ValueError("A retry policy needs a number of attempts or a deadline")
+        self.attempts = attempts
+        self.first = first
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = tuple(retry_on)
+        self.breaker = breaker
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0  # Calls that failed after all their retries
+        self._local = threading.local()
+
+    def delays(self):
+        """Yield the jittered delay before each successive retry."""
+        delay = self.first
+        while True:
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(delay * self.factor, self.maximum)
+
+    def delay(self, n: int):
+        """Return the delay before retry `n` (counting from 1), without jitter."""
+        if n <= 0:
+            return 0
+        return min(self.first * self.factor ** (n - 1), self.maximum)
+
+    @property
+    def last_retries(self):
+        """The retries made by the most recent call on the current thread."""
+        return getattr(self._local, "retries", 0)
+
+    def _record(self, exc, retry_on):
+        """Record a failed attempt with the breaker."""
+        if isinstance(exc, retry_on):
+            self.breaker.record_failure()
+        elif isinstance(exc, CircuitOpenError):
+            self.breaker.end_trial()
+        else:
+            # The device answered, even if the caller did not like the answer
+            self.breaker.record_success()
+
+    def _should_retry(self, exc, idempotent, retry_on):
+        if isinstance(exc, CircuitOpenError) or not isinstance(exc, retry_on):
+            return False
+        if self.breaker is not None and self.breaker.state != CircuitBreaker.CLOSED:
+            # This failure opened the breaker
+            return False
+        return idempotent or not request_sent(exc)
+
+    def _attempts(self, deadline):
+        """Yield the delay to wait before each retry, until the attempts or the time run out."""
+        end = None if deadline is None else time.monotonic() + deadline
+        for attempt, delay in enumerate(self.delays(), start=1):
+            if self.attempts is not None and attempt >= self.attempts:
+                return
+            if end is not None and time.monotonic() + delay > end:
+                return
+            yield delay
+
+    def call(self, func, idempotent: bool = True, retry_on=None, deadline=...):
+        """Call `func` until it succeeds or the policy gives up.
+
+        :param func: The request to make, called without arguments
+        :type func: Callable
+        :param idempotent: Whether `func` can safely run more than once; if not, it is only retried
+            when the request never reached the device, defaults to True
+        :type idempotent: bool, optional
+        :param retry_on: Overrides the errors to retry, defaults to None
+        :type retry_on: Tuple[type], optional
+        :param deadline: Overrides :attr:`deadline` for this call
+        :type deadline: float, optional
+        :return: What `func` returned
+        """
+        retry_on = self.retry_on if retry_on is None else tuple(retry_on)
+        deadline = self.deadline if deadline is ... else deadline
+        self.calls += 1
+        self._local.retries = 0
+        delays = self._attempts(deadline)
+        while True:
+            trial = self.breaker is not None and self.breaker.allow()
+            try:
+                result = func()
+            except Exception as e:
+                if self.breaker is not None:
+                    self._record(e, retry_on)
+                delay = next(delays, None)
+                if delay is None or not self._should_retry(e, idempotent, retry_on):
+                    if isinstance(e, retry_on):
+                        self.failures += 1
+                    raise
+                logger.debug(f"Retrying in {delay:.3f} s after: {e!r}")
+                self._local.retries += 1
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+            finally:
+                if trial:
+                    # Never leave the trial unsettled, e.g. after a KeyboardInterrupt
+                    self.breaker.end_trial()
+
+    async def acall(self, func, idempotent: bool = True, retry_on=None, deadline=...):
+        """Awaitable version of :meth:`call`, for a `func` returning an awaitable."""
+        retry_on = self.retry_on if retry_on is None else tuple(retry_on)
+        deadline = self.deadline if deadline is ... else deadline
+        self.calls += 1
+        self._local.retries = 0
+        delays = self._attempts(deadline)
+        while True:
+            trial = self.breaker is not None and self.breaker.allow()
+            try:
+                result = await func()
+            except Exception as e:
+                if self.breaker is not None:
+                    self._record(e, retry_on)
+                delay = next(delays, None)
+                if delay is None or not self._should_retry(e, idempotent, retry_on):
+                    if isinstance(e, retry_on):
+                        self.failures += 1
+                    raise
+                logger.debug(f"Retrying in {delay:.3f} s after: {e!r}")
+                self._local.retries += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+            finally:
+                if trial:
+                    # Never leave the trial unsettled, e.g. after a KeyboardInterrupt
+                    self.breaker.end_trial()
+
+    def request(
+        self, session, method: str, url: str, idempotent: bool = None, **kwargs
+    ):
+        """Make an HTTP request with `session` under this policy.
+
+        Idempotent requests are also retried when answered with a status in
+        :data:`RETRY_STATUSES`; the last such response is returned if they keep failing.
+
+        :param session: A :class:`requests.Session`, or the :mod:`requests` module
+        :param method: The HTTP method, e.g. ``GET``
+        :type method: str
+        :param url: The url to request
+        :type url: str
+        :param idempotent: Whether the request can safely be sent twice, defaults to None (by
+            method: GET, HEAD, OPTIONS, PUT and DELETE are, POST is not)
+        :type idempotent: bool, optional
+        :param kwargs: Passed on to ``session.request``
+        :return: The HTTP response
+        :rtype: :class:`requests.Response`
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        def attempt():
+            response = session.request(method, url, **kwargs)
+            if idempotent and response.status_code in RETRY_STATUSES:
+                raise RetryableStatus(
+                    f"{method} {url} answered {response.status_code}",
+                    response=response,
+                )
+            return response
+
+        try:
+            return self.call(attempt, idempotent=idempotent)
+        except RetryableStatus as e:
+            return e.response
+
+    @property
+    def stats(self):
+        """Retry statistics.
+
+        :return: A dictionary with the number of calls made, retries made, calls that failed after
+            all their retries, and the state of the circuit breaker if there is one
+        :rtype: dict
+        """
+        stats = {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+        if self.breaker is not None:
+            stats["breaker"] = self.breaker.state
+            stats["trips"] = self.breaker.trips
+        return stats
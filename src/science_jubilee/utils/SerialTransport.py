@@ -0,0 +1,366 @@
+"""Serial (USB) transport used by :class:`Machine` to stream G-code to a Duet controller."""
+
+import collections
+import json
+import logging
+import re
+import threading
+import time
+
+from science_jubilee.utils.LazyImport import lazy_import
+
+serial = lazy_import("serial")  # Only imported once a serial connection is opened
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_END = "<!-- **EoF** -->"  # Ends the file contents sent after M560
+
+
+def checksum(line: str) -> int:
+    """Return the checksum of a line of G-Code: the XOR of all its bytes.
+
+    :param line: The line, including its line number, e.g. ``N3 G0 X10``
+    :type line: str
+    :rtype: int
+    """
+    value = 0
+    for byte in line.encode():
+        value ^= byte
+    return value
+
+
+def number_line(number: int, cmd: str) -> str:
+    """Prefix a command with a line number and append its checksum, e.g. ``N3 G0 X10*41``.
+
+    :param number: The line number
+    :type number: int
+    :param cmd: The command
+    :type cmd: str
+    :rtype: str
+    """
+    line = f"N{number} {cmd}"
+    return f"{line}*{checksum(line)}"
+
+
+class _PendingLine:
+    """A line sent to the controller and not yet acknowledged with `ok`."""
+
+    def __init__(self, number: int, cmd: str):
+        self.number = number
+        self.cmd = cmd
+        self.reply = []
+        self.done = threading.Event()
+
+
+class SerialTransport:
+    """A streaming serial connection to a single Duet controller, with the interface of :class:`HTTPTransport`.
+
+    Every command is sent as a line-numbered, checksummed line. Up to `window` lines are in
+    flight at once: the controller acknowledges each line with ``ok`` once it is queued, so
+    several moves sit in its planner while more are being sent. A background thread reads the
+    replies, matches them to the lines they answer and retransmits lines the controller asks for
+    again (``Resend: N``).
+
+    :param port: The serial port, e.g. ``/dev/ttyACM0``
+    :type port: str
+    :param baudrate: The baudrate, defaults to 115200
+    :type baudrate: int, optional
+    :param window: The maximum number of lines waiting for an ``ok``, defaults to 4
+    :type window: int, optional
+    :param line_ending: Appended to every line sent, defaults to "\\n"
+    :type line_ending: str, optional
+    :param connection: An already opened serial port to use instead of opening `port`, defaults to None
+    :type connection: :class:`serial.Serial`, optional
+    """
+
+    SERIAL = "serial"
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 115200,
+        window: int = 4,
+        line_ending: str = "\n",
+        connection=None,
+    ):
+        self.address = port
+        self.mode = self.SERIAL
+        self.window = window
+        self.line_ending = line_ending
+        self.ser = connection or serial.Serial(port, baudrate, timeout=0.1)
+
+        self._slots = threading.Semaphore(window)
+        self._lock = (
+            threading.RLock()
+        )  # Guards the line numbers, history and pending lines
+        self._pending = collections.deque()  # Lines waiting for an `ok`, in send order
+        self._history = {}  # line number -> numbered line, kept for resends
+        self._line_number = 0
+        self._text = []  # Reply text received since the last `ok`
+        self._skip_ok = 0  # `ok`s that follow resend requests rather than answer a line
+        self._closed = True
+        self._reader = None
+
+        # Statistics
+        self.lines_sent = 0
+        self.resends = 0
+        self.max_in_flight = 0
+        self.last_polls = 0  # Replies are pushed by the controller, never polled
+        self.last_retries = 0  # Resends needed by the most recent command
+
+        self._open()
+
+    def _open(self):
+        """Start reading replies and reset the line numbers, reopening the port if it was closed."""
+        if not self.ser.is_open:
+            self.ser.open()
+        self._closed = False
+        self._reader = threading.Thread(
+            target=self._read_loop, name="serial-reader", daemon=True
+        )
+        self._reader.start()
+        self.reset_line_numbers()
+
+    def reset_line_numbers(self):
+        """Restart line numbering on both ends with ``M110``."""
+        with self._lock:
+            self._line_number = -1
+            self._history = {}
+        self.send_code("M110 N0")
+
+    def send_code(
+        self,
+        cmd: str,
+        timeout: float = None,
+        response_wait: float = 60,
+        until: str = None,
+    ):
+        """Send one or more newline-separated commands and return the controller's reply to all of them.
+
+        The lines are streamed within the flow-control window; this returns once the last one has
+        been acknowledged.
+
+        :param cmd: The G-Code command to send
+        :type cmd: str
+        :param timeout: Unused; kept for compatibility with :meth:`HTTPTransport.send_code`
+        :type timeout: float, optional
+        :param response_wait: The time to wait for all the lines to be acknowledged, defaults to 60
+        :type response_wait: float, optional
+        :param until: Unused, since the replies to all the lines are always returned, defaults to None
+        :type until: str, optional
+        :return: The reply from the controller, or None if not every line was acknowledged in time
+        :rtype: str
+        """
+        if self._closed:
+            self._open()
+        resends = self.resends
+        try:
+            return self._stream(cmd, response_wait)
+        finally:
+            self.last_retries = self.resends - resends
+
+    def send_code_nowait(self, cmd: str, timeout: float = None):
+        """Send the lines of a command without waiting for them to be acknowledged.
+
+        :param cmd: The G-Code command to send
+        :type cmd: str
+        :param timeout: The time to wait for room in the flow-control window, defaults to None (1 s)
+        :type timeout: float, optional
+        """
+        if self._closed:
+            self._open()
+        deadline = time.time() + (1.0 if timeout is None else timeout)
+        for line in cmd.split("\n"):
+            if line.strip() and self._submit(line, deadline) is None:
+                logger.warning(f"Serial window still full; {line!r} not sent")
+                return
+
+    def _stream(self, cmd: str, response_wait: float):
+        """Stream the lines of `cmd` and collect their replies, see :meth:`send_code`."""
+        deadline = time.time() + response_wait
+        entries = []
+        for line in cmd.split("\n"):
+            if not line.strip():
+                continue
+            entry = self._submit(line, deadline)
+            if entry is None:
+                logger.warning(
+                    f"Serial window still full after {response_wait} s; {line!r} not sent"
+                )
+                break
+            entries.append(entry)
+        replies = []
+        for entry in entries:
+            if not entry.done.wait(max(deadline - time.time(), 0)):
+                logger.warning(f"No reply to {entry.cmd!r} within {response_wait} s")
+                return None
+            replies.extend(entry.reply)
+        if len(entries) < len([line for line in cmd.split("\n") if line.strip()]):
+            return None
+        return "\n".join(replies)
+
+    def _submit(self, cmd: str, deadline: float):
+        """Send a line as soon as the window has room for it."""
+        if not self._slots.acquire(timeout=max(deadline - time.time(), 0)):
+            return None
+        with self._lock:
+            self._line_number += 1
+            number = self._line_number
+            line = number_line(number, cmd)
+            entry = _PendingLine(number, cmd)
+            self._pending.append(entry)
+            self._history[number] = line
+            self._history.pop(number - 4 * self.window - 1, None)
+            self._write(line)
+            self.lines_sent += 1
+            self.max_in_flight = max(self.max_in_flight, len(self._pending))
+        return entry
+
+    def _write(self, line: str):
+        self.ser.write((line + self.line_ending).encode())
+
+    def _read_loop(self):
+        """Read replies until the port is closed."""
+        while not self._closed:
+            try:
+                data = self.ser.readline()
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._closed:
+                    return
+                logger.warning(f"Serial read failed: {e}")
+                time.sleep(0.1)
+                continue
+            line = data.decode(errors="replace").strip()
+            if line:
+                self._handle_reply(line)
+
+    def _handle_reply(self, line: str):
+        """Handle one line received from the controller."""
+        lower = line.lower()
+        if lower.startswith("resend:") or lower.startswith("rs "):
+            match = re.search(r"\d+", line)
+            if match is not None:
+                self._resend(int(match.group()))
+            return
+        if lower == "ok" or lower.startswith("ok "):
+            rest = line[2:].strip()
+            if rest and not rest.isdigit():
+                self._text.append(rest)
+            self._acknowledge()
+            return
+        self._text.append(line)
+
+    def _acknowledge(self):
+        """Hand the reply text received so far to the oldest line waiting for an `ok`."""
+        with self._lock:
+            if self._skip_ok > 0:
+                self._skip_ok -= 1
+                return
+            if not self._pending:
+                if self._text:
+                    logger.info(f"Unsolicited reply: {self._text}")
+                self._text = []
+                return
+            entry = self._pending.popleft()
+            entry.reply, self._text = self._text, []
+        entry.done.set()
+        self._slots.release()
+
+    def _resend(self, number: int):
+        """Send again every line from `number` on, after the controller dropped a corrupted line."""
+        with self._lock:
+            self.resends += 1
+            self._skip_ok += 1  # the `ok` following the resend request
+            for n in range(number, self._line_number + 1):
+                if n in self._history:
+                    self._write(self._history[n])
+
+    def get_model(self, key: str = "", flags: str = "d99v", timeout: float = None):
+        """Read (part of) the controller's object model with ``M409``.
+
+        :param key: The object model key to read; an empty key reads the whole model, defaults to ""
+        :type key: str, optional
+        :param flags: The ``M409`` flags, defaults to "d99v" (verbose, full depth)
+        :type flags: str, optional
+        :param timeout: Unused; kept for compatibility with :meth:`HTTPTransport.get_model`
+        :type timeout: float, optional
+        :raises TimeoutError: If the controller did not reply
+        :return: The value of the key in the object model
+        :rtype: Union[dict, list]
+        """
+        reply = self.send_code(f'M409 K"{key}" F"{flags}"', response_wait=10)
+        if reply is None:
+            raise TimeoutError(f"No reply to M409 from {self.address}")
+        for line in reversed(reply.split("\n")):
+            if line.startswith("{"):
+                return json.loads(line)["result"]
+        raise ValueError(f"Unexpected reply to M409: {reply}")
+
+    def upload(self, filepath: str, contents, timeout: float = None):
+        """Write a file to the controller's SD card with ``M560``.
+
+        :param filepath: The full filepath to write, e.g. ``0:/gcodes/job.g``
+        :type filepath: str
+        :param contents: The file contents
+        :type contents: Union[str, bytes]
+        :param timeout: The time to wait for the controller to acknowledge the file, defaults to None (60 s)
+        :type timeout: float, optional
+        :raises TimeoutError: If the controller did not acknowledge the file
+        """
+        if isinstance(contents, bytes):
+            contents = contents.decode()
+        response_wait = timeout or 60
+        if self.send_code(f'M560 P"{filepath}"', response_wait=response_wait) is None:
+            raise TimeoutError(f"Upload of {filepath} was not accepted")
+        # The contents go out as they are, without line numbers; one `ok` follows the end marker
+        deadline = time.time() + response_wait
+        if not self._slots.acquire(timeout=response_wait):
+            raise TimeoutError(f"Upload of {filepath} was not accepted")
+        with self._lock:
+            entry = _PendingLine(None, "M560 contents")
+            self._pending.append(entry)
+            for line in contents.splitlines():
+                self._write(line)
+            self._write(UPLOAD_END)
+        if not entry.done.wait(max(deadline - time.time(), 0)):
+            raise TimeoutError(f"Upload of {filepath} was not acknowledged")
+
+    def download(self, filepath: str, timeout: float = None):
+        """Files cannot be read back over the serial connection."""
+        raise NotImplementedError("Downloading files is only supported over HTTP")
+
+    @property
+    def stats(self):
+        """Flow-control statistics for this connection.
+
+        :return: A dictionary with the number of lines sent, how many times lines were sent again
+            and the largest number of lines that were in flight at once.
+        :rtype: dict
+        """
+        return {
+            "lines": self.lines_sent,
+            "resends": self.resends,
+            "max_in_flight": self.max_in_flight,
+        }
+
+    @property
+    def poll_stats(self):
+        """Replies are pushed by the controller, so there is nothing to poll."""
+        return {}
+
+    def close(self):
+        """Close the serial port and stop the reader thread. The port is reopened on next use."""
+        if self._closed:
+            return
+        self._closed = True
+        self.ser.close()
+        if self._reader is not None:
+            self._reader.join(timeout=1)
+        with self._lock:
+            # Lines in flight will never be acknowledged
+            for entry in self._pending:
+                entry.done.set()
+                self._slots.release()
+            self._pending.clear()
+            self._text = []
+            self._skip_ok = 0
@@ -0,0 +1,385 @@
+"""Dry-run time estimates for a simulated :class:`Machine`.
+
+A machine created with ``simulated=True`` runs every command it would send through a
+:class:`KinematicSimulator`, which plans the moves like the firmware does and adds up how long
+they would take::
+
+    m = Machine(simulated=True, deck_config="lab_automation_deck")
+    ...
+    with m.simulator.measure() as estimate:
+        pipette.transfer(50, plate["A1"], plate["B1"])
+    print(estimate.duration, estimate.breakdown)
+
+The axis limits come from the same ``move.axes`` entries of the object model that
+:attr:`Machine.axis_limits` reads, so the simulator can be set up from a real machine with
+:meth:`KinematicSimulator.from_axes`.
+"""
+
+import collections
+import math
+from contextlib import contextmanager
+from typing import Dict, List
+
+from science_jubilee.utils.MotionState import parse_command
+
+# Jubilee defaults, in the units of the object model: speed and jerk in mm/min, acceleration in mm/s^2
+DEFAULT_AXES = [
+    {
+        "letter": "X",
+        "min": -13.75,
+        "max": 313.75,
+        "speed": 13000.0,
+        "acceleration": 1100.0,
+        "jerk": 1000.0,
+    },
+    {
+        "letter": "Y",
+        "min": -44.0,
+        "max": 341.0,
+        "speed": 13000.0,
+        "acceleration": 1100.0,
+        "jerk": 1000.0,
+    },
+    {
+        "letter": "Z",
+        "min": 0.0,
+        "max": 295.0,
+        "speed": 800.0,
+        "acceleration": 100.0,
+        "jerk": 500.0,
+    },
+    {
+        "letter": "U",
+        "min": 0.0,
+        "max": 200.0,
+        "speed": 8000.0,
+        "acceleration": 800.0,
+        "jerk": 200.0,
+    },
+    {
+        "letter": "V",
+        "min": -100.0,
+        "max": 500.0,
+        "speed": 6000.0,
+        "acceleration": 500.0,
+        "jerk": 300.0,
+    },
+]
+DEFAULT_EXTRUDER = {"speed": 3000.0, "acceleration": 1300.0, "jerk": 3000.0}
+
+MOVE_CODES = {"G0", "G1"}
+CARTESIAN = ("X", "Y", "Z")
+
+# Kinds of time in the estimate breakdown
+MOVE = "move"
+DWELL = "dwell"
+TOOL_CHANGE = "tool_change"
+HOMING = "homing"
+REQUESTS = "requests"
+
+
+class Estimate:
+    """The time estimated for the commands simulated within :meth:`KinematicSimulator.measure`.
+
+    :attr:`breakdown` splits the :attr:`duration` into time spent moving, dwelling, changing
+    tools, homing and waiting on requests; :attr:`moves` counts the moves.
+    """
+
+    def __init__(self):
+        self.breakdown = collections.Counter()
+        self.moves = 0
+        self.distance = 0.0
+
+    @property
+    def duration(self):
+        """The estimated time in seconds."""
+        return sum(self.breakdown.values())
+
+    def __repr__(self):
+        return f"Estimate({self.duration:.2f} s, {self.moves} moves)"
+
+
+class _Move:
+    """A planned linear move."""
+
+    def __init__(self, length, direction, speed, acceleration, rest_speed):
+        self.length = length
+        self.direction = direction  # axis -> signed displacement per mm of `length`
+        self.speed = speed  # cruise speed, mm/s
+        self.acceleration = acceleration  # mm/s^2
+        self.rest_speed = rest_speed  # fastest speed it can start or stop at, mm/s
+        self.entry = 0.0
+        self.exit = 0.0
+
+    def duration(self):
+        """Time of a trapezoidal speed profile from `entry` to `exit` speed."""
+        v, a, d = self.speed, self.acceleration, self.length
+        v0, v1 = min(self.entry, v), min(self.exit, v)
+        accel = (v**2 - v0**2) / (2 * a)
+        decel = (v**2 - v1**2) / (2 * a)
+        if accel + decel <= d:
+            return (v - v0) / a + (v - v1) / a + (d - accel - decel) / v
+        peak = math.sqrt(max((2 * a * d + v0**2 + v1**2) / 2, 0.0))
+        return max(peak - v0, 0.0) / a + max(peak - v1, 0.0) / a
+
+
+class KinematicSimulator:
+    """Estimates how long G-Code takes to run, from the per-axis speed, acceleration and jerk limits.
+
+    Moves are planned like the firmware's look-ahead: consecutive moves are joined at the
+    fastest speed the jerk limits allow, and each one accelerates and decelerates with a
+    trapezoidal speed profile. Commands that wait for motion (``M400``, ``G4``, tool changes,
+    homing, ...) end the look-ahead, so a machine waiting after every move is estimated as
+    coming to a stop after each of them.
+
+    :param axes: The ``move.axes`` entries of the object model: letter, min, max, speed (mm/min),
+        acceleration (mm/s^2) and jerk (mm/min), defaults to :data:`DEFAULT_AXES`
+    :type axes: List[dict], optional
+    :param extruder: The speed, acceleration and jerk of the extruders, defaults to :data:`DEFAULT_EXTRUDER`
+    :type extruder: dict, optional
+    :param tools: The ``tools`` entries of the object model: number, name and offsets, defaults to tools 0 to 3 without offsets
+    :type tools: List[dict], optional
+    :param tool_change_time: Seconds a tool change takes, including its macros, defaults to 8
+    :type tool_change_time: float, optional
+    :param homing_time: Seconds it takes to home one axis, defaults to 5
+    :type homing_time: float, optional
+    :param request_time: Seconds of round trip to the machine for each request, defaults to 0.02
+    :type request_time: float, optional
+    """
+
+    def __init__(
+        self,
+        axes: List[dict] = None,
+        extruder: dict = None,
+        tools: List[dict] = None,
+        tool_change_time: float = 8.0,
+        homing_time: float = 5.0,
+        request_time: float = 0.02,
+    ):
+        self.axes = [dict(axis) for axis in (axes or DEFAULT_AXES)]
+        self.extruder = dict(extruder or DEFAULT_EXTRUDER)
+        if tools is None:
+            tools = [{"number": i, "name": f"tool{i}"} for i in range(4)]
+        self.tools = [
+            {
+                "number": tool["number"],
+                "name": tool.get("name", ""),
+                "offsets": list(tool.get("offsets", [0.0] * len(self.axes))),
+                "extruders": list(tool.get("extruders", [])),
+            }
+            for tool in tools
+        ]
+        self.tool_change_time = tool_change_time
+        self.homing_time = homing_time
+        self.request_time = request_time
+        self._limits = {axis["letter"]: axis for axis in self.axes}
+
+        self.position = {letter: 0.0 for letter in self._limits}
+        self.position["E"] = 0.0
+        self.feed_rate = 3000.0  # mm/min
+        self.absolute_positioning = True
+        self.absolute_extrusion = True
+        self.current_tool = -1
+        self._stack = []
+        self._pending = []  # Moves not planned yet
+        self._estimates = [
+            Estimate()
+        ]  # The running total, and any open `measure` blocks
+
+    def object_model(self):
+        """Return the object model of the simulated machine, as read by :class:`Machine`.
+
+        :rtype: dict
+        """
+        return {
+            "move": {"axes": self.axes},
+            "tools": self.tools,
+            "state": {"currentTool": self.current_tool, "status": "idle"},
+        }
+
+    @classmethod
+    def from_axes(cls, axes: List[dict], **kwargs):
+        """Create a simulator from the ``move.axes`` of a real machine, e.g. ``machine.object_model.get("move")["axes"]``.
+
+        :param axes: The ``move.axes`` entries of the object model
+        :type axes: List[dict]
+        :return: The simulator
+        :rtype: :class:`KinematicSimulator`
+        """
+        keys = ("letter", "min", "max", "speed", "acceleration", "jerk")
+        return cls(
+            axes=[{k: axis[k] for k in keys if k in axis} for axis in axes], **kwargs
+        )
+
+    @property
+    def total(self):
+        """The :class:`Estimate` of everything simulated so far."""
+        self._flush()
+        return self._estimates[0]
+
+    @property
+    def elapsed(self):
+        """The estimated time of everything simulated so far, in seconds."""
+        return self.total.duration
+
+    @contextmanager
+    def measure(self):
+        """Estimate the time of the commands simulated in the body of a `with` block.
+
+        :return: The estimate, filled in when the block exits
+        :rtype: :class:`Estimate`
+        """
+        self._flush()
+        estimate = Estimate()
+        self._estimates.append(estimate)
+        try:
+            yield estimate
+        finally:
+            self._flush()
+            self._estimates.remove(estimate)
+
+    def _add(self, kind: str, seconds: float):
+        for estimate in self._estimates:
+            estimate.breakdown[kind] += seconds
+
+    def send(self, cmd: str):
+        """Simulate one request of one or more newline-separated commands.
+
+        :param cmd: The G-Code sent to the machine
+        :type cmd: str
+        """
+        self._add(REQUESTS, self.request_time)
+        for line in cmd.split("\n"):
+            self.execute_line(line)
+
+    def execute_line(self, line: str):
+        """Simulate a single line of G-Code."""
+        code, params = parse_command(line)
+        if code is None:
+            return
+        if code in MOVE_CODES:
+            self._move(params)
+        elif code.startswith("T") and code != "T":
+            self._flush()
+            tool = int(code[1:])
+            if tool != self.current_tool:
+                self._add(TOOL_CHANGE, self.tool_change_time)
+                self.current_tool = max(tool, -1)
+        elif code == "G4":
+            self._flush()
+            if "P" in params:
+                self._add(DWELL, float(params["P"]) / 1000)
+            elif "S" in params:
+                self._add(DWELL, float(params["S"]))
+        elif code == "G28":
+            self._flush()
+            letters = [letter for letter in self._limits if letter in params]
+            letters = letters or list(self._limits)
+            self._add(HOMING, self.homing_time * len(letters))
+            for letter in letters:
+                self.position[letter] = 0.0
+        elif code == "G10" and params.get("P"):
+            for tool in self.tools:
+                if tool["number"] == int(float(params["P"])):
+                    for i, axis in enumerate(self.axes):
+                        if params.get(axis["letter"]):
+                            tool["offsets"][i] = float(params[axis["letter"]])
+        elif code == "G90":
+            self.absolute_positioning = True
+        elif code == "G91":
+            self.absolute_positioning = False
+        elif code == "M82":
+            self.absolute_extrusion = True
+        elif code == "M83":
+            self.absolute_extrusion = False
+        elif code == "G92":
+            for letter in self.position:
+                if params.get(letter):
+                    self.position[letter] = float(params[letter])
+        elif code == "M120":
+            self._stack.append(
+                (self.absolute_positioning, self.absolute_extrusion, self.feed_rate)
+            )
+        elif code == "M121" and self._stack:
+            (
+                self.absolute_positioning,
+                self.absolute_extrusion,
+                self.feed_rate,
+            ) = self._stack.pop()
+        else:
+            # M400 and anything else the firmware runs once the moves before it are done
+            self._flush()
+
+    def _move(self, params: Dict[str, str]):
+        if params.get("F"):
+            self.feed_rate = float(params["F"])
+        displacement = {}
+        for letter in self._limits:
+            if params.get(letter):
+                value = float(params[letter])
+                target = (
+                    value
+                    if self.absolute_positioning
+                    else self.position[letter] + value
+                )
+                displacement[letter] = target - self.position[letter]
+                self.position[letter] = target
+        if params.get("E"):
+            # Mixing extruders share the first amount
+            value = float(params["E"].split(":")[0])
+            target = value if self.absolute_extrusion else self.position["E"] + value
+            displacement["E"] = target - self.position["E"]
+            self.position["E"] = target
+        displacement = {k: d for k, d in displacement.items() if abs(d) > 1e-9}
+        if not displacement:
+            return
+
+        # The feed rate applies to the Cartesian length, or to the other axes if XYZ do not move
+        cartesian = [d for k, d in displacement.items() if k in CARTESIAN]
+        length = math.sqrt(sum(d**2 for d in (cartesian or displacement.values())))
+        direction = {k: d / length for k, d in displacement.items()}
+        speed = self.feed_rate / 60
+        acceleration = math.inf
+        rest_speed = math.inf
+        for letter, share in direction.items():
+            limits = self._limits.get(letter, self.extruder)
+            share = abs(share)
+            speed = min(speed, limits["speed"] / 60 / share)
+            acceleration = min(acceleration, limits["acceleration"] / share)
+            rest_speed = min(rest_speed, limits["jerk"] / 60 / share)
+        self._pending.append(_Move(length, direction, speed, acceleration, rest_speed))
+        for estimate in self._estimates:
+            estimate.moves += 1
+            estimate.distance += length
+
+    def _junction_speed(self, a: _Move, b: _Move):
+        """The fastest speed at which the machine can go from move `a` to move `b`."""
+        speed = min(a.speed, b.speed)
+        for letter in set(a.direction) | set(b.direction):
+            change = abs(a.direction.get(letter, 0.0) - b.direction.get(letter, 0.0))
+            if change > 1e-12:
+                limits = self._limits.get(letter, self.extruder)
+                speed = min(speed, limits["jerk"] / 60 / change)
+        return speed
+
+    def _flush(self):
+        """Plan the pending moves, which end at rest, and add up their time."""
+        moves, self._pending = self._pending, []
+        if not moves:
+            return
+        # Highest possible entry speed of each move, and exit speed of the last one
+        limits = [moves[0].rest_speed]
+        limits += [self._junction_speed(a, b) for a, b in zip(moves, moves[1:])]
+        limits.append(moves[-1].rest_speed)
+        # Backward pass: slow down in time for the junctions ahead
+        for i in range(len(moves) - 1, -1, -1):
+            reachable = math.sqrt(
+                limits[i + 1] ** 2 + 2 * moves[i].acceleration * moves[i].length
+            )
+            limits[i] = min(limits[i], reachable)
+        # Forward pass: only as fast as the machine can accelerate to
+        for i, move in enumerate(moves):
+            reachable = math.sqrt(limits[i] ** 2 + 2 * move.acceleration * move.length)
+            limits[i + 1] = min(limits[i + 1], reachable)
+            move.entry, move.exit = limits[i], limits[i + 1]
+            self._add(MOVE, move.duration())
@@ -0,0 +1,163 @@
+"""A uniform grid index over the footprints of wells, to find the wells at or near an (x, y) position.
+
+Each footprint (a circle, or an axis-aligned rectangle) is registered in every grid cell its
+bounding box overlaps, so a point lookup only tests the few footprints of one cell, and nearest and
+radius searches only visit the cells around the query. With cells about the size of a well, each
+query tests a handful of wells whatever the number of wells indexed.
+"""
+
+from collections import defaultdict
+from math import floor, hypot
+
+import numpy as np
+
+
+class GridIndex:
+    """Index footprints, given by their centers and half-sizes, on a uniform grid.
+
+    :param x: The x-coordinates of the footprint centers
+    :type x: np.ndarray
+    :param y: The y-coordinates of the footprint centers
+    :type y: np.ndarray
+    :param half_x: The radius of circular footprints, or the half-width of rectangular ones
+    :type half_x: np.ndarray
+    :param half_y: The half-height of rectangular footprints, ignored for circular ones
+    :type half_y: np.ndarray
+    :param circular: Whether each footprint is a circle, defaults to all of them
+    :type circular: np.ndarray, optional
+    :param cell: The size of the grid cells, in mm, defaults to the largest footprint size
+    :type cell: float, optional
+    """
+
+    def __init__(self, x, y, half_x, half_y, circular=None, cell: float = None):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        half_x = np.nan_to_num(np.asarray(half_x, dtype=float))
+        half_y = np.nan_to_num(np.asarray(half_y, dtype=float))
+        if circular is None:
+            circular = np.ones(len(x), dtype=bool)
+        circular = np.asarray(circular, dtype=bool)
+        if cell is None:
+            cell = 2 * max(half_x.max(initial=0), half_y.max(initial=0))
+        self.cell = max(float(cell), 1.0)
+        # Scalar queries are faster on Python lists than on small arrays
+        self._x, self._y = x.tolist(), y.tolist()
+        self._hx, self._hy = half_x.tolist(), half_y.tolist()
+        self._circular = circular.tolist()
+
+        self._cells = defaultdict(list)
+        # The half-size of the bounding box of each footprint
+        reach_x = half_x
+        reach_y = np.where(circular, half_x, half_y)
+        lo_i = np.floor((x - reach_x) / self.cell).astype(int)
+        hi_i = np.floor((x + reach_x) / self.cell).astype(int)
+        lo_j = np.floor((y - reach_y) / self.cell).astype(int)
+        hi_j = np.floor((y + reach_y) / self.cell).astype(int)
+        for n in range(len(x)):
+            for i in range(lo_i[n], hi_i[n] + 1):
+                for j in range(lo_j[n], hi_j[n] + 1):
+                    self._cells[(i, j)].append(n)
+        self._cells = dict(self._cells)
+        if len(x):
+            self.bounds = (
+                float((x - reach_x).min()),
+                float((y - reach_y).min()),
+                float((x + reach_x).max()),
+                float((y + reach_y).max()),
+            )
+            self._extent = (lo_i.min(), lo_j.min(), hi_i.max(), hi_j.max())
+        else:
+            self.bounds = None
+
+    def __len__(self):
+        return len(self._x)
+
+    def _key(self, x: float, y: float):
+        return floor(x / self.cell), floor(y / self.cell)
+
+    def _contains(self, n: int, x: float, y: float):
+        dx, dy = x - self._x[n], y - self._y[n]
+        if self._circular[n]:
+            return dx * dx + dy * dy <= self._hx[n] * self._hx[n]
+        return abs(dx) <= self._hx[n] and abs(dy) <= self._hy[n]
+
+    def at(self, x: float, y: float):
+        """Return the footprint containing (x, y), the one with the closest center if they overlap.
+
+        :return: The index of the footprint, or None
+        :rtype: int
+        """
+        best, best_d = None, None
+        for n in self._cells.get(self._key(x, y), ()):
+            if self._contains(n, x, y):
+                d = hypot(x - self._x[n], y - self._y[n])
+                if best is None or d < best_d:
+                    best, best_d = n, d
+        return best
+
+    def within(self, x: float, y: float, radius: float):
+        """Return the footprints whose center is within `radius` of (x, y), closest first.
+
+        :return: A list of (index, distance) pairs
+        :rtype: List[Tuple[int, float]]
+        """
+        i0, j0 = self._key(x - radius, y - radius)
+        i1, j1 = self._key(x + radius, y + radius)
+        if self.bounds is not None:
+            # Do not walk the empty cells of a large radius
+            ei0, ej0, ei1, ej1 = self._extent
+            i0, j0, i1, j1 = max(i0, ei0), max(j0, ej0), min(i1, ei1), min(j1, ej1)
+        found = {}
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for n in self._cells.get((i, j), ()):
+                    if n not in found:
+                        d = hypot(x - self._x[n], y - self._y[n])
+                        if d <= radius:
+                            found[n] = d
+        return sorted(found.items(), key=lambda item: item[1])
+
+    def nearest(self, x: float, y: float):
+        """Return the footprint whose center is closest to (x, y).
+
+        The rings of cells around the query are searched outwards, until no unvisited cell can hold
+        a closer center.
+
+        :return: The index of the footprint and the distance to its center, or (None, inf) if empty
+        :rtype: Tuple[int, float]
+        """
+        best, best_d = None, float("inf")
+        if self.bounds is None:
+            return best, best_d
+        ci, cj = self._key(x, y)
+        ei0, ej0, ei1, ej1 = self._extent
+        # Before the first ring there are no cells yet, and beyond the last no more
+        first = max(ei0 - ci, ci - ei1, ej0 - cj, cj - ej1, 0)
+        last = max(ci - ei0, ei1 - ci, cj - ej0, ej1 - cj)
+        for ring in range(first, last + 1):
+            for i, j in self._ring(ci, cj, ring, self._extent):
+                for n in self._cells.get((i, j), ()):
+                    d = hypot(x - self._x[n], y - self._y[n])
+                    if d < best_d:
+                        best, best_d = n, d
+            # Centers in the next rings are at least this far away
+            if best_d <= ring * self.cell:
+                break
+        return best, best_d
+
+    @staticmethod
+    def _ring(ci: int, cj: int, ring: int, extent):
+        """Yield the cells at Chebyshev distance `ring` from (ci, cj), within `extent`."""
+        if ring == 0:
+            yield ci, cj
+            return
+        ei0, ej0, ei1, ej1 = extent
+        i0, i1 = max(ci - ring, ei0), min(ci + ring, ei1)
+        j0, j1 = max(cj - ring + 1, ej0), min(cj + ring - 1, ej1)
+        for j in (cj - ring, cj + ring):
+            if ej0 <= j <= ej1:
+                for i in range(i0, i1 + 1):
+                    yield i, j
+        for i in (ci - ring, ci + ring):
+            if ei0 <= i <= ei1:
+                for j in range(j0, j1 + 1):
+                    yield i, j
@@ -0,0 +1,282 @@
+"""Timing of the commands sent to the machine, grouped by the high-level operation that sent them.
+
+Tracing is off until a :class:`Tracer` is given to a :class:`Machine`::
+
+    tracer = Tracer()
+    m = Machine(address="192.168.1.2", tracer=tracer)
+    pipette.transfer(50, plate["A1"], plate["B1"])
+    tracer.export_chrome_trace("transfer.json")  # open in chrome://tracing or Perfetto
+    print(tracer.summary()["Pipette.transfer"])
+
+Every command sent gets a ``gcode`` span, nested in the span of the operation that sent it
+(methods decorated with :func:`traced`, e.g. ``Pipette.transfer`` or ``Machine.pickup_tool``).
+"""
+
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+OPERATION = "operation"
+GCODE = "gcode"
+
+# Upper edges of the duration histogram buckets, in seconds
+HISTOGRAM_EDGES = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+
+def _bucket_label(edge: float):
+    return f"<{edge * 1000:g}ms" if edge < 1 else f"<{edge:g}s"
+
+
+class Span:
+    """A timed section of work, e.g. an operation or a single command.
+
+    Command spans record what it took to get the reply in their attributes: `path` (the
+    transport mode, "dsf", "standalone" or "serial"), `polls`, `retries` and `reply_bytes`.
+    Operation spans add up the commands sent within them: `commands`, `command_time` and `polls`.
+
+    :param name: The name of the span, e.g. ``Pipette.transfer`` or ``G0``
+    :type name: str
+    :param category: :data:`OPERATION` or :data:`GCODE`
+    :type category: str
+    :param parent: The span this one is nested in, defaults to None
+    :type parent: :class:`Span`, optional
+    """
+
+    def __init__(self, name: str, category: str, parent=None, **attrs):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.attrs = attrs
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+        if category == OPERATION:
+            self.attrs.update(commands=0, command_time=0.0, polls=0)
+
+    @property
+    def duration(self):
+        """The time spent in the span in seconds, so far if it has not ended."""
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def operation(self):
+        """The name of the innermost operation this span belongs to, or None."""
+        span = self.parent
+        while span is not None and span.category != OPERATION:
+            span = span.parent
+        return span.name if span is not None else None
+
+    def as_dict(self, origin: float = 0):
+        """Return the span as a JSON-serializable dictionary, with times relative to `origin`."""
+        return {
+            "name": self.name,
+            "category": self.category,
+            "operation": self.operation,
+            "start": self.start - origin,
+            "duration": self.duration,
+            "thread": self.thread,
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """Collects :class:`Span` objects from one or more machines.
+
+    Spans nest per thread, so operations running in parallel threads are kept apart.
+
+    :param max_spans: The number of finished spans kept; the oldest are dropped first, defaults to 100000
+    :type max_spans: int, optional
+    """
+
+    def __init__(self, max_spans: int = 100000):
+        self.spans = collections.deque(maxlen=max_spans)
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return the innermost open span of the calling thread, or None."""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, category: str = OPERATION, **attrs):
+        """Time the body of a `with` block as a span nested in the current one.
+
+        :param name: The name of the span
+        :type name: str
+        :param category: :data:`OPERATION` or :data:`GCODE`, defaults to :data:`OPERATION`
+        :type category: str, optional
+        :return: The span, whose attributes can be added to inside the block
+        :rtype: :class:`Span`
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        stack = self._local.stack
+        span = Span(name, category, parent=self.current(), **attrs)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+            if category == GCODE:
+                self._add_to_operations(span)
+            with self._lock:
+                self.spans.append(span)
+
+    @staticmethod
+    def _add_to_operations(span: Span):
+        """Count a finished command in every operation it was sent from."""
+        parent = span.parent
+        while parent is not None:
+            if parent.category == OPERATION:
+                parent.attrs["commands"] += 1
+                parent.attrs["command_time"] += span.duration
+                parent.attrs["polls"] += span.attrs.get("polls", 0)
+            parent = parent.parent
+
+    def clear(self):
+        """Drop all finished spans."""
+        with self._lock:
+            self.spans.clear()
+
+    def _finished(self, category: str = None) -> List[Span]:
+        with self._lock:
+            spans = list(self.spans)
+        return [s for s in spans if category is None or s.category == category]
+
+    def to_json(self):
+        """Return the finished spans as a list of dictionaries, in the order they ended.
+
+        :rtype: List[dict]
+        """
+        return [span.as_dict(self.origin) for span in self._finished()]
+
+    def export_json(self, path: str):
+        """Write the finished spans to a JSON file, see :meth:`to_json`.
+
+        :param path: The file to write
+        :type path: str
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def to_chrome_trace(self):
+        """Return the finished spans in the Chrome trace event format.
+
+        :return: A dictionary that can be loaded by ``chrome://tracing`` or Perfetto once saved as JSON
+        :rtype: dict
+        """
+        pid = os.getpid()
+        events = []
+        for span in self._finished():
+            args = {k: v for k, v in span.attrs.items() if v is not None}
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (span.start - self.origin) * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": pid,
+                    "tid": span.thread,
+                    "args": args,
+                }
+            )
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        """Write the finished spans to a Chrome trace file, see :meth:`to_chrome_trace`.
+
+        :param path: The file to write
+        :type path: str
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summary(self, category: str = OPERATION) -> Dict[str, dict]:
+        """Summarize the durations of the finished spans of a category by name.
+
+        For operations, the time spent waiting for command replies and the number of reply polls
+        are included, so that time spent moving or polling can be told apart from time spent in
+        the host code.
+
+        :param category: :data:`OPERATION` to summarize operations, :data:`GCODE` to summarize
+            commands by their G/M code, defaults to :data:`OPERATION`
+        :type category: str, optional
+        :return: A dictionary mapping each span name to its count, total, mean, min, median,
+            95th percentile and max duration in seconds, and a histogram of the durations
+        :rtype: Dict[str, dict]
+        """
+        durations = collections.defaultdict(list)
+        totals = collections.defaultdict(collections.Counter)
+        for span in self._finished(category):
+            durations[span.name].append(span.duration)
+            for key in ("commands", "command_time", "polls", "retries"):
+                if key in span.attrs:
+                    totals[span.name][key] += span.attrs[key]
+
+        summary = {}
+        for name, values in durations.items():
+            values.sort()
+            histogram = {_bucket_label(edge): 0 for edge in HISTOGRAM_EDGES}
+            histogram[f">={HISTOGRAM_EDGES[-1]:g}s"] = 0
+            labels = list(histogram)
+            for value in values:
+                i = next(
+                    (i for i, edge in enumerate(HISTOGRAM_EDGES) if value < edge),
+                    len(HISTOGRAM_EDGES),
+                )
+                histogram[labels[i]] += 1
+            summary[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "min": values[0],
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "max": values[-1],
+                **totals[name],
+                "histogram": histogram,
+            }
+        return summary
+
+
+def _percentile(values: List[float], percent: float):
+    """Return the nearest-rank percentile of sorted values."""
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def _tracer_of(obj):
+    """Return the tracer of a machine, or of the machine a tool is loaded on."""
+    tracer = getattr(obj, "tracer", None)
+    if tracer is None:
+        tracer = getattr(getattr(obj, "_machine", None), "tracer", None)
+    return tracer
+
+
+def traced(func):
+    """Decorator recording each call of a :class:`Machine` or tool method as an operation span.
+
+    The span is named after the method, e.g. ``Pipette.transfer``. Nothing is recorded unless
+    the machine has a tracer.
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        tracer = _tracer_of(self)
+        if tracer is None:
+            return func(self, *args, **kwargs)
+        with tracer.span(name):
+            return func(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,624 @@
+"""Transport layer used by :class:`Machine` to exchange G-code with a Duet controller."""
+
+import json
+import logging
+import threading
+import time
+import zlib
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from science_jubilee.utils.MotionState import parse_command
+from science_jubilee.utils.Retry import QUERY, CircuitBreaker, RetryPolicy, idempotency
+
+logger = logging.getLogger(__name__)
+
+
+class PollSchedule:
+    """Delays between reply polls: starting at `first` and growing by `factor` up to `maximum` seconds."""
+
+    def __init__(self, first: float, factor: float, maximum: float):
+        self.first = first
+        self.factor = factor
+        self.maximum = maximum
+
+    def delays(self, first: float = None):
+        """Yield the delay before each successive poll.
+
+        :param first: Override for the first delay, e.g. the length of a dwell, defaults to None
+        :type first: float, optional
+        """
+        delay = self.first if first is None else first
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+
+# How often to poll for the reply, by the expected duration of the command.
+POLL_SCHEDULES = {
+    # Settings, queries and queued moves are answered within milliseconds
+    "instant": PollSchedule(0.002, 1.5, 0.05),
+    # Commands that wait for queued motion to finish
+    "wait": PollSchedule(0.01, 1.5, 0.25),
+    # Homing, probing, macros and tool changes take seconds
+    "long": PollSchedule(0.1, 1.5, 1.0),
+}
+WAIT_COMMANDS = {"G4", "M400"}
+LONG_COMMANDS = {"G28", "G29", "G30", "G32", "M32", "M98", "M999"}
+
+
+def command_class(cmd: str):
+    """Classify a (possibly multi-line) command by how long it is expected to take to reply.
+
+    :param cmd: The G-Code command
+    :type cmd: str
+    :return: One of the keys of :data:`POLL_SCHEDULES`, and the dwell time in seconds if known
+    :rtype: Tuple[str, float]
+    """
+    ranks = ["instant", "wait", "long"]
+    cls, dwell = "instant", None
+    for line in cmd.split("\n"):
+        code, params = parse_command(line)
+        if code is None:
+            continue
+        if code in LONG_COMMANDS or (code.startswith("T") and code != "T"):
+            line_cls = "long"
+        elif code in WAIT_COMMANDS:
+            line_cls = "wait"
+            if code == "G4":
+                try:
+                    seconds = (
+                        float(params.get("S", 0)) + float(params.get("P", 0)) / 1000
+                    )
+                    dwell = (dwell or 0) + seconds
+                except ValueError:
+                    pass
+        else:
+            line_cls = "instant"
+        if ranks.index(line_cls) > ranks.index(cls):
+            cls = line_cls
+    return cls, dwell
+
+
+class GCodeBuffer:
+    """The free space in the `rr_gcode` input buffer of a standalone controller.
+
+    The firmware drops code that does not fit in its input buffer, so a block of code is handed
+    over in pieces that fit the free space (`buff`) reported in reply to the previous `rr_gcode`.
+    The transports send what :meth:`pieces` yields and pass each reply to :meth:`update`.
+
+    :param size: The size of the buffer in bytes, until the controller reports more, defaults to 255
+    :type size: int, optional
+    """
+
+    def __init__(self, size: int = 255):
+        self.size = size
+        self.space = size
+
+    def pieces(self, cmd: str, wait: float = 60):
+        """Split a block of code into the `rr_gcode` requests that hand it over.
+
+        When there is no room for the next line, the free space is polled with an empty `rr_gcode`
+        after a short delay. A line longer than the whole buffer is sent on its own into an empty
+        buffer.
+
+        :param cmd: The block of code, one command per line
+        :type cmd: str
+        :param wait: The longest time to wait for room in the buffer, in seconds, defaults to 60
+        :type wait: float, optional
+        :raises requests.Timeout: If there is still no room for the next line after `wait` seconds
+        :return: Pairs of the delay to wait, in seconds, and the code to send next
+        :rtype: Iterator[Tuple[float, str]]
+        """
+        deadline = time.time() + wait
+        lines = cmd.split("\n")
+        i = 0
+        delays = None
+        while i < len(lines):
+            piece = []
+            length = 0
+            while i < len(lines):
+                n = len(lines[i].encode()) + 1
+                fits = length + n <= self.space or (
+                    not piece and self.space >= self.size
+                )
+                if not fits:
+                    break
+                piece.append(lines[i])
+                length += n
+                i += 1
+            if piece:
+                yield 0, "\n".join(piece)
+                delays = None
+                continue
+            if time.time() > deadline:
+                raise requests.Timeout(f"No room in the G-code buffer after {wait} s")
+            delays = delays or POLL_SCHEDULES["instant"].delays()
+            yield next(delays), ""
+
+    def update(self, response):
+        """Record the free space reported in reply to an `rr_gcode` request.
+
+        :param response: The response to the request, with a `json()` method
+        """
+        try:
+            space = int(response.json()["buff"])
+        except (ValueError, KeyError, TypeError):
+            # Not reported, e.g. by older firmware: assume the code went through
+            space = self.size
+        self.size = max(self.size, space)
+        self.space = space
+
+
+class HTTPTransport:
+    """A persistent, pooled HTTP connection to a single Duet controller.
+
+    The same keep-alive session is used for the DSF (``/machine/code``) and the
+    standalone (``rr_gcode``/``rr_model``/``rr_reply``) endpoints, so consecutive
+    commands and reply polls reuse one TCP connection instead of opening a new one
+    per request.
+
+    Failed requests are retried by `retry_policy`. Queries are retried on any transient error;
+    commands only when the request never reached the controller, so they never run twice.
+
+    :param address: The IP address (optionally with port) of the controller
+    :type address: str
+    :param pool_maxsize: The maximum number of connections kept open to the controller, defaults to 2
+    :type pool_maxsize: int, optional
+    :param keep_alive: Whether to keep connections open between requests, defaults to True
+    :type keep_alive: bool, optional
+    :param retry_policy: How failed requests are retried, defaults to None (a :class:`RetryPolicy`
+        with its own :class:`CircuitBreaker`)
+    :type retry_policy: :class:`RetryPolicy`, optional
+    """
+
+    DSF = "dsf"
+    STANDALONE = "standalone"
+    GCODE_BUFFER = 255  # Bytes of code a standalone controller takes per `rr_gcode`, until it reports more
+
+    def __init__(
+        self,
+        address: str,
+        pool_maxsize: int = 2,
+        keep_alive: bool = True,
+        retry_policy: RetryPolicy = None,
+    ):
+        self.address = address
+        self.base_url = f"http://{address}"
+        # Which API the controller speaks. Detected on the first successful command so
+        # that standalone boards do not pay for a failed POST on every command.
+        self.mode = None
+
+        session = requests.Session()
+        # Retries are left to the policy, which knows which requests are safe to send twice
+        self.retry_policy = retry_policy or RetryPolicy(breaker=CircuitBreaker())
+        # A single pool per controller, holding at most `pool_maxsize` sockets.
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        session.mount("http://", self._adapter)
+        # Counters carried over from pools discarded by `close()`.
+        self._closed_requests = 0
+        self._closed_connections = 0
+        # Reply polls made per command class, and by the most recent command
+        self._poll_counts = {cls: [0, 0] for cls in POLL_SCHEDULES}
+        self.last_polls = 0
+        # Transient errors retried by the most recent command, per thread so that the
+        # object model subscription does not count towards the commands
+        self._local = threading.local()
+        # Size and free space of the `rr_gcode` input buffer, as last reported by the controller
+        self._gcode_buffer = GCodeBuffer(self.GCODE_BUFFER)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        self.session = session
+
+    def get(self, endpoint: str, timeout: float = None, idempotent=True, **kwargs):
+        """Issue a GET request to the controller over the shared session.
+
+        :param endpoint: The endpoint to query, e.g. ``rr_model?key=seqs``
+        :type endpoint: str
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :param idempotent: Whether the request can be retried after it reached the controller, defaults to True
+        :type idempotent: bool, optional
+        :return: The HTTP response
+        :rtype: :class:`requests.Response`
+        """
+        response = self._request("GET", endpoint, idempotent, timeout=timeout, **kwargs)
+        logger.debug(
+            f"GET {endpoint}, status: {response.status_code}, content:{response.content}"
+        )
+        return response
+
+    def post(
+        self,
+        endpoint: str,
+        data=None,
+        timeout: float = None,
+        idempotent=False,
+        **kwargs,
+    ):
+        """Issue a POST request to the controller over the shared session.
+
+        :param endpoint: The endpoint to post to, e.g. ``machine/code``
+        :type endpoint: str
+        :param data: The request body, defaults to None
+        :type data: str, optional
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :param idempotent: Whether the request can be retried after it reached the controller, defaults to False
+        :type idempotent: bool, optional
+        :return: The HTTP response
+        :rtype: :class:`requests.Response`
+        """
+        response = self._request(
+            "POST", endpoint, idempotent, data=data, timeout=timeout, **kwargs
+        )
+        logger.debug(
+            f"POST {endpoint}, status: {response.status_code}, content:{response.content}"
+        )
+        return response
+
+    @property
+    def last_retries(self):
+        """The requests retried while sending the most recent command on this thread."""
+        return getattr(self._local, "retries", 0)
+
+    @last_retries.setter
+    def last_retries(self, value: int):
+        self._local.retries = value
+
+    def _request(self, method: str, endpoint: str, idempotent: bool, **kwargs):
+        """Make a request under :attr:`retry_policy`, counting its retries in :attr:`last_retries`."""
+        try:
+            return self.retry_policy.request(
+                self.session,
+                method,
+                f"{self.base_url}/{endpoint}",
+                idempotent=idempotent,
+                **kwargs,
+            )
+        finally:
+            self.last_retries += self.retry_policy.last_retries
+
+    def send_code(
+        self,
+        cmd: str,
+        timeout: float = None,
+        response_wait: float = 60,
+        until: str = None,
+    ):
+        """Send a G-Code command and return the controller's reply.
+
+        On the first call both APIs are tried in turn (DSF first); afterwards only the
+        API the controller answered on is used. `cmd` may hold several newline-separated
+        commands, which are sent in a single request.
+
+        :param cmd: The G-Code command to send
+        :type cmd: str
+        :param timeout: The time to wait for the HTTP request to complete, defaults to None
+        :type timeout: float, optional
+        :param response_wait: The time to wait for a reply in standalone mode, defaults to 60
+        :type response_wait: float, optional
+        :param until: In standalone mode, keep collecting replies until this text shows up and
+            return everything collected instead of only the last reply line, defaults to None
+        :type until: str, optional
+        :return: The reply from the controller, or None if no reply was received
+        :rtype: str
+        """
+        self.last_polls = 0
+        self.last_retries = 0
+        if self.mode == self.DSF:
+            return self._send_dsf(cmd, timeout=timeout)
+        if self.mode == self.STANDALONE:
+            return self._send_standalone(
+                cmd, timeout=timeout, response_wait=response_wait, until=until
+            )
+
+        try:
+            # Try sending the command with a POST to the DSF code endpoint
+            response = self.post(
+                "machine/code",
+                data=f"{cmd}",
+                timeout=timeout,
+                idempotent=idempotency(cmd) == QUERY,
+            )
+            if not response.ok or "rejected" in response.text:
+                raise requests.RequestException
+            self.mode = self.DSF
+            return response.text
+        except requests.RequestException:
+            # If the POST fails (not supported in standalone mode), fall back to rr_gcode
+            response = self._send_standalone(
+                cmd, timeout=timeout, response_wait=response_wait, until=until
+            )
+            if response is not None:
+                self.mode = self.STANDALONE
+            return response
+
+    def send_code_nowait(self, cmd: str, timeout: float = None):
+        """Hand a command to the controller without waiting for its reply, e.g. an emergency stop.
+
+        Safe to call while another thread waits for the reply to its own command: on standalone
+        controllers the reply is not polled for, so it cannot be taken from that thread.
+
+        :param cmd: The G-Code command to send
+        :type cmd: str
+        :param timeout: The time to wait for the HTTP request to complete, defaults to None
+        :type timeout: float, optional
+        """
+        if self.mode == self.STANDALONE:
+            # Urgent codes such as M112 are acted on as they arrive, so the buffer is not waited on
+            self._rr_gcode(cmd, timeout)
+        elif self.mode == self.DSF:
+            # DSF runs each request on its own channel; its reply is not shared with other requests
+            self._send_dsf(cmd, timeout=timeout)
+        else:
+            self.send_code(cmd, timeout=timeout)
+
+    def _send_dsf(self, cmd: str, timeout: float = None):
+        """Send a command to a controller running DSF.
+
+        The request is held open until the code completes, so there is nothing to poll.
+        """
+        try:
+            return self.post(
+                "machine/code",
+                data=f"{cmd}",
+                timeout=timeout,
+                idempotent=idempotency(cmd) == QUERY,
+            ).text
+        except requests.RequestException as e:
+            print(f"`machine/code` request failed: {e}")
+            return None
+
+    def _send_standalone(
+        self, cmd: str, timeout: float = None, response_wait: float = 60, until=None
+    ):
+        """Send a command to a standalone controller and wait for its reply.
+
+        The firmware bumps `seqs.reply` in the object model when a reply is ready, so that is
+        polled on a schedule matched to the kind of command: every few milliseconds at first for
+        settings and queries, more slowly for motion waits, homing and tool changes.
+        """
+        # Paraphrased from Duet HTTP-requests page:
+        # Client should query `rr_model?key=seqs` and monitor `seqs.reply`. If incremented, the command went through
+        # and the response is available at `rr_reply`.
+        try:
+            reply_count = self._reply_seq(timeout)
+            self._queue_code(cmd, timeout=timeout, wait=response_wait)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Both `requests.post` and `requests.get` requests failed: {e}")
+            return None
+
+        cls, dwell = command_class(cmd)
+        tic = time.time()
+        polls = 0
+        collected = ""
+        try:
+            for delay in POLL_SCHEDULES[cls].delays(first=dwell):
+                time.sleep(delay)
+                polls += 1
+                try:
+                    new_reply_count = self._reply_seq(timeout)
+                    if new_reply_count != reply_count:
+                        # Reading the reply clears it, so a read that failed is not repeated
+                        response = self.get(
+                            "rr_reply", timeout=timeout, idempotent=False
+                        ).text
+                        if until is not None:
+                            # A multi-command block may produce several replies; keep
+                            # reading until the expected marker has been seen.
+                            collected += response + "\n"
+                            reply_count = new_reply_count
+                            if until in collected:
+                                return collected
+                            continue
+                        responses = split_response_objects(response)
+                        if len(responses) > 0:
+                            return responses[-1]
+                        return None
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    # Errors left over by the retry policy are retried on the poll schedule
+                    logger.debug(f"Error in gcode reply wait loop: {e}")
+                    self.last_retries += 1
+                if time.time() - tic > response_wait:
+                    return collected or None
+        finally:
+            self.last_polls = polls
+            self._poll_counts[cls][0] += 1
+            self._poll_counts[cls][1] += polls
+
+    def _queue_code(self, cmd: str, timeout: float = None, wait: float = 60):
+        """Hand a block of code to a standalone controller with `rr_gcode`.
+
+        The lines of the block are sent in pieces that fit the free space left in the controller's
+        input buffer (`buff`), as reported in reply to the previous `rr_gcode`. When there is no
+        room for the next line, the free space is polled with an empty `rr_gcode`, see
+        :meth:`GCodeBuffer.pieces`.
+        """
+        for delay, code in self._gcode_buffer.pieces(cmd, wait):
+            if delay:
+                time.sleep(delay)
+            self._rr_gcode(code, timeout)
+
+    def _rr_gcode(self, code: str, timeout: float = None):
+        """Send code with `rr_gcode` and keep track of the free space left in the input buffer."""
+        # Polling the free space is a query, sending code is not
+        response = self.get(
+            "rr_gcode", params={"gcode": code}, timeout=timeout, idempotent=not code
+        )
+        self._gcode_buffer.update(response)
+
+    def _reply_seq(self, timeout: float = None):
+        """Return the reply sequence number of a standalone controller."""
+        return self.get("rr_model?key=seqs", timeout=timeout).json()["result"]["reply"]
+
+    @property
+    def poll_stats(self):
+        """Reply polling statistics, by command class.
+
+        DSF controllers hold the request open until the code completes, so commands sent to
+        them never poll.
+
+        :return: A dictionary mapping each command class to the number of commands sent, the
+            number of reply polls they made and the polls per command.
+        :rtype: dict
+        """
+        return {
+            cls: {
+                "commands": commands,
+                "polls": polls,
+                "polls_per_command": polls / commands if commands else 0.0,
+            }
+            for cls, (commands, polls) in self._poll_counts.items()
+        }
+
+    def get_model(self, key: str = "", flags: str = "d99v", timeout: float = None):
+        """Read (part of) the controller's object model in a single request.
+
+        DSF controllers are queried with ``M409``, standalone controllers with ``rr_model``.
+
+        :param key: The object model key to read, e.g. ``tools``; an empty key reads the whole model, defaults to ""
+        :type key: str, optional
+        :param flags: The ``M409`` flags, defaults to "d99v" (verbose, full depth)
+        :type flags: str, optional
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :return: The value of the key in the object model
+        :rtype: Union[dict, list]
+        """
+        if self.mode != self.STANDALONE:
+            try:
+                response = self.post(
+                    "machine/code",
+                    data=f'M409 K"{key}" F"{flags}"',
+                    timeout=timeout,
+                    idempotent=True,
+                )
+                if not response.ok or "rejected" in response.text:
+                    raise requests.RequestException
+                self.mode = self.DSF
+                return json.loads(response.text)["result"]
+            except requests.RequestException:
+                if self.mode == self.DSF:
+                    raise
+        response = self.get(f"rr_model?key={key}&flags={flags}", timeout=timeout)
+        self.mode = self.STANDALONE
+        return response.json()["result"]
+
+    def delay_time(self, n):
+        """Return the delay before retry `n` of a request, see :meth:`RetryPolicy.delay`."""
+        return self.retry_policy.delay(n)
+
+    def download(self, filepath: str, timeout: float = None):
+        """Download a file from the controller's SD card.
+
+        :param filepath: The full filepath of the file to download, e.g. ``/sys/tfree0.g``
+        :type filepath: str
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :return: The HTTP response holding the file contents
+        :rtype: :class:`requests.Response`
+        """
+        return self.get(f"rr_download?name={filepath}", timeout=timeout)
+
+    def upload(self, filepath: str, contents, timeout: float = None):
+        """Upload a file to the controller's SD card, e.g. a G-Code job to run with ``M32``.
+
+        DSF controllers take the file with ``PUT /machine/file``, standalone controllers with
+        ``rr_upload``, which also checks the CRC-32 of what it received.
+
+        :param filepath: The full filepath to write, e.g. ``0:/gcodes/job.g``
+        :type filepath: str
+        :param contents: The file contents
+        :type contents: Union[str, bytes]
+        :param timeout: The time to wait for a response, defaults to None
+        :type timeout: float, optional
+        :raises requests.RequestException: If the controller did not accept the file
+        """
+        if isinstance(contents, str):
+            contents = contents.encode()
+        if self.mode != self.STANDALONE:
+            try:
+                response = self._request(
+                    "PUT",
+                    f"machine/file/{quote(filepath)}",
+                    True,
+                    data=contents,
+                    timeout=timeout,
+                )
+                logger.debug(
+                    f"PUT machine/file/{filepath}, status: {response.status_code}"
+                )
+                if response.ok:
+                    self.mode = self.DSF
+                    return
+                raise requests.RequestException(
+                    f"Upload of {filepath} failed with status {response.status_code}"
+                )
+            except requests.RequestException:
+                if self.mode == self.DSF:
+                    raise
+        crc = format(zlib.crc32(contents) & 0xFFFFFFFF, "08x")
+        # Writing the same file again is harmless
+        response = self.post(
+            f"rr_upload?name={quote(filepath)}&crc32={crc}",
+            data=contents,
+            timeout=timeout,
+            idempotent=True,
+        )
+        if not response.ok or response.json().get("err", 1) != 0:
+            raise requests.RequestException(
+                f"Upload of {filepath} failed: {response.text}"
+            )
+        self.mode = self.STANDALONE
+
+    @property
+    def stats(self):
+        """Connection-reuse statistics for this controller.
+
+        :return: A dictionary with the number of HTTP requests sent, the number of TCP
+            connections opened to serve them, how many requests reused an open connection
+            and the resulting reuse ratio.
+        :rtype: dict
+        """
+        requests_sent, connections = self._pool_counts()
+        requests_sent += self._closed_requests
+        connections += self._closed_connections
+        reused = max(requests_sent - connections, 0)
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": reused,
+            "reuse_ratio": reused / requests_sent if requests_sent else 0.0,
+        }
+
+    def _pool_counts(self):
+        """Sum the request and connection counters of the live connection pools."""
+        pools = self._adapter.poolmanager.pools
+        requests_sent = 0
+        connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return requests_sent, connections
+
+    def close(self):
+        """Close all pooled connections. The transport can still be used afterwards."""
+        requests_sent, connections = self._pool_counts()
+        self._closed_requests += requests_sent
+        self._closed_connections += connections
+        self.session.close()
+
+
+def split_response_objects(s):
+    """
+    Split text strings from gcode responses when multiple responses held in Duet buffer
+    """
+    # Split the string on newlines and filter out empty strings
+    matches = [line for line in s.split("\n") if line.strip()]
+    return matches
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from science_jubilee.AsyncMachine import AsyncMachine
+from science_jubilee.Machine import MachineStateError
+from science_jubilee.tools.Tool import Tool
+from science_jubilee.utils import AsyncTransport
+from science_jubilee.utils.DuetEmulator import DuetEmulator
+
+
+@pytest.fixture(params=["dsf", "standalone"])
+def duet(request):
+    with DuetEmulator(mode=request.param, time_scale=0) as emulator:
+        yield emulator
+
+
+@pytest.fixture(params=["aiohttp", "executor"])
+def http_backend(request, monkeypatch):
+    if request.param == "aiohttp":
+        pytest.importorskip("aiohttp")
+    else:
+        monkeypatch.setattr(AsyncTransport, "aiohttp", None)
+    return request.param
+
+
+def test_moves_overlap_with_other_io(duet, http_backend):
+    async def instrument():
+        await asyncio.sleep(0.01)
+        return "measured"
+
+    async def run():
+        async with AsyncMachine(
+            address=duet.address, deck_config="lab_automation_deck_AFL_bolton"
+        ) as m:
+            with pytest.raises(MachineStateError):
+                await m.move_to(x=10)
+            await m.home_all()
+            results = await asyncio.gather(
+                m.move_to(x=100, y=50, z=20), instrument(), m.move(dx=5, dz=-2)
+            )
+            assert results[1] == "measured"
+            assert (await m.get_position())["X"] == "105.000"
+            assert (await m.sync_position())["Z"] == "18.000"
+            assert await m.active_tool_index() == -1
+
+    asyncio.run(run())
+
+
+def test_tool_change(duet, http_backend):
+    async def run():
+        async with AsyncMachine(address=duet.address) as m:
+            await m.home_all()
+            await m.set_tool_offset(2, z=-10)
+            tool = Tool(2, "tool2")
+            await m.load_tool(tool)
+            assert tool.tool_offset == -10
+            await m.pickup_tool("tool2")
+            assert tool.is_active_tool
+            assert await m.active_tool_index() == 2
+            assert (await m.model("tools"))[2]["offsets"][2] == -10
+            await m.park_tool()
+            assert duet.interpreter.model["state"]["currentTool"] == -1
+
+    asyncio.run(run())
+
+
+def test_standalone_batch_fits_the_gcode_buffer(http_backend):
+    async def run(address):
+        async with AsyncMachine(address=address) as m:
+            await m.home_all()
+            # Far more code than the 255 bytes the input buffer holds
+            await m.gcode_many([f"G0 X{x} F6000" for x in range(1, 101)])
+            assert (await m.sync_position())["X"] == "100.000"
+
+    with DuetEmulator(mode="standalone", time_scale=0) as duet:
+        asyncio.run(run(duet.address))
+        assert duet.rejected_codes == 0
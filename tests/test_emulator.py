@@ -0,0 +1,362 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from science_jubilee.Machine import Machine
+from science_jubilee.tools.Pipette import Pipette
+from science_jubilee.utils.DuetEmulator import DuetEmulator
+from science_jubilee.utils.Tracing import GCODE, Tracer
+
+
+@pytest.fixture(params=["dsf", "standalone"])
+def duet(request):
+    with DuetEmulator(mode=request.param, time_scale=0) as emulator:
+        yield emulator
+
+
+@pytest.fixture
+def machine(duet):
+    m = Machine(address=duet.address, deck_config="lab_automation_deck_AFL_bolton")
+    m.home_all()
+    yield m
+    m.disconnect()
+
+
+def test_connect_reads_object_model(duet, machine):
+    assert machine.configured_axes == ["X", "Y", "Z", "U", "V"]
+    assert machine.configured_tools == {i: f"tool{i}" for i in range(4)}
+    assert machine.active_tool_index == -1
+    assert machine.axes_homed == [True, True, True, True]
+
+
+def test_moves_track_controller_position(duet, machine):
+    machine.move_to(x=100, y=50, z=20)
+    machine.move(dx=5, dz=-2)
+    assert machine.get_position()["X"] == "105.000"
+    assert machine.sync_position()["X"] == "105.000"
+    assert machine.position == [105.0, 50.0, 18.0]
+
+
+def test_tool_offsets(duet, machine):
+    machine.set_tool_offset(2, z=-10)
+    assert machine.tool_z_offsets[2] == -10
+
+
+def test_download_file(duet, machine):
+    duet.files["/sys/tfree0.g"] = "G0 X0\n"
+    assert machine.download_file("/sys/tfree0.g").text == "G0 X0\n"
+
+
+def test_pipette_transfer(duet, machine):
+    tiprack = machine.load_labware("opentrons_96_tiprack_300ul", 0)
+    plate = machine.load_labware("corning_96_wellplate_360ul_flat", 1)
+    trash = machine.load_labware("agilent_1_reservoir_290ml", 2)
+    pipette = Pipette.from_config(1, "P300", "P300_config.json")
+    machine.load_tool(pipette)
+    machine.pickup_tool(pipette)
+    pipette.add_tiprack(tiprack)
+    pipette.trash = trash[0]
+
+    pipette.transfer(50, plate["A1"], [plate["B1"], plate["B2"]])
+    pipette.transfer(50, plate["A1"], plate[0:3])
+
+    assert not pipette.has_tip
+    assert not tiprack[0].has_tip and not tiprack[1].has_tip
+    position = duet.interpreter.user_position
+    assert machine.sync_position()["X"] == f"{position('X'):.3f}"
+
+
+def test_subscription_serves_state_from_memory(duet, machine):
+    machine.start_subscription(interval=0.01)
+    assert machine.subscribed
+    # A tool change made outside of this Machine, e.g. from the web interface
+    duet.interpreter.execute_line("T2")
+    deadline = time.time() + 5
+    while machine.object_model.get("state")["currentTool"] != 2:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    fetches = []
+    fetch = machine.object_model._fetch
+    machine.object_model._fetch = lambda key: fetches.append(key) or fetch(key)
+    assert machine.active_tool_index == 2
+    machine.axes_homed = [False] * 4
+    machine.move_to(x=10)
+    assert all(machine.axes_homed)
+    assert fetches == []
+
+    machine.stop_subscription()
+    assert not machine.subscribed
+
+
+def test_subscription_reads_changed_sections_in_full(duet, machine):
+    assert duet.interpreter.lookup("", "d99fn")["move"]["axes"][0] == {
+        "machinePosition": 0.0,
+        "userPosition": 0.0,
+    }
+    duet.interpreter.execute_line("M999")
+    machine.object_model.refresh()
+    machine.start_subscription(interval=0.01)
+    # Homing and tool offsets are left out of the partial poll
+    machine.gcode("G28")
+    machine.gcode("G10 P1 Z-7")
+    updates = machine.subscription.updates
+    deadline = time.time() + 5
+    while machine.subscription.updates < updates + 2:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    assert all(axis["homed"] for axis in machine.object_model.get("move")["axes"])
+    assert machine.tool_z_offsets[1] == -7
+    machine.stop_subscription()
+
+
+def test_discarded_batch_leaves_tracked_state(duet, machine):
+    machine.move_to(x=10)
+    with pytest.raises(RuntimeError):
+        with machine.batch():
+            machine.gcode("G91")
+            machine.gcode("G0 X50")
+            raise RuntimeError("the batch is discarded")
+    assert machine.motion_state.absolute_positioning
+    assert machine.get_position()["X"] == "10.000"
+    assert duet.interpreter.machine_position["X"] == 10
+
+
+def test_current_well(duet, machine):
+    plate = machine.load_labware("corning_96_wellplate_360ul_flat", 1)
+    machine.move_to(x=plate["B2"].x, y=plate["B2"].y)
+    codes = len(duet.interpreter.codes)
+    # Unknown after homing, and not read back from the machine
+    assert machine.current_well is None
+    assert len(duet.interpreter.codes) == codes
+    machine.get_position()
+    assert machine.current_well.name == "B2"
+    assert len(duet.interpreter.codes) == codes + 1
+    # A well assigned by hand takes priority until the machine moves in X or Y
+    machine.current_well = plate["A1"]
+    machine.move(dz=1)
+    assert machine.current_well.name == "A1"
+    machine.move_to(x=plate["C3"].x, y=plate["C3"].y)
+    assert machine.current_well.name == "C3"
+
+
+def test_record_and_run_job(duet, machine):
+    with machine.record() as job:
+        requests_sent = duet.request_count
+        for x in (10, 20, 30):
+            machine.move_to(x=x, y=x)
+        machine.move(dz=5)
+    # Nothing is sent while recording
+    assert duet.request_count == requests_sent
+    progress = []
+    machine.run_job(job, poll_interval=0.01, on_progress=progress.append)
+
+    assert "/gcodes/science_jubilee_job.g" in duet.files
+    assert progress[-1] == 1.0
+    assert machine.get_position()["X"] == "30.000"
+    assert machine.position == [30.0, 30.0, 5.0]
+
+
+def test_deferred_sync_waits_only_before_measuring(duet, machine, monkeypatch):
+    executed = []
+    execute_line = duet.interpreter.execute_line
+    monkeypatch.setattr(
+        duet.interpreter,
+        "execute_line",
+        lambda line: executed.append(line.strip()) or execute_line(line),
+    )
+
+    with machine.deferred_sync():
+        for x in (10, 20, 30):
+            machine.move_to(x=x, y=x)
+        assert "M400" not in executed
+        machine.sync()  # e.g. before reading a sensor
+        assert executed.count("M400") == 1
+        machine.sync()
+        assert executed.count("M400") == 1
+        machine.move(dz=5)
+    # All moves have finished once the block exits
+    assert executed.count("M400") == 2
+    assert machine.sync_position()["Z"] == "5.000"
+    machine.move_to(x=0)
+    assert executed.count("M400") == 3
+
+
+def test_tracing_attributes_commands_to_operations(duet, machine, tmp_path):
+    tiprack = machine.load_labware("opentrons_96_tiprack_300ul", 0)
+    plate = machine.load_labware("corning_96_wellplate_360ul_flat", 1)
+    pipette = Pipette.from_config(1, "P300", "P300_config.json")
+    machine.load_tool(pipette)
+    machine.tracer = Tracer()
+    machine.pickup_tool(pipette)
+    pipette.add_tiprack(tiprack)
+    pipette.trash = plate["H12"]
+
+    pipette.transfer(50, plate["A1"], plate["B1"])
+
+    commands = [s for s in machine.tracer.spans if s.category == GCODE]
+    assert {s.attrs["path"] for s in commands} == {duet.mode}
+    assert all(s.operation is not None for s in commands)
+    summary = machine.tracer.summary()
+    assert summary["Machine.pickup_tool"]["count"] == 1
+    transfer = summary["Pipette.transfer"]
+    # Nested operations count towards the transfer as well
+    assert summary["Pipette.pickup_tip"]["commands"] < transfer["commands"]
+    assert transfer["command_time"] <= transfer["total"]
+    assert sum(transfer["histogram"].values()) == 1
+    if duet.mode == "standalone":
+        assert transfer["polls"] > 0
+
+    trace = tmp_path / "trace.json"
+    machine.tracer.export_chrome_trace(trace)
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert len(events) == len(machine.tracer.spans)
+    assert {e["ph"] for e in events} == {"X"}
+
+
+def test_stream_path(duet, machine):
+    machine.gcode("T0")
+    t = np.linspace(0, 4 * np.pi, 2000)
+    points = np.c_[
+        150 + 50 * np.cos(t), 150 + 50 * np.sin(t), np.linspace(1, 5, len(t))
+    ]
+    start = machine.get_position()
+    requests_sent = duet.request_count
+
+    machine.stream_path(points, s=3000, e_per_mm=0.01, chunk_size=500)
+
+    if duet.mode == "dsf":
+        # 2000 moves plus the G90/M83 before and the M82/M400 after them
+        assert duet.request_count - requests_sent == 5
+    assert duet.rejected_codes == 0
+    assert machine.sync_position()["X"] == "200.000"
+    assert machine.position == [200.0, 150.0, 5.0]
+    start = np.array([float(start[axis]) for axis in "XYZ"])
+    length = np.linalg.norm(np.diff(points, axis=0, prepend=[start]), axis=1).sum()
+    extruded = duet.interpreter.model["move"]["extruders"][0]["position"]
+    assert extruded == pytest.approx(0.01 * length, abs=1e-4)
+
+
+def test_crash_monitor_holds_motion_until_handled(duet):
+    handled = threading.Event()
+    cleared = threading.Event()
+
+    def handler(message):
+        # Commands sent by the handler are not held
+        m.gcode("M292")
+        m.home_all()  # after the halt
+        handled.set()
+        cleared.wait(5)
+
+    m = Machine(
+        address=duet.address,
+        deck_config="lab_automation_deck_AFL_bolton",
+        crash_detection=True,
+        crash_handler=handler,
+    )
+    m.subscription.interval = 0.01
+    m.home_all()
+    # Reported by the crash detection trigger macro, outside of any command sent here
+    duet.interpreter.execute_line('M291 P"crash detected" S1')
+    assert handled.wait(5)
+    assert m.crash_monitor.crashed
+
+    move = threading.Thread(target=m.move_to, kwargs={"x": 10})
+    move.start()
+    move.join(0.2)
+    assert move.is_alive()
+    assert duet.interpreter.machine_position["X"] == 0
+    cleared.set()
+    move.join(5)
+    assert not move.is_alive() and not m.crash_monitor.crashed
+    assert duet.interpreter.model["state"]["messageBox"] is None
+    assert m.sync_position()["X"] == "10.000"
+    m.disconnect()
+
+
+def wait_until_handled(m):
+    deadline = time.time() + 5
+    while not m.crash_monitor.crashes or m.crash_monitor.crashed:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("stop", ["halt", "pause"])
+def test_crash_monitor_halts_queued_moves(duet, stop):
+    m = Machine(
+        address=duet.address,
+        deck_config="lab_automation_deck_AFL_bolton",
+        crash_detection=True,
+        crash_handler=lambda message: None,
+        crash_stop=stop,
+    )
+    m.subscription.interval = 0.01
+    m.home_all()
+    # Motion sent by the protocol, still queued on the controller when the crash is reported
+    duet.interpreter.time_scale = 1
+    m.gcode("G0 X100 F6000")
+    duet.interpreter.execute_line('M291 P"crash detected" S1')
+    wait_until_handled(m)
+
+    # Without a job to pause, a pause falls back to a halt
+    codes = duet.interpreter.codes
+    assert "M25" not in codes
+    assert codes.index("M112") < codes.index("M999")
+    assert not any(m.axes_homed)
+    assert not any(axis["homed"] for axis in duet.interpreter.axes)
+    m.disconnect()
+
+
+def test_crash_monitor_pauses_a_job(duet):
+    statuses = []
+
+    def handler(message):
+        # The pause is sent without waiting for the controller to act on it
+        deadline = time.time() + 5
+        while duet.interpreter.model["state"]["status"] == "processing":
+            assert time.time() < deadline
+            time.sleep(0.01)
+        statuses.append(duet.interpreter.model["state"]["status"])
+
+    m = Machine(
+        address=duet.address,
+        deck_config="lab_automation_deck_AFL_bolton",
+        crash_detection=True,
+        crash_handler=handler,
+        crash_stop="pause",
+    )
+    m.subscription.interval = 0.01
+    m.home_all()
+    duet.interpreter.time_scale = 1
+    duet.files["/gcodes/job.g"] = "G4 P20\n" * 200
+    m.gcode('M32 "0:/gcodes/job.g"')
+    updates = m.subscription.updates
+    while m.subscription.updates < updates + 2:
+        time.sleep(0.01)
+    duet.interpreter.execute_line('M291 P"crash detected" S1')
+    wait_until_handled(m)
+
+    codes = duet.interpreter.codes
+    assert statuses == ["paused"]
+    assert codes.index("M25") < codes.index("M24")
+    assert "M112" not in codes
+    duet.interpreter.execute_line("M112")
+    m.disconnect()
+
+
+def test_crash_monitor_reads_command_replies(duet):
+    m = Machine(
+        address=duet.address,
+        deck_config="lab_automation_deck_AFL_bolton",
+        crash_detection=True,
+    )
+    m.home_all()
+    # A trigger macro reporting with echo, as seen in the reply to the next command
+    m.gcode('echo "crash detected"')
+    assert m.crash_monitor.crashed
+    m.crash_monitor.resume()
+    m.disconnect()
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from science_jubilee.Fleet import Fleet, FleetError
+from science_jubilee.Machine import Machine
+from science_jubilee.utils.DuetEmulator import DuetEmulator
+
+
+@pytest.fixture
+def fleet():
+    emulators = [DuetEmulator(time_scale=0) for _ in range(3)]
+    for emulator in emulators:
+        emulator.start()
+    fleet = Fleet.connect(
+        {f"jubilee-{i}": {"address": e.address} for i, e in enumerate(emulators)}
+    )
+    yield fleet
+    fleet.disconnect()
+    for emulator in emulators:
+        emulator.stop()
+
+
+def test_failed_connect_disconnects_the_other_machines(monkeypatch):
+    disconnected = []
+    disconnect = Machine.disconnect
+
+    def record(machine):
+        disconnected.append(machine)
+        disconnect(machine)
+
+    monkeypatch.setattr(Machine, "disconnect", record)
+    with DuetEmulator(time_scale=0) as duet:
+        with pytest.raises(TypeError):
+            Fleet.connect(
+                {
+                    "jubilee-0": {"address": duet.address},
+                    "jubilee-1": {"no_such_option": 1},
+                }
+            )
+    assert len(disconnected) == 1
+
+
+def test_protocols_run_concurrently(fleet):
+    loader = fleet.share(object(), "loader")
+    turns = []
+
+    def protocol(m, x):
+        m.home_all()
+        m.move_to(x=x, y=50)
+        with loader.use(m):
+            turns.append(fleet.name_of(m))
+            time.sleep(0.2)
+        return m.get_position()["X"]
+
+    tic = time.perf_counter()
+    results = fleet.run(protocol, x=10, per_machine={"jubilee-2": {"x": 30}})
+    elapsed = time.perf_counter() - tic
+
+    assert results == {
+        "jubilee-0": "10.000",
+        "jubilee-1": "10.000",
+        "jubilee-2": "30.000",
+    }
+    assert sorted(turns) == sorted(fleet)
+    assert elapsed >= 0.6  # the loader is used by one machine at a time
+    telemetry = fleet.telemetry()
+    for name in fleet:
+        assert telemetry["machines"][name]["state"] == "done"
+        assert telemetry["machines"][name]["commands"] > 0
+    stats = telemetry["resources"]["loader"]
+    assert stats["uses"] == {name: 1 for name in fleet}
+    assert stats["max_wait"] >= 0.3
+
+    def failing(m):
+        raise RuntimeError("clogged")
+
+    with pytest.raises(FleetError) as e:
+        fleet.run(failing, machines=["jubilee-1"])
+    assert list(e.value.errors) == ["jubilee-1"]
+    assert fleet.telemetry()["machines"]["jubilee-1"]["state"] == "failed"
+
+
+def test_shared_resource_is_first_come_first_served(fleet):
+    loader = fleet.share(object(), "loader")
+    order = []
+
+    def take_turn(name):
+        with loader.use(name):
+            order.append(name)
+
+    loader.acquire("first")
+    threads = []
+    for name in ["a", "b", "c", "d"]:
+        threads.append(threading.Thread(target=take_turn, args=(name,)))
+        threads[-1].start()
+        while loader.stats["waiting"] < len(threads):
+            time.sleep(0.001)
+    assert not loader.acquire("late", timeout=0.01)
+    loader.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b", "c", "d"]
+    assert loader.stats["waiting"] == 0
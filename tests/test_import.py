@@ -1,6 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that only some tools need, and that must not be imported with the core package
+HEAVY_MODULES = ["cv2", "matplotlib", "yaml", "serial", "aiohttp", "websocket"]
+# Cold start budget for the core package, in seconds: about 1.5x the ~230 ms it takes on a
+# laptop, so that a new eager import fails the test. Override on slow machines.
+IMPORT_BUDGET = float(os.environ.get("SCIENCE_JUBILEE_IMPORT_BUDGET", 0.35))
+
+
+def cold_import(statement):
+    """Run an import in a fresh interpreter and return its duration and the heavy modules it loaded."""
+    script = f"""
+import json, sys, time
+tic = time.perf_counter()
+{statement}
+toc = time.perf_counter()
+heavy = [m for m in {HEAVY_MODULES + ["numpy", "requests"]!r} if m in sys.modules]
+print(json.dumps({{"time": toc - tic, "heavy": heavy}}))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
 def test_import():
     import science_jubilee
 
+    assert science_jubilee.__version__
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import science_jubilee.Machine",
+        "from science_jubilee.tools import Pipette",
+        "from science_jubilee.tools.Camera import Camera",
+        "from science_jubilee.tools.WebCamera import Camera",
+        "from science_jubilee.tools.HTTPSyringe import HTTPSyringe",
+        "from science_jubilee.tools.AS7341 import AS7341",
+    ],
+)
+def test_import_does_not_load_heavy_dependencies(statement):
+    # numpy and requests are core dependencies, used by the machine and every tool
+    assert set(cold_import(statement)["heavy"]) <= {"numpy", "requests"}
+
+
+@pytest.mark.parametrize(
+    "statement", ["import science_jubilee", "from science_jubilee import tools"]
+)
+def test_package_import_loads_no_dependencies(statement):
+    assert cold_import(statement)["heavy"] == []
+
+
+def test_import_time_budget():
+    result = cold_import(
+        "import science_jubilee.Machine\nfrom science_jubilee.tools import Pipette"
+    )
+    assert result["time"] < IMPORT_BUDGET
+
+
+def test_tool_registry():
+    from science_jubilee import tools
+    from science_jubilee.tools.Pipette import Pipette
+
+    assert "Pipette" in tools.available_tools()
+    assert tools.get_tool("Pipette") is Pipette
+    assert tools.Loop.__name__ == "science_jubilee.tools.Loop"
+    with pytest.raises(KeyError):
+        tools.get_tool("Toaster")
+
 
 if __name__ == "__main__":
     test_import()
@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from science_jubilee.decks.Deck import Deck
+from science_jubilee.labware.Calibration import Calibration
+from science_jubilee.labware.Labware import Labware, Well
+from science_jubilee.utils.DefinitionCache import definitions
+
+
+@pytest.fixture
+def plate():
+    return Labware("corning_96_wellplate_360ul_flat")
+
+
+def test_wells_are_views_of_the_labware_geometry(plate):
+    a1 = plate["A1"]
+    x, y = a1.x, a1.y
+    plate.offset = (10, 20, 1)
+    assert (a1.x, a1.y) == pytest.approx((x + 10, y + 20))
+    assert a1.offset == (10, 20, 1)
+    a1.x = 0
+    assert plate.geometry.x[0] == 0
+    assert plate.geometry.points.shape == (96, 3)
+    assert plate["H12"].diameter == a1.diameter
+    well = Well(name="A1", depth=5, totalLiquidVolume=10, shape="rectangular", z=2)
+    assert well.top_ == 7 and well.diameter is None
+
+
+def test_manual_offset(plate):
+    plate.add_slot(0)
+    plate.manual_offset([(10, 80), (109, 80), (109, 17)])
+    assert (plate["A1"].x, plate["A1"].y) == pytest.approx((10, 80))
+    assert (plate["H12"].x, plate["H12"].y) == pytest.approx((109, 17))
+    assert np.diff(plate.geometry.x[:12]) == pytest.approx(np.full(11, 9))
+
+
+def test_calibrate_fits_an_affine_transform(plate, tmp_path):
+    plate.add_slot(1)
+    # A plate rotated by 1°, slightly stretched along x and tilted along x
+    theta = np.radians(1)
+    rotation = np.array(
+        [[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]]
+    )
+    points = plate.geometry.points
+
+    def deck(name):
+        x, y, z = points[plate.wells[name]._index]
+        return (*rotation @ [1.001 * x, y] + [30, 40], z + 0.01 * x + 1)
+
+    measured = {name: deck(name) for name in ["A1", "A12", "H12", "H1", "D6"]}
+    calibration = plate.calibrate(measured, save=False)
+    assert calibration.rms == pytest.approx(0, abs=1e-9)
+    assert calibration.rotation == pytest.approx(1)
+    assert calibration.scale[0] == pytest.approx(1.001)
+    well = plate["E9"]
+    assert (well.x, well.y, well.z) == pytest.approx(deck("E9"))
+
+    with pytest.raises(ValueError):
+        plate.calibrate({name: deck(name) for name in ["A1", "A6", "A12"]})
+    with pytest.raises(ValueError):
+        Calibration.fit([points[0], points[0]], [deck("A1")[:2], deck("A1")[:2]])
+
+    # Measurements are saved per slot, and can be loaded back
+    (tmp_path / "plate.json").write_text(json.dumps(plate.data))
+    saved = Labware("plate", path=tmp_path)
+    saved.add_slot(1)
+    saved.calibrate(measured, save=True)
+    loaded = Labware("plate", path=tmp_path)
+    loaded.add_slot(1)
+    loaded.load_calibration()
+    assert loaded["E9"].x == pytest.approx(well.x)
+
+
+def test_definitions_are_parsed_once(tmp_path):
+    (tmp_path / "plate.json").write_text(
+        json.dumps(Labware("fisherbrand_96_wellplate_360ul").data)
+    )
+    definitions.clear()
+    a = Labware("plate", path=tmp_path, offset=(10, 0))
+    b = Labware("plate", path=tmp_path)
+    assert definitions.misses == 1
+    assert a["A1"].x == b["A1"].x + 10
+    a.data["calibration"] = {}
+    assert "calibration" not in Labware("plate", path=tmp_path).data
+
+    cache_file = Labware.compile_definitions(tmp_path)
+    assert os.path.exists(cache_file)
+    definitions.clear()
+    assert Labware("plate", path=tmp_path)["A1"].x == b["A1"].x
+    assert definitions.misses == 0
+    # The well geometry was read back too, not compiled again
+    definitions.compiled(tmp_path / "plate.json", "geometry", pytest.fail)
+
+
+def test_indexing(plate):
+    assert plate[0] is plate["A1"] and plate[-1] is plate["H12"]
+    assert [w.name for w in plate[:3]] == ["A1", "A2", "A3"]
+    # One-dimensional selections are lists, as the tools expect
+    assert plate[0:2] + plate[2:4] == plate[:4] and type(plate[:, 0]) == list
+    assert [w.name for w in plate[[13, 0]]] == ["B2", "A1"]
+    assert [w.name for w in plate[np.array(["H1", "A2"])]] == ["H1", "A2"]
+    mask = np.array([w.x > 100 for w in plate])
+    assert len(plate[mask]) == 16
+    assert plate[1, 2] is plate["B3"]
+    assert [w.name for w in plate[:, 11]] == [f"{r}12" for r in "ABCDEFGH"]
+    assert plate[::2, ::3].shape == (4, 4)
+    assert plate.get_column(2)[-1] is plate["H2"]
+    assert len(plate) == 96 and list(plate)[12] is plate["B1"]
+
+
+def test_deck_finds_wells_by_position():
+    deck = Deck("lab_automation_deck_AFL_bolton")
+    tips = deck.load_labware("opentrons_96_tiprack_300ul", 0)
+    plate = deck.load_labware("corning_96_wellplate_360ul_flat", 1)
+    well = plate["C5"]
+    assert deck.well_at(well.x + 1, well.y - 1) is well
+    assert deck.well_at(well.x + 4.5, well.y) is None  # Between two wells
+    assert deck.nearest_well(well.x + 5, well.y) == (plate["C6"], pytest.approx(4))
+    assert deck.nearest_well(-100, -100)[0] is tips["H1"]
+    assert deck.wells_within(well.x, well.y, 9)[0] is well
+    assert len(deck.wells_within(well.x, well.y, 9)) == 5
+    # The index follows the wells when they move
+    plate.offset = (2, 0)
+    assert deck.well_at(well.x, well.y) is well
+    assert deck.well_at(well.x - 4, well.y) is None
+
+
+def test_labware_from_one_file_are_independent(tmp_path):
+    data = dict(Labware("fisherbrand_96_wellplate_360ul").data)
+    data["calibration"] = {"0": {"A1": [10, 80]}}
+    (tmp_path / "plate.json").write_text(json.dumps(data))
+    a = Labware("plate", path=tmp_path)
+    b = Labware("plate", path=tmp_path)
+    assert a.manualOffset is not b.manualOffset
+    a.add_slot(3)
+    a.manual_offset([(10, 80), (109, 80), (109, 17)], save=False)
+    a.calibrate({"A1": (12, 81)})
+    c = Labware("plate", path=tmp_path)
+    assert "3" not in b.manualOffset and "3" not in c.manualOffset
+    assert "3" not in c.calibrations and "3" not in c.data["calibration"]
@@ -0,0 +1,109 @@
+import asyncio
+import socket
+import time
+
+import pytest
+import requests
+
+from science_jubilee.Machine import Machine
+from science_jubilee.utils.DuetEmulator import DuetEmulator
+from science_jubilee.utils.Retry import (
+    COMMAND,
+    QUERY,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    idempotency,
+)
+
+
+@pytest.fixture
+def duet():
+    with DuetEmulator(time_scale=0) as emulator:
+        yield emulator
+
+
+@pytest.fixture
+def machine(duet):
+    m = Machine(address=duet.address)
+    m.home_all()
+    yield m
+    m.disconnect()
+
+
+def test_idempotency():
+    assert idempotency("M114") == QUERY
+    assert idempotency('M409 K"move" F"d99v"\necho "done"') == QUERY
+    assert idempotency("G0 X10") == COMMAND
+    assert idempotency("M114\nG91\nG0 X5") == COMMAND
+
+
+def test_queries_are_retried(duet, machine):
+    duet.fail_requests(2)
+    assert "Count" in machine.gcode("M114")
+    assert machine.transport.last_retries == 2
+
+
+def test_motion_is_never_sent_twice(duet, machine):
+    machine.move_to(x=10)
+    # The move arrives, but its reply is lost
+    duet.fail_requests(1, drop=True)
+    machine.gcode("G91\nG0 X5\nG90")
+    assert machine.transport.last_retries == 0
+    assert machine.sync_position()["X"] == "15.000"
+
+
+def test_circuit_breaker_stops_retrying_an_unreachable_device():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    policy = RetryPolicy(attempts=5, first=0.001, breaker=breaker)
+    url = f"http://127.0.0.1:{port}/rr_gcode"
+    # Refused connections never reached the device, so even a command is retried
+    with pytest.raises(requests.ConnectionError):
+        policy.request(requests, "GET", url, idempotent=False, timeout=1)
+    assert policy.retries == 2
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        policy.request(requests, "GET", url, timeout=1)
+    assert policy.retries == 2
+
+
+def test_circuit_breaker_settles_an_unexpected_trial():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.01)
+    policy = RetryPolicy(attempts=1, breaker=breaker, retry_on=(ConnectionError,))
+
+    def fail(error):
+        raise error
+
+    with pytest.raises(ConnectionError):
+        policy.call(lambda: fail(ConnectionError()))
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.02)
+    # The device answered the trial, if not as the caller hoped
+    with pytest.raises(ValueError):
+        policy.call(lambda: fail(ValueError()))
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert policy.call(lambda: "ok") == "ok"
+
+
+def test_machines_retry_independently(duet, machine):
+    other = Machine(address=duet.address)
+    machine.sync_position()
+    assert machine.query_retry.calls > 0
+    assert other.query_retry.calls == 0
+    other.disconnect()
+
+
+def test_async_retries_are_counted():
+    policy = RetryPolicy(attempts=5, first=0.001)
+    failures = [ConnectionError(), ConnectionError()]
+
+    async def request():
+        if failures:
+            raise failures.pop()
+        return "ok"
+
+    assert asyncio.run(policy.acall(request, retry_on=(ConnectionError,))) == "ok"
+    assert policy.last_retries == 2
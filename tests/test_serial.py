@@ -0,0 +1,63 @@
+import sys
+
+import pytest
+
+from science_jubilee.Machine import Machine
+from science_jubilee.utils.DuetEmulator import SerialDuetEmulator
+from science_jubilee.utils.SerialTransport import checksum, number_line
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="needs a POSIX pseudo-terminal"
+)
+
+
+@pytest.fixture
+def duet():
+    with SerialDuetEmulator(time_scale=0) as emulator:
+        yield emulator
+
+
+@pytest.fixture
+def machine(duet):
+    m = Machine(port=duet.port, deck_config="lab_automation_deck_AFL_bolton")
+    m.home_all()
+    yield m
+    m.disconnect()
+
+
+def test_number_line():
+    assert number_line(3, "G0 X10") == f"N3 G0 X10*{checksum('N3 G0 X10')}"
+
+
+def test_connect_and_move(duet, machine):
+    assert machine.configured_axes == ["X", "Y", "Z", "U", "V"]
+    machine.move_to(x=100, y=50, z=20)
+    machine.move(dx=5, dz=-2)
+    assert machine.sync_position()["X"] == "105.000"
+    assert machine.position == [105.0, 50.0, 18.0]
+
+
+def test_batches_stream_within_window(duet, machine):
+    # Each line takes a while to acknowledge, so the next ones are sent in the meantime
+    duet.interpreter.command_time = 0.02
+    replies = machine.gcode_many([f"G0 X{x}" for x in range(10)] + ["M114"])
+    assert replies[-1].startswith("X:9.000")
+    stats = machine.connection_stats
+    assert 1 < stats["max_in_flight"] <= machine.transport.window
+
+
+def test_corrupted_lines_are_resent(duet, machine):
+    next_line = machine.transport._line_number + 1
+    duet.corrupt_lines = {next_line, next_line + 3}
+    machine.gcode_many([f"G0 X{x}" for x in range(1, 7)])
+    assert duet.resends_requested == 2
+    assert machine.transport.resends == 2
+    assert machine.sync_position()["X"] == "6.000"
+
+
+def test_record_and_run_job(duet, machine):
+    with machine.record() as job:
+        machine.move_to(x=30, y=30)
+    machine.run_job(job, poll_interval=0.01)
+    assert duet.files["/gcodes/science_jubilee_job.g"] == job.text
+    assert machine.sync_position()["Y"] == "30.000"
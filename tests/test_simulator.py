@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+import pytest
+
+from science_jubilee.Machine import Machine, plan_travel
+from science_jubilee.tools.Pipette import Pipette
+from science_jubilee.utils.Simulator import KinematicSimulator
+
+
+def trapezoid(distance, speed, acceleration, rest_speed):
+    ramp = (speed**2 - rest_speed**2) / acceleration
+    return 2 * (speed - rest_speed) / acceleration + (distance - ramp) / speed
+
+
+def test_single_move_follows_axis_limits():
+    sim = KinematicSimulator(request_time=0)
+    sim.send("G1 X100 F6000\nM400")
+    # 100 mm/s cruise, 1100 mm/s^2, starting and stopping at the 1000 mm/min jerk
+    assert sim.elapsed == pytest.approx(trapezoid(100, 100, 1100, 1000 / 60))
+    sim.send("G1 Z10 F6000\nM400")  # Z is limited to 800 mm/min
+    assert sim.total.breakdown["move"] > sim.elapsed - 1e-9 > 10 / (800 / 60)
+
+
+def test_lookahead_joins_collinear_moves():
+    one = KinematicSimulator(request_time=0)
+    one.send("G1 X200 F6000")
+    many = KinematicSimulator(request_time=0)
+    many.send("\n".join(f"G1 X{x} F6000" for x in range(1, 201)))
+    assert many.elapsed == pytest.approx(one.elapsed)
+    corners = KinematicSimulator(request_time=0)
+    corners.send("\n".join(f"G1 X{200 * (i % 2)} F6000" for i in range(1, 5)))
+    assert corners.elapsed > 3 * one.elapsed
+
+
+def test_breakdown():
+    sim = KinematicSimulator(tool_change_time=8, homing_time=5, request_time=0.5)
+    sim.send("G28")
+    with sim.measure() as estimate:
+        sim.send("T1\nG4 P1500\nG1 X10")
+    assert estimate.breakdown["tool_change"] == 8
+    assert estimate.breakdown["dwell"] == 1.5
+    assert estimate.breakdown["requests"] == 0.5
+    assert estimate.moves == 1
+    assert sim.total.breakdown["homing"] == 5 * 5
+
+
+def test_simulated_machine_estimates_protocols():
+    m = Machine(simulated=True, deck_config="lab_automation_deck_AFL_bolton")
+    m.home_all()
+    assert m.axis_limits[2] == (0.0, 295.0)
+    tiprack = m.load_labware("opentrons_96_tiprack_300ul", 0)
+    plate = m.load_labware("corning_96_wellplate_360ul_flat", 1)
+    pipette = Pipette.from_config(1, "P300", "P300_config.json")
+    m.load_tool(pipette)
+    m.pickup_tool(pipette)
+    pipette.add_tiprack(tiprack)
+    pipette.trash = m.load_labware("agilent_1_reservoir_290ml", 2)[0]
+
+    with m.simulator.measure() as one:
+        pipette.transfer(50, plate["A1"], plate["B1"])
+    with m.simulator.measure() as two:
+        pipette.transfer(50, plate["A1"], [plate["B1"], plate["B2"]])
+    assert 0 < one.duration < two.duration
+
+    t = np.linspace(0, 2 * math.pi, 500)
+    points = np.c_[150 + 50 * np.cos(t), 150 + 50 * np.sin(t), np.full_like(t, 50)]
+    with m.simulator.measure() as path:
+        m.stream_path(points, s=3000)
+    at_feed = path.distance / (3000 / 60)
+    assert path.breakdown["move"] == pytest.approx(at_feed, rel=0.1)
+
+
+def test_plan_travel():
+    low = {"X": 0, "Y": 0, "Z": 5}
+    high = {"X": 0, "Y": 0, "Z": 150}
+    # Retract, travel, descend
+    assert plan_travel(low, x=10, y=20, z=2, clearance=50) == [
+        {"z": 70},
+        {"x": 10, "y": 20},
+        {"z": 2},
+    ]
+    # A target above the clearance is reached while travelling
+    assert plan_travel(low, x=10, y=20, z=60, clearance=50) == [
+        {"z": 70},
+        {"x": 10, "y": 20, "z": 60},
+    ]
+    # From high up, part of the descent happens while travelling
+    assert plan_travel(high, x=10, y=20, z=2, clearance=50) == [
+        {"x": 10, "y": 20, "z": 70},
+        {"z": 2},
+    ]
+    # Within the same well there is nothing to clear
+    assert plan_travel(low, x=0, z=20, clearance=50) == [{"z": 20}]
+    assert plan_travel(low, z=5, clearance=50) == []
+
+
+def test_travel_to_is_faster_than_separate_moves():
+    m = Machine(simulated=True, deck_config="lab_automation_deck_AFL_bolton")
+    m.home_all()
+    plate = m.load_labware("corning_96_wellplate_360ul_flat", 1)
+    m.move_to(x=0, y=0, z=0)
+
+    with m.simulator.measure() as separate:
+        m.safe_z_movement()
+        m.move_to(x=plate["A1"].x, y=plate["A1"].y)
+        m.move_to(z=plate["A1"].z)
+    m.move_to(x=0, y=0, z=0)
+    with m.simulator.measure() as planned:
+        m.travel_to(plate["A1"])
+    assert m.position == pytest.approx([plate["A1"].x, plate["A1"].y, plate["A1"].z])
+    assert planned.breakdown["requests"] < separate.breakdown["requests"]
+    assert planned.duration < separate.duration